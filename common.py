@@ -1,5 +1,11 @@
+import re
+import time
+import calendar
+import threading
 from enum import Enum
 from datetime import datetime
+from collections import OrderedDict
+from contextlib import contextmanager
 from dateutil import tz
 import dateparser
 
@@ -48,14 +54,81 @@ class Singleton(type):
         return self._instances[self]
 
 
+class LRUCache(object):
+    """A thread safe, size bounded, least recently used cache"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return self.get(key, None) is not None
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            value = self._items[key] = self._items.pop(key)
+            return value
+
+    def set(self, key, value=True):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._items.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class KeyLocks(object):
+    """Locks by key, the lock of a key is dropped once no thread holds or waits for it"""
+
+    def __init__(self):
+        self._locks = {}  # key -> [lock, number of holding and waiting threads]
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def lock(self, key):
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._locks)
+
+
 class Age(object):
 
     def __init__(self, datetime_obj):
-        self._datetime_obj = as_local_time(datetime_obj, raise_if_native_time=False)
+        """datetime_obj: datetime, timestamp string or epoch seconds"""
+        if isinstance(datetime_obj, (int, long, float)):
+            self._epoch = datetime_obj
+        else:
+            self._epoch = to_epoch(as_utc_time(datetime_obj))
 
     @property
     def total_seconds(self):
-        return int((datetime.now() - self._datetime_obj).total_seconds())
+        return int(time.time() - self._epoch)
 
     @property
     def days(self):
@@ -74,13 +147,80 @@ class Age(object):
         return '{} days and {} hours'.format(self.days, self.hours)
 
 
+def ages(times, now=None):
+    """Computing the Age json of many times (datetimes or epoch seconds) with a single clock read"""
+    now = time.time() if now is None else now
+    result = []
+    for time_obj in times:
+        if not isinstance(time_obj, (int, long, float)):
+            time_obj = to_epoch(as_utc_time(time_obj))
+        total_seconds = int(now - time_obj)
+        days = total_seconds / 86400
+        result.append({'days': days, 'hours': (total_seconds - days * 86400) / 3600,
+                       'total_seconds': total_seconds})
+    return result
+
+
+ISO_8601_PATTERN = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6})\d*)?(Z|[+-]\d{2}:?\d{2})?$')
+RFC_1123_PATTERN = re.compile(r'^\w{3}, (\d{2}) (\w{3}) (\d{4}) (\d{2}):(\d{2}):(\d{2}) GMT$')
+MONTHS = {month: index + 1 for index, month in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'))}
+UTC = tz.tzutc()
+
+
+def parse_time(text):
+    """Parsing a timestamp string. The ISO-8601 (Github API) and RFC 1123 (HTTP headers) formats
+    are parsed directly, other formats are parsed by dateparser.
+    Returns: datetime, timezone aware if the timestamp includes a timezone
+    """
+    match = ISO_8601_PATTERN.match(text)
+    if match:
+        year, month, day, hour, minute, second, fraction, zone = match.groups()
+        tzinfo = None
+        if zone == 'Z':
+            tzinfo = UTC
+        elif zone:
+            digits = zone[1:].replace(':', '')
+            offset = int(digits[:2]) * 3600 + int(digits[2:]) * 60
+            tzinfo = tz.tzoffset(None, -offset if zone[0] == '-' else offset)
+        return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second),
+                        int(fraction.ljust(6, '0')) if fraction else 0, tzinfo)
+    match = RFC_1123_PATTERN.match(text)
+    if match and match.group(2) in MONTHS:
+        day, month, year, hour, minute, second = match.groups()
+        return datetime(int(year), MONTHS[month], int(day), int(hour), int(minute), int(second), tzinfo=UTC)
+    return dateparser.parse(text)
+
+
+def to_epoch(datetime_obj):
+    """Converting the datetime to epoch seconds, naive datetimes are considered as UTC
+    (as the times of PyGithub and of the BSON dates)"""
+    return calendar.timegm(datetime_obj.utctimetuple()) + datetime_obj.microsecond / 1e6
+
+
+def from_epoch(seconds):
+    """Returns: the (naive) UTC time of the epoch seconds"""
+    return datetime.utcfromtimestamp(seconds)
+
+
+def as_utc_time(datetime_obj):
+    """Converting the datetime object (or timestamp string) to naive UTC time,
+    naive datetimes are considered as UTC"""
+    if isinstance(datetime_obj, basestring):
+        datetime_obj = parse_time(datetime_obj)
+    if datetime_obj.tzinfo:
+        return datetime_obj.astimezone(UTC).replace(tzinfo=None)
+    return datetime_obj
+
+
 def as_local_time(datetime_obj, tzinfo=None, raise_if_native_time=True):
     """Converting the datetime object to local time
     if raise_if_native_time: Raises ValueError: astimezone() cannot be applied to
                              a naive datetime  if provided datetime_obj with tzinfo=None
     """
     if isinstance(datetime_obj, basestring):
-        datetime_obj = dateparser.parse(datetime_obj)
+        datetime_obj = parse_time(datetime_obj)
     if not datetime_obj.tzinfo and not raise_if_native_time:
         return datetime_obj
     local_dt = datetime_obj.astimezone(tz.tzlocal())
@@ -92,7 +232,7 @@ def skip_if_testing_mode(func, *args, **kwargs):
     from config import config
 
     def decorated(self, *args, **kwargs):
-        if config().config.testing_mode:
+        if config().snapshot.testing_mode:
             GlobalLogger.info('Skipping function "{}" - running in testing mode.'.format(func.__name__))
             return
         return func(self, *args, **kwargs)
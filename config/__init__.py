@@ -1,31 +1,152 @@
 import os
+import re
+import time
+import logging
+import threading
+
 import yaml
 
 from common import AttributeDict, Singleton
 
 
+logging.basicConfig()
+logger = logging.getLogger('ConfigLogger')
+logger.setLevel(logging.INFO)
+
+
+class FrozenAttributeDict(AttributeDict):
+    """An immutable AttributeDict"""
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('The config snapshot is immutable')
+
+    __setattr__ = __setitem__ = __delitem__ = _immutable
+    update = setdefault = pop = popitem = clear = _immutable
+
+    @classmethod
+    def freeze(cls, obj):
+        """Returns: an immutable copy of the parsed yaml <obj> (the lists are converted to tuples)"""
+        if isinstance(obj, dict):
+            return cls((key, cls.freeze(value)) for key, value in obj.items())
+        elif isinstance(obj, (list, tuple)):
+            return tuple(cls.freeze(value) for value in obj)
+        return obj
+
+
+class ConfigSnapshot(object):
+    """An immutable snapshot of the config files.
+    The values that are used on hot paths are precompiled:
+        * title_tag_pattern: the compiled pattern of the pull request title tags.
+        * title_tag_format: the format of a pull request title tag.
+        * testing_mode: whether to skip the actions.
+        * repos: dict of (organization, repository) -> the repository config.
+        * reviewer_levels: dict of (organization, repository) -> {login: level}.
+    """
+
+    def __init__(self, data, mtimes):
+        github = data['config'].github
+        title_tag = github.pull_request_title_tag
+        object.__setattr__(self, '_data', data)
+        object.__setattr__(self, 'mtimes', mtimes)
+        object.__setattr__(self, 'title_tag_pattern', re.compile(title_tag.pattern))
+        object.__setattr__(self, 'title_tag_format', title_tag.format)
+        object.__setattr__(self, 'testing_mode', bool(data['config'].get('testing_mode')))
+        object.__setattr__(self, 'repos', FrozenAttributeDict(((repo.org, repo.repo), repo) for repo in github.repos))
+        object.__setattr__(self, 'reviewer_levels', FrozenAttributeDict(
+            (key, FrozenAttributeDict((login, level + 1)
+                                      for level, logins in enumerate(repo.get('reviewers') or ())
+                                      for login in logins))
+            for key, repo in self.repos.items()))
+
+    def __setattr__(self, name, value):
+        raise TypeError('The config snapshot is immutable')
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __getattr__(self, name):
+        try:
+            return self._data[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
 class config(object):
+    """The config files (config.yaml and credentials.yaml).
+    The files are loaded into an immutable snapshot (see ConfigSnapshot) which is swapped when the files
+    are changed on disk, the modification times are checked at most every CHECK_INTERVAL seconds.
+    A snapshot that fails to load is skipped and the previous snapshot is kept.
+    The callbacks registered by on_reload() are called with the (old, new) snapshots after every reload.
+    """
 
     __metaclass__ = Singleton
     DIR = os.path.dirname(__file__)
     CONFIG_FILES = ('config.yaml', 'credentials.yaml')
+    CHECK_INTERVAL = 5
 
     def __init__(self, *args, **kwargs):
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._snapshot = None
+        self._seen_mtimes = None
+        self._next_check = time.time() + self.CHECK_INTERVAL
         self.reload()
 
-    def reload(self):
-        self._data = AttributeDict()
+    @property
+    def snapshot(self):
+        if time.time() >= self._next_check:
+            self.check()
+        return self._snapshot
+
+    def on_reload(self, callback):
+        self._callbacks.append(callback)
+
+    def _mtimes(self):
+        mtimes = []
         for p in self.CONFIG_FILES:
-            conf_name = os.path.splitext(p)[0]
             fp = os.path.join(self.DIR, p)
             if not os.path.exists(fp):
                 raise IOError('Config file does not exist, please generate it as '
                               '{} from the template.'.format(fp))
-            with open(fp, 'r') as confile:
-                self._data[conf_name] = AttributeDict.attributize_dict(yaml.load(confile))
+            mtimes.append(os.path.getmtime(fp))
+        return tuple(mtimes)
+
+    def check(self):
+        """Reloading the config if any of the files was changed.
+        Returns: whether the config was reloaded"""
+        self._next_check = time.time() + self.CHECK_INTERVAL
+        try:
+            changed = self._mtimes() != self._seen_mtimes
+        except (IOError, OSError):
+            logger.exception('Could not check the config files')
+            return False
+        if not changed:
+            return False
+        try:
+            self.reload()
+        except Exception:
+            logger.exception('Failed to reload the config, keeping the previous config')
+            return False
+        return True
+
+    def reload(self):
+        with self._lock:
+            self._seen_mtimes = mtimes = self._mtimes()
+            data = {}
+            for p in self.CONFIG_FILES:
+                with open(os.path.join(self.DIR, p), 'r') as confile:
+                    data[os.path.splitext(p)[0]] = yaml.load(confile)
+            old, self._snapshot = self._snapshot, ConfigSnapshot(FrozenAttributeDict.freeze(data), mtimes)
+        if old is not None:
+            logger.info('Config reloaded')
+            for callback in self._callbacks:
+                try:
+                    callback(old, self._snapshot)
+                except Exception:
+                    logger.exception('Config reload callback failed')
 
     def __getitem__(self, key):
-        return self._data[key]
+        return self.snapshot[key]
 
     def __getattribute__(self, name):
         try:
@@ -1,20 +1,22 @@
 # -*- coding: utf-8 -*-
-import md5
-import smtplib
+import time
 import logging
-from email import encoders
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email.utils import COMMASPACE, formatdate
+import threading
+from multiprocessing.pool import ThreadPool
 
 from config import config
-from common import Singleton
-from nudgebot.lib.actions import Action, RUN_TYPES
+from common import Singleton, LRUCache, KeyLocks
+from nudgebot.lib.actions import RUN_TYPES
 from nudgebot.db import db
 from nudgebot.lib.github.pull_request_statistics import PullRequestStatistics
 from nudgebot.flow import FLOW
+from nudgebot.lib.flow_plan import FlowPlan
 from nudgebot.lib.github import GithubEnv
+from nudgebot.review_metrics import ReviewMetrics
+from nudgebot.mailer import Mailer
+from nudgebot.outbox import ActionOutbox, OutboxBatch
+from nudgebot.lib.github.ci_statuses import CIStatuses
+from nudgebot.lib.github.event_deltas import EventDelta
 
 
 logging.basicConfig()
@@ -28,101 +30,251 @@ class NudgeBot(object):
 
     def __init__(self):
         self._email_addr = config().credentials.email.address
+        self.mailer = Mailer.from_config(self._email_addr)
+        # The evaluations of the same pull request are serialized, the other pull requests are evaluated concurrently
+        self._pr_locks = KeyLocks()
+        self._local = threading.local()
+        deltas_config = config().config.get('event_deltas', {})
+        self.max_statistics_age = deltas_config.get('max_age_seconds', 3600)
+        # (repository, number) -> (time, statistics) of the recently processed pull requests
+        self._pr_statistics = LRUCache(deltas_config.get('cached_pull_requests', 100))
+        self._flow_plan = FlowPlan.compile(FLOW)
+        self.flow_stats = self._flow_plan.stats
+        self.outbox = ActionOutbox()
+        self.outbox.on_failure(self._outbox_failed)
 
-    def send_email(self, receivers, subject, body, attachments=None, text_format='plain'):
-        logger.info('Sending Email to {}; subject="{}"'.format(receivers, subject))
-        """Sending the message <body> to the <recievers>"""
-        if isinstance(receivers, basestring):
-            receivers = [receivers]
-        msg = MIMEMultipart()
-        msg['From'] = self._email_addr
-        msg['To'] = COMMASPACE.join(receivers)
-        msg['Date'] = formatdate(localtime=True)
-        msg['Subject'] = subject
-
-        msg.attach(MIMEText(body, text_format))
-        if attachments:
-            for attachment in attachments:
-                with open(attachment, "rb") as attachment_file:
-                    part = MIMEBase('application', 'octet-stream')
-                    part.set_payload(attachment_file.read())
-                    encoders.encode_base64(part)
-                    part.add_header('Content-Disposition', "attachment; filename= {}"
-                                    .format(attachment))
-                    msg.attach(part)
-
-        smtp_server = smtplib.SMTP('localhost')
-        smtp_server.sendmail(self._email_addr, receivers, msg.as_string())
-
-    def _process_flow(self, pr_stats, tree, cases_properties=None, cases_checksum=None):
-        if not cases_checksum:
-            cases_checksum = md5.new()
-        if cases_properties is None:
-            cases_properties = []
-        if isinstance(tree, dict):
-            for case, node in tree.items():
-                case.load_pr_statistics(pr_stats)
-                if case.state:
-                    cases_checksum.update(case.hash)
-                    cases_properties.append(case.properties)
-                    self._process_flow(pr_stats, node, cases_properties, cases_checksum)
-        elif isinstance(tree, (list, tuple)):
-            for action in tree:
-                self._process_flow(pr_stats, action, cases_properties, cases_checksum)
-        elif isinstance(tree, Action):
-            action = tree
-            action.load_pr_statistics(pr_stats)
-            is_done = ([record for record in db().records.find({
-                           'cases_checksum': cases_checksum.hexdigest(),
-                           'action.checksum': action.hash})
-                        ])
-            if not is_done or action.run_type == RUN_TYPES.ALWAYS:
-                action.run()
-                db().add_record(cases_properties, cases_checksum.hexdigest(), action)
+    @property
+    def flow_plan(self):
+        """The flow plan of the current thread (see FlowPlan.copy)"""
+        plan = getattr(self._local, 'flow_plan', None)
+        if plan is None:
+            plan = self._local.flow_plan = self._flow_plan.copy()
+        return plan
+
+    def send_email(self, receivers, subject, body, attachments=None, text_format='plain', digest=False):
+        """Queuing the message <body> to the <recievers>, the message is sent in the background.
+        Messages with <digest> are coalesced with the other messages to the receiver (see Mailer)"""
+        logger.info('Queuing Email to {}; subject="{}"'.format(receivers, subject))
+        self.mailer.send(receivers, subject, body, attachments, text_format, digest)
+
+    def _outbox_failed(self, pr_key):
+        """The previewed statistics of the pull request are wrong once its actions failed,
+        the next event of the pull request rebuilds them from Github"""
+        self._pr_statistics.pop((pr_key['repository'], pr_key['number']))
+        db().patch_pr_stats(pr_key['repository'], pr_key['number'], {'stale': True})
 
     def process(self,  pull_request_stats):
-        logger.info('Processing pull request statistics: {}'.format(pull_request_stats.number))
-        return self._process_flow(pull_request_stats, FLOW)
+        logger.info('Processing pull request statistics: {}'.format(pull_request_stats.number()))
+        pull_request_stats.prefetch()
+        pr_key = pull_request_stats.key()
+        start = time.time()
+        with self._pr_locks.lock((pr_key['repository'], pr_key['number'])):
+            # Loading all the action records of the pull request at once, the actions that are still in the
+            # outbox are considered as done. The records are committed once the actions were executed.
+            done_actions = db().get_done_actions(pr_key) | self.outbox.get_pending(pr_key)
+            batch = OutboxBatch(pull_request_stats)
+
+            def run_action(action, cases_properties, cases_checksum):
+                done_key = (cases_checksum, action.hash)
+                is_done = done_key in done_actions or db().claim_legacy_action(pr_key, done_key)
+                if is_done and action.run_type != RUN_TYPES.ALWAYS:
+                    return False
+                operations = action.prepare() or []
+                done_actions.add(done_key)
+                batch.add(operations, done_key, db().create_record(pr_key, cases_properties, cases_checksum, action))
+                return True
+
+            try:
+                self.flow_plan.evaluate(pull_request_stats, run_action)
+            finally:
+                self.outbox.submit(batch)
+                pull_request_stats.repo().reviewers_pool.flush()
+        logger.info('Evaluated the flow of pull request #{} in {:.2f}ms ({} actions, {} queued operations)'.format(
+            pull_request_stats.number(), (time.time() - start) * 1000, batch.actions, len(batch.operations)))
 
     def initialize(self):
-        # TODO: deal with socket.timeout
-        db().set_initialization_time()
+        """Initializing all the open pull requests of the repositories in parallel.
+        The progress is checkpointed so an interrupted initialization resumes where it stopped.
+        """
+        if db().initialization_done or not db().initialization_time:
+            db().set_initialization_time()
+            db().clear_initialization_progress()
+        else:
+            logger.info('Resuming interrupted initialization...')
+        db().set_initialization_done(False)
         logger.info('Initializing NudgeBot...')
-        for repo in GithubEnv().repos:
-            repo.reviewers_pool.initialize()
-            for pr in repo.get_pull_requests():
+        init_config = config().config.get('initialization', {})
+        pool = ThreadPool(init_config.get('workers', 8))
+        succeeded = True
+        try:
+            for repo in GithubEnv().repos:
+                repo.reviewers_pool.initialize()
+                succeeded &= self._initialize_repository(repo, pool, init_config.get('bulk_size', 50))
+        finally:
+            pool.close()
+        if succeeded:
+            db().set_initialization_done()
+        else:
+            logger.error('Some pull requests failed to initialize, they will be retried on the next start.')
+
+    def _initialize_repository(self, repo, pool, bulk_size):
+        """Returns: whether all the pull requests of the repository were initialized"""
+        initialized = db().get_initialized_pull_requests(repo.full_name)
+        pull_requests = [pr for pr in repo.get_pull_requests() if pr.number not in initialized]
+        logger.info('Initializing {} pull requests of repository "{}" ({} already initialized)...'.format(
+            len(pull_requests), repo.name, len(initialized)))
+        lock, start = threading.Lock(), time.time()
+        progress = {'stats': [], 'done': 0, 'failed': 0}
+
+        def flush():
+            stats, progress['stats'] = progress['stats'], []
+            db().update_pr_stats_many(stats)
+            db().add_initialized_pull_requests(repo.full_name, [stat['number'] for stat in stats])
+            logger.info('Initialized {}/{} pull requests of repository "{}" ({:.2f} pull requests/sec)'.format(
+                progress['done'], len(pull_requests), repo.name, progress['done'] / (time.time() - start)))
+
+        def initialize_pull_request(pr):
+            try:
                 pr_stat = PullRequestStatistics(pr)
                 self.process(pr_stat)
-                db().update_pr_stats(pr_stat.get_json())
+                data = pr_stat.get_json()
+            except Exception:
+                logger.exception('Failed to initialize pull request #{}'.format(pr.number))
+                with lock:
+                    progress['failed'] += 1
+                return
+            with lock:
+                progress['stats'].append(data)
+                progress['done'] += 1
+                if len(progress['stats']) >= bulk_size:
+                    flush()
+
+        pool.map(initialize_pull_request, pull_requests)
+        with lock:
+            flush()
+        return not progress['failed']
 
-    def _fetch_pr_number(self, json_data):
+    def fetch_pr_number(self, json_data):
         pull_request_number = json_data.get('pull_request', {}).get('number')
         issue = json_data.get('issue', {})
         if not pull_request_number and issue.get('pull_request'):
             pull_request_number = issue.get('number')
+        if not pull_request_number and CIStatuses.parse_event(json_data):
+            # CI status events are mapped to the pull request by its head sha
+            repository = json_data.get('repository', {})
+            pull_request_number = db().find_pr_number_by_head_sha(
+                repository.get('owner', {}).get('login'), repository.get('name'), CIStatuses.parse_event(json_data)[0])
         return pull_request_number
 
-    def process_github_event(self, json_data):
+    def is_bot_event(self, json_data):
         sender = json_data['sender']['login']
-        logger.info('Processing Github event: sender="{}"'.format(sender))
         if sender == config().credentials.github.username:
             logging.info('Event detected as Bot event (sender="{}")'.format(sender))
-            return  # In order the prevent recursion when the bot perform action and invoke webhook
+            return True  # In order the prevent recursion when the bot perform action and invoke webhook
+        return False
+
+    def process_github_events(self, json_datas):
+        """Processing coalesced events of the same pull request.
+        The events are applied to the statistics one by one (see EventDelta) and the flow is evaluated
+        once, after the last event. If any of the events could not be applied, the pull request
+        statistics are rebuilt from Github instead.
+        """
+        json_datas = [json_data for json_data in json_datas if not self.is_bot_event(json_data)]
+        if json_datas:
+            return self._process_events(json_datas)
+
+    def record_event(self, repository_name, json_data):
+        """Applying the event to the review metrics and to the stored CI statuses"""
+        try:
+            ReviewMetrics().record(repository_name, json_data)
+        except Exception:
+            logger.exception('Failed to update the review metrics by the event')
+        try:
+            CIStatuses().apply_event(repository_name, json_data)
+        except Exception:
+            logger.exception('Failed to update the CI statuses by the event')
+
+    def process_github_event(self, json_data):
+        sender = json_data['sender']['login']
+        logger.info('Processing Github event: sender="{}"'.format(sender))
+        if self.is_bot_event(json_data):
+            return
+        return self._process_events([json_data])
+
+    def _process_events(self, json_datas):
         repository = [repo for repo in GithubEnv().repos
-                      if repo.name == json_data.get('repository', {}).get('name')].pop()
-        pull_request_number = self._fetch_pr_number(json_data)
-        if pull_request_number:
-            logging.info('event data: pr#{}; sender="{}"'.format(
-                pull_request_number, sender))
-            pr = repository.get_pull_request(pull_request_number)
-            pr_stat = PullRequestStatistics(pr)
-            repository.reviewers_pool.update_from_pr_stats(pr_stat)
-            if pr.state != 'open':
-                logger.info('Pull request state is "{}": removing statistics...'.format(pr.state))
-                db().remove_pr_stats(pull_request_number)
-                return
+                      if repo.name == json_datas[-1].get('repository', {}).get('name')].pop()
+        pull_request_number = self.fetch_pr_number(json_datas[-1])
+        changed, stale, refresh = set(), set(), False
+        for json_data in json_datas:
+            self.record_event(repository.name, json_data)
+            if pull_request_number and not refresh:
+                delta = self.apply_event_delta(repository, pull_request_number, json_data)
+                if delta is None:
+                    refresh = True
+                else:
+                    changed.update(delta[0])
+                    stale.update(delta[1])
+        if not pull_request_number:
+            logger.info('Event detected as non pull request event...')
+        elif refresh:
+            self.refresh_pull_request(repository, pull_request_number)
+        else:
+            self.update_pull_request(repository, pull_request_number, changed, stale)
+
+    def apply_event_delta(self, repository, pull_request_number, json_data):
+        """Patching the stored and the in-memory statistics of the pull request by the event.
+        Returns: (the changed stats, the stored stats that were not patched)
+                 or None if the statistics have to be refreshed"""
+        delta = EventDelta.parse(json_data)
+        logger.info('Event of pull request #{}: {}'.format(pull_request_number, delta))
+        if delta.refresh:
+            return None
+        fields, max_fields = delta.get_fields(repository.name)
+        stored = db().patch_pr_stats(repository.name, pull_request_number, fields, max_fields)
+        if stored is None or stored.get('stale'):
+            return None  # The statistics of the pull request were not stored yet or the actions failed
+        cached = self._pr_statistics.get((repository.name, pull_request_number))
+        if cached:
+            delta.apply(cached[1])
+        changed = delta.changed_stats
+        stale = changed.intersection(PullRequestStatistics.STORED_STATS) - set(fields) - set(max_fields)
+        return changed, stale
+
+    def update_pull_request(self, repository, pull_request_number, changed, stale):
+        """Evaluating the flow if any of the <changed> stats affects it and storing the <stale> stats"""
+        evaluate = self.flow_stats is None or bool(self.flow_stats.intersection(changed))
+        if not evaluate and not stale:
+            logger.info('The event does not affect the flow of pull request #{}'.format(pull_request_number))
+            return
+        key = (repository.name, pull_request_number)
+        cached = self._pr_statistics.get(key)
+        if not cached or time.time() - cached[0] > self.max_statistics_age:
+            return self.refresh_pull_request(repository, pull_request_number)
+        pr_stat = cached[1]
+        pr_stat.invalidate(*PullRequestStatistics.VOLATILE_STATS)
+        repository.reviewers_pool.update_from_pr_stats(pr_stat)
+        if evaluate:
             self.process(pr_stat)
-            # TODO: Find away to 'un-cache' the object so we will not have to re-instantiate
-            db().update_pr_stats(pr_stat.get_json())
         else:
-            logger.info('Event detected as non pull request event...')
+            pr_stat.prefetch()
+            repository.reviewers_pool.flush()
+        db().update_pr_stats(pr_stat.get_json())
+
+    def refresh_pull_request(self, repository, pull_request_number):
+        """Rebuilding the statistics of the pull request from Github and evaluating the flow"""
+        logging.info('Refreshing pull request #{}'.format(pull_request_number))
+        key = (repository.name, pull_request_number)
+        pr = repository.get_pull_request(pull_request_number)
+        pr_stat = PullRequestStatistics(pr)
+        pr_stat.prefetch()
+        repository.reviewers_pool.update_from_pr_stats(pr_stat)
+        if pr.state != 'open':
+            logger.info('Pull request state is "{}": removing statistics...'.format(pr.state))
+            self._pr_statistics.pop(key)
+            repository.reviewers_pool.flush()
+            db().remove_pr_stats(pull_request_number, repository.name, repository.owner.login)
+            return
+        self.process(pr_stat)
+        db().update_pr_stats(pr_stat.get_json())
+        self._pr_statistics.set(key, (time.time(), pr_stat))
@@ -1,3 +1,4 @@
+import json
 import argparse
 
 import github
@@ -16,6 +17,20 @@ dump_db_parser.add_argument('--filename', '-f', help='The file path to dump the
 clear_db_parser = subparsers.add_parser('clear_db', help='Clearing all the DB content (DANGER)')
 clear_db_parser.add_argument('--force', '-f', dest='force', help='Force operation (without prompt)',
                              action='store_true', default=False)
+simulate_flow_parser = subparsers.add_parser(
+    'simulate_flow', help='Evaluating a flow against the stored pull request statistics (without running the actions)')
+simulate_flow_parser.add_argument('--flow', default='nudgebot.flow:FLOW',
+                                  help='The flow to simulate (<module>:<attribute>)')
+simulate_flow_parser.add_argument('--files', nargs='+', default=None,
+                                  help='JSON files of pull request statistics to use instead of the DB')
+simulate_flow_parser.add_argument('--repository', '-r', default=None, help='Simulating only this repository')
+simulate_flow_parser.add_argument('--limit', type=int, default=0, help='The maximum number of pull requests')
+simulate_flow_parser.add_argument('--processes', '-p', type=int, default=None,
+                                  help='The number of processes (defaults to the number of CPUs)')
+simulate_flow_parser.add_argument('--skip-done', dest='skip_done', action='store_true', default=False,
+                                  help='Not listing the actions that were already done (by the DB records)')
+simulate_flow_parser.add_argument('--save', default=None,
+                                  help='Saving the pull request statistics to a JSON file (for --files)')
 
 
 if config().config.debug_mode:
@@ -30,6 +45,19 @@ def parse_command(namespace):
         celery_app.worker_main(['--loglevel=info', '--beat'])
     elif namespace.operation == 'dump_db':
         print(db().dump(namespace.filename))
+    elif namespace.operation == 'simulate_flow':
+        from nudgebot import simulation
+        snapshots = simulation.load_snapshots(namespace.files, namespace.repository, namespace.limit)
+        if namespace.save:
+            with open(namespace.save, 'w') as snapshots_file:
+                json.dump(snapshots, snapshots_file)
+        done_actions = {}
+        if namespace.skip_done:
+            for snapshot in snapshots:
+                key = {k: snapshot[k] for k in ('organization', 'repository', 'number')}
+                done_actions[(snapshot['repository'], snapshot['number'])] = db().get_done_actions(key)
+        simulation.print_simulation(simulation.simulate_flow(
+            simulation.load_flow(namespace.flow), snapshots, namespace.processes, done_actions))
     elif namespace.operation == 'clear_db':
         if namespace.force:
             db().clear_db()
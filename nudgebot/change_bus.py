@@ -0,0 +1,61 @@
+import Queue
+import logging
+import threading
+
+from common import Singleton
+
+
+logging.basicConfig()
+logger = logging.getLogger('ChangeBusLogger')
+logger.setLevel(logging.INFO)
+
+
+class Subscription(object):
+    """A subscription to the change bus, the changes are (kind, data) tuples"""
+
+    def __init__(self, max_pending):
+        self._changes = Queue.Queue(max_pending)
+        self.closed = False
+
+    def put(self, change):
+        self._changes.put_nowait(change)
+
+    def get(self, timeout=None):
+        """Returns: the next change or None if there was no change within the timeout"""
+        try:
+            return self._changes.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+
+
+class ChangeBus(object):
+    """An in-process publish/subscribe bus of the statistics changes.
+    Publishing never blocks, subscribers that fall behind by more than MAX_PENDING changes are dropped.
+    """
+    __metaclass__ = Singleton
+    MAX_PENDING = 1000
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        subscription = Subscription(self.MAX_PENDING)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscription.closed = True
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, kind, data):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.put((kind, data))
+            except Queue.Full:
+                logger.warning('Dropping a subscription that fell behind the change bus')
+                self.unsubscribe(subscription)
@@ -2,9 +2,12 @@ import pprint
 import logging
 from datetime import datetime
 
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReplaceOne, UpdateOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 
-from common import Singleton
+from config import config
+from common import Singleton, to_epoch
+from nudgebot.change_bus import ChangeBus
 from bson import _ENCODERS as bson_encoders
 
 
@@ -16,6 +19,10 @@ logger.setLevel(logging.INFO)
 class db(object):  # noqa
     __metaclass__ = Singleton
     bson_types = tuple(bson_encoders.keys())
+    PR_STATS_KEY = ('organization', 'repository', 'number')
+    PR_STATS_TIMES = ('age', 'last_update')  # Stored as epoch seconds
+    DELIVERED_EVENTS_TTL_DAYS = 14
+    CI_STATUSES_TTL_DAYS = 30
 
     def __init__(self):
         self.client = MongoClient()
@@ -26,11 +33,45 @@ class db(object):  # noqa
         self.pr_stats = self.client.db.pr_stats
         self.reviewers_pool = self.client.db.reviewers_pool
         self.metadata = self.client.db.metadata
+        self.github_cache = self.client.db.github_cache
+        self.delivered_events = self.client.db.delivered_events
+        self.events_cursors = self.client.db.events_cursors
+        self.initialization_progress = self.client.db.initialization_progress
+        self.review_metrics = self.client.db.review_metrics
+        self.review_milestones = self.client.db.review_milestones
+        self.pr_commits = self.client.db.pr_commits
+        self.diffs = self.client.db.diffs
+        self.ci_statuses = self.client.db.ci_statuses
+        self.records.create_index([('organization', ASCENDING), ('repository', ASCENDING), ('number', ASCENDING)])
+        self._index_legacy_records()
         if not self.metadata.find_one():
             self.metadata.insert_one({
                 'init_time': None,
-                'delivered_github_events': []
+                'utc_epoch_times': True
             })
+        self._create_pr_stats_index()
+        self._migrate_local_epoch_times()
+        self._migrate_pr_stats_times()
+        self.initialization_progress.create_index([('repository', ASCENDING), ('number', ASCENDING)], unique=True)
+        for field in ('title_tags', 'reviewers', 'owner', 'last_update', 'age'):
+            self.pr_stats.create_index([(field, ASCENDING)])
+        self._migrate_reviewers_keys()
+        self.reviewers_pool.create_index([('organization', ASCENDING), ('repository', ASCENDING),
+                                          ('login', ASCENDING)], unique=True)
+        self.reviewers_pool.create_index([('organization', ASCENDING), ('repository', ASCENDING),
+                                          ('level', ASCENDING), ('load', ASCENDING)])
+        self._migrate_reviewers_pool()
+        self._create_delivered_events_indexes()
+        self.review_metrics.create_index([('repository', ASCENDING), ('reviewer', ASCENDING),
+                                          ('granularity', ASCENDING), ('bucket', ASCENDING)], unique=True)
+        self.review_metrics.create_index([('expire_at', ASCENDING)], expireAfterSeconds=0)
+        self.review_milestones.create_index([('repository', ASCENDING), ('number', ASCENDING)], unique=True)
+        self._migrate_pr_commits()
+        self.pr_commits.create_index([(key, ASCENDING) for key in self.PR_STATS_KEY], unique=True)
+        self.pr_commits.create_index([('organization', ASCENDING), ('repository', ASCENDING), ('head_sha', ASCENDING)])
+        self.ci_statuses.create_index([('repository', ASCENDING), ('sha', ASCENDING), ('context', ASCENDING)],
+                                      unique=True)
+        self.ci_statuses.create_index([('datetime', ASCENDING)], expireAfterSeconds=self.CI_STATUSES_TTL_DAYS * 86400)
 
     def close(self):
         self.metadata.close()
@@ -54,19 +95,244 @@ class db(object):  # noqa
             result = str(node)
         return result
 
-    def get_reviewers_pool(self):
-        return self.reviewers_pool.find_one({}, {'_id': False})
+    def _migrate_reviewers_pool(self):
+        """Expanding the reviewers pool that used to be stored in a single document (login -> level and pull
+        requests, shared by all the repositories) into the reviewer documents of the configured repositories"""
+        legacy = self.reviewers_pool.find_one({'login': {'$exists': False}})
+        if not legacy:
+            return
+        logger.info('Migrating the reviewers pool to per reviewer documents...')
+        updates = []
+        for (org, repo), levels in config().snapshot.reviewer_levels.items():
+            numbers = {stat['number'] for stat in self.pr_stats.find({'organization': org, 'repository': repo},
+                                                                     {'number': True})}
+            for login, level in levels.items():
+                pull_requests = [number for number in (legacy.get(login) or {}).get('pull_requests', [])
+                                 if number in numbers]
+                updates.append(UpdateOne({'organization': org, 'repository': repo, 'login': login}, {'$setOnInsert': {
+                    'level': level, 'pull_requests': pull_requests, 'load': len(pull_requests)}}, upsert=True))
+        if updates:
+            self.reviewers_pool.bulk_write(updates)
+        self.reviewers_pool.delete_one({'_id': legacy['_id']})
+
+    def _migrate_reviewers_keys(self):
+        """The reviewer documents used to be keyed by the full name of the repository (<organization>/<name>),
+        they are keyed by the organization and the repository name like the pull request statistics"""
+        indexes = self.reviewers_pool.index_information()
+        for name in ('repository_1_login_1', 'repository_1_level_1_load_1'):
+            if name in indexes:
+                self.reviewers_pool.drop_index(name)
+        updates = []
+        for doc in self.reviewers_pool.find({'repository': {'$regex': '/'}}, {'repository': True}):
+            organization, repository = doc['repository'].split('/', 1)
+            updates.append(UpdateOne({'_id': doc['_id']},
+                                     {'$set': {'organization': organization, 'repository': repository}}))
+        if updates:
+            logger.info('Keying the reviewers pool by the organization and the repository name...')
+            self.reviewers_pool.bulk_write(updates)
+
+    def get_reviewers_pool(self, organization=None, repository=None, sort=None):
+        """Returns: list of the reviewer documents (of the repository if provided)"""
+        query = {'organization': organization, 'repository': repository} if repository else {}
+        cursor = self.reviewers_pool.find(query, {'_id': False})
+        if sort:
+            cursor = cursor.sort(sort)
+        return list(cursor)
+
+    def group_reviewers_pool(self):
+        """Returns: list of (login, {'pull_requests': <count>, 'load': <load>}) of the reviewers over all the
+        repositories, sorted by the load"""
+        pipeline = [
+            {'$group': {'_id': '$login', 'pull_requests': {'$sum': {'$size': '$pull_requests'}},
+                        'load': {'$sum': '$load'}}},
+            {'$sort': {'load': ASCENDING, '_id': ASCENDING}}
+        ]
+        return [(doc.pop('_id'), doc) for doc in self.reviewers_pool.aggregate(pipeline)]
+
+    @staticmethod
+    def set_reviewer_level(organization, repository, login, level):
+        """Returns: the update operation of the reviewer level (for update_reviewers)"""
+        return UpdateOne({'organization': organization, 'repository': repository, 'login': login},
+                         {'$set': {'level': level}, '$setOnInsert': {'pull_requests': [], 'load': 0}},
+                         upsert=True)
+
+    @staticmethod
+    def attach_pr_to_reviewer(organization, repository, login, pull_request_number, detach=False):
+        """Returns: the atomic update operation that attaches (or detaches) the pull request to the
+        reviewer and updates the reviewer load (for update_reviewers)"""
+        key = {'organization': organization, 'repository': repository, 'login': login}
+        if detach:
+            return UpdateOne(dict(key, pull_requests=pull_request_number),
+                             {'$pull': {'pull_requests': pull_request_number}, '$inc': {'load': -1}})
+        return UpdateOne(dict(key, pull_requests={'$ne': pull_request_number}),
+                         {'$addToSet': {'pull_requests': pull_request_number}, '$inc': {'load': 1}})
+
+    def update_reviewers(self, updates):
+        if updates:
+            self.reviewers_pool.bulk_write(updates)
+            self.bump_stats_version()
+
+    @property
+    def stats_version(self):
+        """A counter that is incremented on every change of the statistics or the reviewers pool"""
+        return self.metadata.find_one({}, {'stats_version': True}).get('stats_version', 0)
+
+    def bump_stats_version(self):
+        self.metadata.update_one({}, {'$inc': {'stats_version': 1}})
+
+    def find_pr_stats(self, query=None, projection=None, sort=None, skip=0, limit=0):
+        """Finding pull request statistics
+        Args:
+            * query: (dict) the mongo query.
+            * projection: (list) the fields to return (all if not provided).
+            * sort: (list) of (field, descending) tuples.
+            * skip, limit: pagination.
+        Returns: (total count, list of statistics)
+        """
+        projection = dict({field: True for field in projection or []}, _id=False)
+        cursor = self.pr_stats.find(query or {}, projection)
+        if sort:
+            cursor = cursor.sort([(field, DESCENDING if descending else ASCENDING) for field, descending in sort])
+        total = cursor.count()
+        return total, list(cursor.skip(skip).limit(limit))
 
     @property
     def pull_request_statistics(self):
         return [prs for prs in self.pr_stats.find({}, {'_id': False})]
 
-    @property
-    def delivered_github_events(self):
-        return self.metadata.find_one()['delivered_github_events']
+    def group_pr_stats(self, field, match=None, push=None):
+        """Grouping the pull request statistics by the <field> (array fields are unwound)
+        Args:
+            * field: the field to group by.
+            * match (optional): a query to filter the statistics and the unwound values with.
+            * push (optional): fields of the statistics to collect for each group.
+        Returns: dict of value -> {'count': <count>, 'total_review_comments': <sum>, 'pull_requests': [...]}
+        """
+        pipeline = []
+        if match:
+            pipeline.append({'$match': match})
+        pipeline += [{'$unwind': '$' + field}] if field in ('title_tags', 'reviewers') else []
+        if match and field in match:
+            pipeline.append({'$match': {field: match[field]}})
+        group = {'_id': '$' + field, 'count': {'$sum': 1},
+                 'total_review_comments': {'$sum': '$total_review_comments'}}
+        if push:
+            group['pull_requests'] = {'$push': {key: '$' + key for key in push}}
+        pipeline.append({'$group': group})
+        return {doc.pop('_id'): doc for doc in self.pr_stats.aggregate(pipeline)}
+
+    @staticmethod
+    def review_metrics_update(repository, reviewer, granularity, bucket, inc, max_fields=None,
+                              number=None, expire_at=None):
+        """Returns: the upsert operation of the review metrics bucket (for update_review_metrics)"""
+        update = {}
+        if inc:  # MongoDB before 5.0 rejects an empty $inc
+            update['$inc'] = inc
+        if max_fields:
+            update['$max'] = max_fields
+        if number is not None:
+            update['$addToSet'] = {'pull_requests': number}
+        if expire_at:
+            update['$setOnInsert'] = {'expire_at': expire_at}
+        return UpdateOne({'repository': repository, 'reviewer': reviewer,
+                          'granularity': granularity, 'bucket': bucket}, update, upsert=True)
+
+    def update_review_metrics(self, updates):
+        if updates:
+            self.review_metrics.bulk_write(updates, ordered=False)
+
+    def get_review_metrics(self, repository, granularity, since=None, reviewer=None):
+        """Returns: the review metrics buckets of the repository (or of the reviewer in it) sorted by time"""
+        query = {'repository': repository, 'reviewer': reviewer, 'granularity': granularity}
+        if since:
+            query['bucket'] = {'$gte': since}
+        return list(self.review_metrics.find(query, {'_id': False, 'expire_at': False}).sort('bucket', ASCENDING))
+
+    def set_review_milestone(self, repository, number, milestone, time):
+        """Setting the time the pull request reached the milestone (e.g. first_review)
+        Returns: True if the milestone was reached now, False if it was already reached
+        """
+        key = {'repository': repository, 'number': number}
+        self.review_milestones.update_one(key, {'$setOnInsert': key}, upsert=True)
+        return self.review_milestones.update_one(dict(key, **{milestone: None}),
+                                                 {'$set': {milestone: time}}).modified_count == 1
+
+    def set_review_side(self, repository, number, side):
+        """Setting the side (owner or reviewer) of the last review activity of the pull request
+        Returns: the side of the previous activity (None if there was none)
+        """
+        previous = self.review_milestones.find_one_and_update(
+            {'repository': repository, 'number': number}, {'$set': {'last_side': side}}, upsert=True)
+        return (previous or {}).get('last_side')
+
+    def remove_review_milestones(self, repository, number):
+        self.review_milestones.delete_one({'repository': repository, 'number': number})
+
+    def add_sent_report(self, name, receivers, timings):
+        self.sent_reports.insert_one({
+            'name': name,
+            'receivers': receivers,
+            'sending_time': datetime.now(),
+            'timings': timings
+        })
+
+    def get_pr_stats(self, organization, repository, projection=None):
+        """Returns: list of the pull request statistics of the repository"""
+        projection = dict(projection or {}, _id=False)
+        return list(self.pr_stats.find({'organization': organization, 'repository': repository}, projection))
+
+    def _create_delivered_events_indexes(self):
+        ttl_days = config().config.events_handler.get('delivery_ttl_days', self.DELIVERED_EVENTS_TTL_DAYS)
+        self.delivered_events.create_index([('key', ASCENDING)], unique=True)
+        self.delivered_events.create_index([('datetime', ASCENDING)], expireAfterSeconds=int(ttl_days * 86400))
+        # Migrating the event ids that used to be stored in the metadata document
+        metadata = self.metadata.find_one({'delivered_github_events': {'$exists': True}})
+        if metadata:
+            logger.info('Migrating delivered Github events to their own collection...')
+            self.add_delivered_events(['event:{}'.format(event_id)
+                                       for event_id in metadata['delivered_github_events']])
+            self.metadata.update_one({'_id': metadata['_id']}, {'$unset': {'delivered_github_events': ''}})
+
+    def get_events_cursor(self, feed):
+        return self.events_cursors.find_one({'feed': feed}, {'_id': False}) or {'feed': feed}
+
+    def set_events_cursor(self, feed, etag, last_event_id):
+        self.events_cursors.update_one({'feed': feed}, {'$set': {
+            'etag': etag, 'last_event_id': last_event_id, 'datetime': datetime.now()}}, upsert=True)
+
+    def get_delivered_events(self, keys):
+        """Returns: set of the given delivery keys that were already delivered"""
+        return {doc['key'] for doc in self.delivered_events.find({'key': {'$in': list(keys)}}, {'key': True})}
+
+    def add_delivered_events(self, keys, pending=False):
+        """Adding the delivery keys, <pending> keys are of events that are not processed yet.
+        Returns: set of the keys that were not delivered before"""
+        keys = list(keys)
+        if not keys:
+            return set()
+        docs = [{'key': key, 'datetime': datetime.utcnow()} for key in keys]
+        if pending:
+            for doc in docs:
+                doc['pending'] = True
+        try:
+            self.delivered_events.insert_many(docs, ordered=False)
+        except BulkWriteError as err:
+            errors = err.details['writeErrors']
+            if any(error['code'] != 11000 for error in errors):  # Not a duplicate key error
+                raise
+            return set(keys) - {keys[error['index']] for error in errors}
+        return set(keys)
+
+    def set_delivered_events_processed(self, keys):
+        self.delivered_events.update_many({'key': {'$in': list(keys)}}, {'$unset': {'pending': ''}})
+
+    def remove_delivered_events(self, keys):
+        self.delivered_events.delete_many({'key': {'$in': list(keys)}})
 
-    def add_delivered_github_event(self, event_id):
-        self.metadata.update_one({}, {'$addToSet': {'delivered_github_events': event_id}})
+    def remove_pending_delivered_events(self):
+        """Removing the keys of the events that were not processed (e.g. the process was stopped).
+        Returns: the number of the removed keys"""
+        return self.delivered_events.delete_many({'pending': True}).deleted_count
 
     def set_initialization_time(self):
         self.metadata.update_one({}, {'$set': {'init_time': datetime.now()}})
@@ -75,8 +341,32 @@ class db(object):  # noqa
     def initialization_time(self):
         return self.metadata.find_one()['init_time']
 
-    def add_record(self, cases_properties, cases_checksum, action):
-        db().records.insert_one(self.bson_encode({
+    @property
+    def initialization_done(self):
+        metadata = self.metadata.find_one()
+        # Initializations that were done before the flag was added have only the init time
+        return metadata.get('init_done', metadata['init_time'] is not None)
+
+    def set_initialization_done(self, done=True):
+        self.metadata.update_one({}, {'$set': {'init_done': done}})
+
+    def get_initialized_pull_requests(self, repository):
+        return {doc['number'] for doc in self.initialization_progress.find({'repository': repository})}
+
+    def add_initialized_pull_requests(self, repository, numbers):
+        if numbers:
+            self.initialization_progress.insert_many([{'repository': repository, 'number': number}
+                                                      for number in numbers])
+
+    def clear_initialization_progress(self):
+        self.initialization_progress.remove()
+
+    def create_record(self, pr_key, cases_properties, cases_checksum, action):
+        """Creating an action record document of the pull request
+        Args:
+            * pr_key: (dict) the organization, repository and number of the pull request.
+        """
+        record = {
             'cases_properties': cases_properties,
             'cases_checksum': cases_checksum,
             'datetime': datetime.now(),
@@ -85,7 +375,43 @@ class db(object):  # noqa
                 'name': action.class_name,
                 'properties': action.properties
             }
-        }))
+        }
+        record.update(pr_key)
+        return self.bson_encode(record)
+
+    def add_record(self, pr_key, cases_properties, cases_checksum, action):
+        self.records.insert_one(self.create_record(pr_key, cases_properties, cases_checksum, action))
+
+    def add_records(self, records):
+        if records:
+            self.records.insert_many(records)
+
+    def get_done_actions(self, pr_key):
+        """Returns: set of the (cases_checksum, action checksum) of all the records of the pull request"""
+        return {(record['cases_checksum'], record['action']['checksum'])
+                for record in self.records.find(pr_key, {'cases_checksum': True, 'action.checksum': True})}
+
+    def _index_legacy_records(self):
+        """Loading the records that were added before the pull request key was stored in the record.
+        Their checksums are digests of the pull request number, so a legacy record could only be attributed
+        to its pull request once its (cases checksum, action checksum) is matched (see claim_legacy_action)"""
+        self._legacy_records = {}
+        for record in self.records.find({'number': {'$exists': False}},
+                                        {'cases_checksum': True, 'action.checksum': True}):
+            self._legacy_records.setdefault(
+                (record['cases_checksum'], record['action']['checksum']), []).append(record['_id'])
+        if self._legacy_records:
+            logger.info('{} legacy action records are waiting to be attributed to their pull requests'.format(
+                sum(len(ids) for ids in self._legacy_records.values())))
+
+    def claim_legacy_action(self, pr_key, done_key):
+        """Attributing the legacy records of the (cases checksum, action checksum) <done_key> to the pull request.
+        Returns: whether the action was done by a legacy record"""
+        ids = self._legacy_records.pop(done_key, None)
+        if not ids:
+            return False
+        self.records.update_many({'_id': {'$in': ids}}, {'$set': pr_key})
+        return True
 
     def dump(self, filename=None):
         """Prettily dumping the DB content"""
@@ -102,15 +428,144 @@ class db(object):  # noqa
                 f.write(out)
         return out
 
-    def remove_pr_stats(self, pr_number):
-        self.pr_stats.remove({'number': pr_number})
+    def remove_pr_stats(self, pr_number, repository=None, organization=None):
+        stat_key = {'number': pr_number}
+        if repository:
+            stat_key['repository'] = repository
+        if organization:
+            stat_key['organization'] = organization
+        self.pr_stats.remove(stat_key)
+        self.pr_commits.remove(stat_key)
+        self.bump_stats_version()
+        ChangeBus().publish('pr_stats_removed', stat_key)
+
+    def _migrate_pr_commits(self):
+        """The commits records used to be keyed by the repository name only, the records are refetched when needed"""
+        if 'repository_1_number_1' in self.pr_commits.index_information():
+            logger.info('Removing the commits records without the organization...')
+            self.pr_commits.drop_index('repository_1_number_1')
+            self.pr_commits.drop_index('repository_1_head_sha_1')
+            self.pr_commits.delete_many({'organization': {'$exists': False}})
+
+    def get_pr_commits(self, organization, repository, number):
+        """Returns: the commits record of the pull request (None if there is no record)"""
+        return self.pr_commits.find_one({'organization': organization, 'repository': repository, 'number': number},
+                                        {'_id': False})
+
+    def set_pr_commits(self, record):
+        self.pr_commits.replace_one(self._pr_stats_key(record), record, upsert=True)
+
+    def find_pr_number_by_head_sha(self, organization, repository, sha):
+        record = self.pr_commits.find_one({'organization': organization, 'repository': repository, 'head_sha': sha},
+                                          {'number': True})
+        return record['number'] if record else None
+
+    def get_ci_statuses(self, repository, sha):
+        """Returns: (whether all the statuses of the sha were fetched, list of the stored statuses)"""
+        fetched, statuses = False, []
+        for status in self.ci_statuses.find({'repository': repository, 'sha': sha}, {'_id': False}):
+            if status['context'] is None:
+                fetched = True  # The fetch marker
+            else:
+                statuses.append(status)
+        return fetched, statuses
+
+    def set_ci_status(self, repository, sha, context, state, description, updated_at):
+        """Setting the status of the context unless a newer status is already stored"""
+        key = {'repository': repository, 'sha': sha, 'context': context}
+        try:
+            self.ci_statuses.update_one(dict(key, updated_at={'$lte': updated_at}), {'$set': {
+                'state': state, 'description': description, 'updated_at': updated_at, 'datetime': datetime.now()
+            }}, upsert=True)
+        except DuplicateKeyError:
+            pass  # A newer status is already stored
+
+    def set_ci_statuses_fetched(self, repository, sha):
+        self.ci_statuses.update_one({'repository': repository, 'sha': sha, 'context': None},
+                                    {'$set': {'datetime': datetime.now()}}, upsert=True)
+
+    def _create_pr_stats_index(self):
+        index = [(key, ASCENDING) for key in self.PR_STATS_KEY]
+        try:
+            self.pr_stats.create_index(index, unique=True)
+        except DuplicateKeyError:
+            # Statistics that were duplicated before the unique index was created
+            logger.info('Removing duplicated pull request statistics...')
+            seen = set()
+            for stat in self.pr_stats.find({}, {key: True for key in self.PR_STATS_KEY}):
+                stat_key = tuple(stat.get(key) for key in self.PR_STATS_KEY)
+                if stat_key in seen:
+                    self.pr_stats.delete_one({'_id': stat['_id']})
+                seen.add(stat_key)
+            self.pr_stats.create_index(index, unique=True)
+
+    def _migrate_pr_stats_times(self):
+        """Converting the times of the statistics that were stored as datetime objects to epoch seconds"""
+        updates = []
+        for stat in self.pr_stats.find({'$or': [{field: {'$type': 'date'}} for field in self.PR_STATS_TIMES]},
+                                       {field: True for field in self.PR_STATS_TIMES}):
+            updates.append(UpdateOne({'_id': stat['_id']}, {'$set': {
+                field: to_epoch(stat[field]) for field in self.PR_STATS_TIMES if isinstance(stat.get(field), datetime)
+            }}))
+        if updates:
+            logger.info('Converting the times of {} pull request statistics to epoch seconds...'.format(len(updates)))
+            self.pr_stats.bulk_write(updates)
+
+    def _migrate_local_epoch_times(self):
+        """Fixing the epoch seconds that were converted from the (UTC) naive times as if they were local times"""
+        if self.metadata.find_one().get('utc_epoch_times'):
+            return
+
+        def fix(seconds):
+            return to_epoch(datetime.fromtimestamp(seconds)) if isinstance(seconds, (int, long, float)) else seconds
+        updates = []
+        for stat in self.pr_stats.find({}, {field: True for field in self.PR_STATS_TIMES +
+                                            ('review_comment_reaction_statuses',)}):
+            fields = {field: fix(stat[field]) for field in self.PR_STATS_TIMES if field in stat}
+            if stat.get('review_comment_reaction_statuses'):
+                for status in stat['review_comment_reaction_statuses']:
+                    status['last_comment']['created_at'] = fix(status['last_comment']['created_at'])
+                fields['review_comment_reaction_statuses'] = stat['review_comment_reaction_statuses']
+            if fields:
+                updates.append(UpdateOne({'_id': stat['_id']}, {'$set': fields}))
+        if updates:
+            logger.info('Fixing the epoch times of {} pull request statistics...'.format(len(updates)))
+            self.pr_stats.bulk_write(updates)
+        self.metadata.update_one({}, {'$set': {'utc_epoch_times': True}})
+
+    def _pr_stats_key(self, data):
+        return {key: data[key] for key in self.PR_STATS_KEY}
 
     def update_pr_stats(self, data):
-        stat_key = {key: data[key] for key in ('organization', 'repository', 'number')}
-        stat_exists = bool([s for s in self.pr_stats.find(stat_key)])
-        if stat_exists:
-            self.pr_stats.remove(stat_key)
-        self.pr_stats.insert_one(data)
+        self.pr_stats.replace_one(self._pr_stats_key(data), data, upsert=True)
+        self.bump_stats_version()
+        ChangeBus().publish('pr_stats', data)
+
+    def patch_pr_stats(self, repository, number, fields, max_fields=None):
+        """Setting the <fields> of the stored statistics of the pull request and raising
+        the <max_fields> to the given values.
+        Returns: the patched statistics or None if there are no stored statistics of the pull request"""
+        key, update = {'repository': repository, 'number': number}, {}
+        if fields:
+            update['$set'] = fields
+        if max_fields:
+            update['$max'] = max_fields
+        if not update:
+            return self.pr_stats.find_one(key, {'_id': False})
+        data = self.pr_stats.find_one_and_update(key, update, {'_id': False}, return_document=ReturnDocument.AFTER)
+        if data:
+            self.bump_stats_version()
+            ChangeBus().publish('pr_stats', data)
+        return data
+
+    def update_pr_stats_many(self, datas):
+        """Updating the statistics of several pull requests in a single bulk write"""
+        if datas:
+            self.pr_stats.bulk_write([ReplaceOne(self._pr_stats_key(data), data, upsert=True)
+                                      for data in datas], ordered=False)
+            self.bump_stats_version()
+            for data in datas:
+                ChangeBus().publish('pr_stats', data)
 
     def clear_db(self):
         # Deleting all the data in the db
@@ -120,4 +575,13 @@ class db(object):  # noqa
         self.pr_stats.remove()
         self.reviewers_pool.remove()
         self.metadata.remove()
+        self.github_cache.remove()
+        self.delivered_events.remove()
+        self.events_cursors.remove()
+        self.initialization_progress.remove()
+        self.review_metrics.remove()
+        self.review_milestones.remove()
+        self.pr_commits.remove()
+        self.diffs.remove()
+        self.ci_statuses.remove()
         logger.info('DB clean.')
@@ -0,0 +1,112 @@
+import json
+import md5
+import logging
+
+from config import config
+from common import Singleton, LRUCache
+from nudgebot.db import db
+
+
+logging.basicConfig()
+logger = logging.getLogger('DeliveriesLogger')
+logger.setLevel(logging.INFO)
+
+
+def event_fingerprint(payload):
+    """A fingerprint of the event content, common to the webhook and the Events API
+    payloads of the same event (which do not share the same id).
+    Returns None if the event content cannot be identified.
+    """
+    for name in ('comment', 'review', 'pull_request', 'issue'):
+        obj = payload.get(name)
+        if isinstance(obj, dict) and obj.get('id'):
+            return md5.new(json.dumps([
+                name, obj['id'], obj.get('updated_at') or obj.get('submitted_at'),
+                payload.get('action') or payload.get('event'),
+                # The subject of the action, the events of different subjects could have the same update time
+                (payload.get('label') or {}).get('name'),
+                (payload.get('requested_reviewer') or {}).get('login'),
+                (payload.get('requested_team') or {}).get('slug'),
+                (payload.get('assignee') or {}).get('login')
+            ])).hexdigest()
+    return None
+
+
+class DeliveryStore(object):
+    """Deduplicates the delivered Github events (both polled events and webhook deliveries).
+    The delivery keys are stored in an indexed collection with TTL, the recent ones are also
+    cached in memory so most of the duplicate checks don't hit the database.
+    The keys of a claimed event are pending until the event is processed (see done), the pending keys
+    of a stopped process are removed on startup so the redelivered events are processed.
+    """
+    __metaclass__ = Singleton
+    DEFAULT_CACHE_SIZE = 10000
+
+    def __init__(self):
+        cache_size = config().config.events_handler.get('delivery_cache_size', self.DEFAULT_CACHE_SIZE)
+        self._cache = LRUCache(cache_size)
+        removed = db().remove_pending_delivered_events()
+        if removed:
+            logger.info('Removed {} delivery keys of unprocessed events'.format(removed))
+
+    @staticmethod
+    def event_key(event_id):
+        return 'event:{}'.format(event_id)
+
+    @staticmethod
+    def delivery_key(delivery_id):
+        return 'delivery:{}'.format(delivery_id)
+
+    @staticmethod
+    def fingerprint_key(fingerprint):
+        return 'fingerprint:{}'.format(fingerprint)
+
+    def is_delivered(self, key):
+        if key in self._cache:
+            return True
+        if db().get_delivered_events([key]):
+            self._cache.set(key)
+            return True
+        return False
+
+    def claim(self, *keys):
+        """Marking the delivery keys as delivered, pending until done() is called.
+        Returns: the claimed keys, empty if any of the keys was delivered before (i.e. the event should be ignored)
+        """
+        keys = [key for key in keys if key]
+        if any(key in self._cache for key in keys):
+            # Making sure all the keys are stored so the other sources of the event will be ignored too
+            db().add_delivered_events([key for key in keys if key not in self._cache])
+            for key in keys:
+                self._cache.set(key)
+            return []
+        new_keys = db().add_delivered_events(keys, pending=True)
+        for key in keys:
+            self._cache.set(key)
+        if len(new_keys) != len(keys):
+            db().set_delivered_events_processed(new_keys)
+            return []
+        return keys
+
+    def done(self, keys, processed=True):
+        """Committing the claimed keys once the event was processed, the keys are released if
+        the processing failed so the redelivery of the event is processed"""
+        if processed:
+            db().set_delivered_events_processed(keys)
+            return
+        db().remove_delivered_events(keys)
+        for key in keys:
+            self._cache.pop(key)
+
+    def claim_github_event(self, payload, delivery_id=None, event_id=None):
+        """Claiming the Github event by its delivery id (webhooks), event id (Events API) and content.
+        Returns: the claimed keys (see claim), empty if the event was delivered before
+        """
+        fingerprint = event_fingerprint(payload)
+        claimed = self.claim(self.delivery_key(delivery_id) if delivery_id else None,
+                             self.event_key(event_id) if event_id else None,
+                             self.fingerprint_key(fingerprint) if fingerprint else None)
+        if not claimed:
+            logger.info('Ignoring duplicated Github event: delivery_id={}; event_id={}'.format(
+                delivery_id, event_id))
+        return claimed
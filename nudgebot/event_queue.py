@@ -0,0 +1,112 @@
+import time
+import Queue
+import logging
+import threading
+
+from config import config
+from common import Singleton
+
+
+logging.basicConfig()
+logger = logging.getLogger('EventQueueLogger')
+logger.setLevel(logging.INFO)
+
+
+class EventQueue(object):
+    """Coalescing queue of the Github events.
+    The events are keyed by (repository, pull request number), events of the same pull request
+    that arrive within the window are merged into a single processing and the processing of
+    each pull request is serialized.
+    config (event_queue):
+        * window_seconds: the time to wait for more events of the pull request since the last one.
+        * max_wait_seconds: the maximum time an event waits in the queue.
+        * workers: the number of pull requests processed concurrently.
+    """
+    __metaclass__ = Singleton
+
+    def __init__(self):
+        queue_config = config().config.get('event_queue', {})
+        self.window_seconds = queue_config.get('window_seconds', 10)
+        self.max_wait_seconds = queue_config.get('max_wait_seconds', 60)
+        self.workers = queue_config.get('workers', 4)
+        self._pending = {}
+        self._in_progress = set()
+        self._condition = threading.Condition()
+        self._ready = Queue.Queue()
+        self._started = False
+        self.counters = {'received': 0, 'processed': 0}
+
+    @staticmethod
+    def get_key(payload):
+        from nudgebot import NudgeBot
+        return (payload.get('repository', {}).get('name'), NudgeBot().fetch_pr_number(payload))
+
+    def put(self, payload, on_done=None):
+        """Queuing the event payload, on_done(processed) is called once the event was handled"""
+        from nudgebot import NudgeBot
+        if NudgeBot().is_bot_event(payload):
+            if on_done:
+                on_done(True)
+            return
+        key = self.get_key(payload)
+        now = time.time()
+        with self._condition:
+            self.counters['received'] += 1
+            pending = self._pending.setdefault(key, {'payloads': [], 'callbacks': [], 'first': now})
+            pending['payloads'].append(payload)
+            if on_done:
+                pending['callbacks'].append(on_done)
+            pending['last'] = now
+            self._condition.notify()
+
+    def _due_time(self, pending):
+        return min(pending['last'] + self.window_seconds, pending['first'] + self.max_wait_seconds)
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                now = time.time()
+                next_due = None
+                for key, pending in self._pending.items():
+                    if key in self._in_progress:
+                        continue  # Serializing the processing of the pull request
+                    due = self._due_time(pending)
+                    if due <= now:
+                        self._in_progress.add(key)
+                        pending = self._pending.pop(key)
+                        self._ready.put((key, pending['payloads'], pending['callbacks']))
+                    elif next_due is None or due < next_due:
+                        next_due = due
+                self._condition.wait(None if next_due is None else next_due - now)
+
+    def _work(self):
+        from nudgebot import NudgeBot
+        while True:
+            key, payloads, callbacks = self._ready.get()
+            processed = False
+            try:
+                logger.info('Processing {} coalesced events of {} pull request #{}'.format(
+                    len(payloads), *key))
+                NudgeBot().process_github_events(payloads)
+                processed = True
+            except Exception:
+                logger.exception('Failed to process the events of {} pull request #{}'.format(*key))
+            finally:
+                for callback in callbacks:
+                    try:
+                        callback(processed)
+                    except Exception:
+                        logger.exception('Event done callback failed')
+                with self._condition:
+                    self.counters['processed'] += 1
+                    self._in_progress.discard(key)
+                    self._condition.notify()
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        for target in [self._dispatch] + [self._work] * self.workers:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
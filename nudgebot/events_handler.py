@@ -1,15 +1,16 @@
+import json
 import threading
-import requests
-import github
 import time
 import logging
-from datetime import datetime
+from functools import partial
+from multiprocessing.pool import ThreadPool
 
 from common import Singleton, as_local_time
 from nudgebot.lib.github import GithubEnv
 from config import config
 from nudgebot.db import db
-from globals import SERVER_PORT
+from nudgebot.deliveries import DeliveryStore
+from nudgebot.event_queue import EventQueue
 
 
 logging.basicConfig()
@@ -17,45 +18,181 @@ logger = logging.getLogger('EventsHandlerLogger')
 logger.setLevel(logging.INFO)
 
 
+class EventsFeed(object):
+    """A polled Github events feed of a repository with its cursor (ETag and last event id).
+    The cursor of a poll is saved once the events of the poll and of the former polls were handled
+    (see checkpoint), so the events that were queued when the process stopped are polled again.
+    """
+    MAX_PAGES = 10  # The Github events API serves up to 300 events (10 pages)
+
+    def __init__(self, repo, path, min_interval, max_interval):
+        self.repo = repo
+        self.path = path
+        self.name = '{}{}'.format(repo.full_name, path)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.next_poll = 0
+        cursor = db().get_events_cursor(self.name)
+        self.etag = cursor.get('etag')
+        self.last_event_id = cursor.get('last_event_id')
+        self._checkpoints = []  # The cursors of the polls whose events are being handled, in order
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<{} name="{}">'.format(self.__class__.__name__, self.name)
+
+    def _get(self, url, etag=None):
+        headers = {'If-None-Match': etag} if etag else {}
+        status, response_headers, output = self.repo._requester.requestJson('GET', url, headers=headers)
+        if status not in (200, 304):
+            logger.error('Failed to poll events feed "{}": status={}; {}'.format(self.name, status, output))
+        return status, response_headers, (json.loads(output) if status == 200 and output else [])
+
+    def poll(self):
+        """Polling the feed, the cursor is stored only by the checkpoints (after the events are handled).
+        Returns: list of the new raw events (from the oldest to the newest)
+        """
+        # The ETag and the poll interval of the feed are the ones of the first page
+        status, first_headers, events = self._get(self.repo.url + self.path, self.etag)
+        headers, new_events = first_headers, []
+        if status == 200:
+            pages = 1
+            while events:
+                for event in events:
+                    if self.last_event_id and int(event['id']) <= self.last_event_id:
+                        events = []
+                        break
+                    new_events.append(event)
+                next_url = self._next_page_url(headers)
+                if not events or not next_url or pages >= self.MAX_PAGES:
+                    break
+                _, headers, events = self._get(next_url)
+                pages += 1
+            self.etag = first_headers.get('etag') or self.etag
+            if new_events:
+                self.last_event_id = max(int(event['id']) for event in new_events)
+        self._schedule(bool(new_events), first_headers)
+        return list(reversed(new_events))
+
+    def checkpoint(self):
+        """Returns: a checkpoint of the current cursor, held until release(). Every queued event
+        of the poll holds the checkpoint too (see hold)"""
+        checkpoint = {'holds': 1, 'etag': self.etag, 'last_event_id': self.last_event_id}
+        with self._lock:
+            self._checkpoints.append(checkpoint)
+        return checkpoint
+
+    def hold(self, checkpoint):
+        with self._lock:
+            checkpoint['holds'] += 1
+
+    def release(self, checkpoint):
+        """Releasing the checkpoint, the latest checkpoint that is released with all the former ones is saved"""
+        with self._lock:
+            checkpoint['holds'] -= 1
+            saved = None
+            while self._checkpoints and not self._checkpoints[0]['holds']:
+                saved = self._checkpoints.pop(0)
+            if saved:
+                db().set_events_cursor(self.name, saved['etag'], saved['last_event_id'])
+
+    @staticmethod
+    def _next_page_url(headers):
+        for link in headers.get('link', '').split(','):
+            if 'rel="next"' in link:
+                return link[link.index('<') + 1:link.index('>')]
+        return None
+
+    def _schedule(self, active, headers):
+        """Adapting the poll interval to the repository activity and to the Github poll hint"""
+        if active:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        interval = max(self.interval, int(headers.get('x-poll-interval', 0)))
+        self.next_poll = time.time() + interval
+
+
 class EventsHandler(threading.Thread):
     __metaclass__ = Singleton
+    FEEDS = ('/events', '/issues/events')
 
     def __init__(self, *args, **kwargs):
         threading.Thread.__init__(self, *args, **kwargs)
         self.daemon = True
-        self._last_check = None
+        handler_config = config().config.events_handler
+        self.min_interval = handler_config.check_timeout_seconds
+        self.max_interval = handler_config.get('max_check_timeout_seconds', self.min_interval * 5)
+        self.pollers = handler_config.get('pollers', 4)
+        self._feeds = None
+        self._pool = None
+
+    @property
+    def feeds(self):
+        if self._feeds is None:
+            self._feeds = [EventsFeed(repo, path, self.min_interval, self.max_interval)
+                           for repo in GithubEnv().repos for path in self.FEEDS]
+        return self._feeds
+
+    def dispatch(self, feed, event, checkpoint):
+        """Handing the event to the processing pipeline, the checkpoint of the poll is held until it's handled"""
+        is_this_old = (as_local_time(event['created_at'], raise_if_native_time=False)
+                       < db().initialization_time)
+        is_this_me = event['actor']['login'] == config().credentials.github.username
+        if is_this_old or is_this_me:
+            return
+        logger.info('New event detected: id={}'.format(event['id']))
+        if 'payload' in event:
+            payload = event['payload']
+        else:
+            payload = event  # Issue events are not wrapped with payload
+        # Fill some required fields that could be missing in the events API but
+        # coming with webhooks for some reason
+        payload['sender'] = {'login': event['actor']['login']}
+        payload['repository'] = payload.get('repository', {'name': feed.repo.name,
+                                                           'owner': {'login': feed.repo.owner.login}})
+        keys = DeliveryStore().claim_github_event(payload, event_id=event['id'])
+        if keys:
+            feed.hold(checkpoint)
+            EventQueue().put(payload, on_done=partial(self._event_done, feed, checkpoint, keys))
+
+    @staticmethod
+    def _event_done(feed, checkpoint, keys, processed):
+        # A failed event doesn't hold the cursor back, its claim is released for the webhook redelivery
+        try:
+            DeliveryStore().done(keys, processed)
+        finally:
+            feed.release(checkpoint)
+
+    def check_feed(self, feed):
+        logger.info('Searching for new events in "{}"'.format(feed.name))
+        try:
+            events = feed.poll()
+            checkpoint = feed.checkpoint()
+            try:
+                for event in events:
+                    self.dispatch(feed, event, checkpoint)
+            finally:
+                feed.release(checkpoint)
+        except Exception:
+            logger.exception('Failed to check events feed "{}"'.format(feed.name))
+            feed.next_poll = time.time() + feed.interval
 
     def check_github_events(self):
-        """Sending new Github events to the webhooks server"""
-        for repo in GithubEnv().repos:
-            logger.info('Searching for new event in repository "{}"'.format(repo.name))
-            for getter in ('get_events', 'get_issues_events'):
-                for event in getattr(repo, getter)():
-                    is_this_new = (as_local_time(event.last_modified or event.created_at,
-                                                 raise_if_native_time=False)
-                                   < db().initialization_time)
-                    is_this_me = event.actor.login == config().credentials.github.username
-                    if (event.id in db().delivered_github_events or is_this_new or is_this_me):
-                        break
-                    logger.info('New event detected: id={}'.format(event.id))
-                    if isinstance(event, github.IssueEvent.IssueEvent):
-                        payload = event.raw_data
-                    else:
-                        payload = event.payload
-                    # Fill some required fields that could be missing in the events API but
-                    # coming with webhooks for some reason
-                    payload['sender'] = {'login': event.actor.login}
-                    payload['repository'] = payload.get('repository', {'name': repo.name})
-                    requests.post('http://localhost:{}/webhooks'.format(SERVER_PORT), json=payload)
-                    db().add_delivered_github_event(event.id)
+        """Polling all the feeds that are due, concurrently.
+        Returns: the time (seconds) until the next feed is due"""
+        now = time.time()
+        due_feeds = [feed for feed in self.feeds if feed.next_poll <= now]
+        if due_feeds:
+            if self._pool is None:
+                self._pool = ThreadPool(self.pollers)
+            self._pool.map(self.check_feed, due_feeds)
+        return max(min(feed.next_poll for feed in self.feeds) - time.time(), 0)
 
     def run(self):
         logger.info('Starting events handler.')
+        if not config().config.events_handler.use_github_events_proxy:
+            return
         while True:
-            if (not self._last_check or ((datetime.now() - self._last_check).total_seconds() >
-                                         config().config.events_handler.check_timeout_seconds)):
-                self._last_check = datetime.now()
-                if config().config.events_handler.use_github_events_proxy:
-                    self.check_github_events()
-            else:
-                time.sleep(1)
+            time.sleep(self.check_github_events())
@@ -8,6 +8,13 @@ class FlowObject(object):
             self._properties[name] = str(value)
         return super(FlowObject, self).__setattr__(name, value)
 
+    def __copy__(self):
+        """A copy with its own state, the attribute values are shared"""
+        obj = self.__class__.__new__(self.__class__)
+        obj.__dict__.update(self.__dict__)
+        obj.__dict__['_properties'] = dict(self._properties)
+        return obj
+
     @property
     def class_name(self):
         return self.__class__.__name__
@@ -5,6 +5,7 @@ from common import Age, skip_if_testing_mode
 from nudgebot.lib.github.users import BotUser
 from nudgebot.lib.github.pull_request import PullRequestTitleTag
 from nudgebot.lib import FlowObject
+from nudgebot.outbox import EditTitle, RequestReviewers, CreateComment, Call
 
 
 logging.basicConfig()
@@ -18,8 +19,15 @@ class RUN_TYPES:
 
 
 class Action(FlowObject):
-    """A base class for an action"""
+    """A base class for an action
+    The actions that define operations() are executed through the outbox (see ActionOutbox),
+    the other actions run inline.
+    static attributes:
+        * INVALIDATES: The Github resources (or stats) that the action changes, only the
+                       statistics that depend on them are dropped after the action runs.
+                       None means that all the statistics are dropped."""
     _github_obj = BotUser()
+    INVALIDATES = None
 
     def __init__(self, *args, **kwargs):
         self.run_type = kwargs.get('run_type', RUN_TYPES.ONCE)
@@ -28,11 +36,31 @@ class Action(FlowObject):
     def run(self):
         logger.info('Running action: {}'.format(self))
         self.action()
-        self._pr_statistics.uncache_all()
+        if self.INVALIDATES is None:
+            self._pr_statistics.uncache_all()
+        else:
+            self._pr_statistics.invalidate(*self.INVALIDATES)
+
+    @skip_if_testing_mode
+    def prepare(self):
+        """Returns: the outbox operations of the action, previewed on the pull request statistics.
+        An action without operations is run inline and an empty list is returned."""
+        operations = self.operations()
+        if operations is None:
+            self.run()
+            return []
+        logger.info('Queuing action: {}'.format(self))
+        for operation in operations:
+            operation.preview(self._pr_statistics)
+        return operations
 
     def action(self):
         raise NotImplementedError()
 
+    def operations(self):
+        """Returns: list of the outbox operations of the action or None to run the action inline"""
+        return None
+
     def _md5(self, *strings):
         checksum = md5.new()
         checksum.update(str(self._pr_statistics.number()))
@@ -42,18 +70,26 @@ class Action(FlowObject):
 
 
 class PullRequestTitleTagSet(Action):
+    INVALIDATES = ('title',)
+
     def __init__(self, title_tags, override=False, **kwargs):
         self.title_tags = title_tags
         self.override = override
         Action.__init__(self, **kwargs)
 
-    def action(self):
+    def _new_tags(self):
         if isinstance(self.title_tags, basestring):
             self.title_tags = [self.title_tags]
         current_tags = self._pr_statistics.pull_request.title_tags
-        new_tags = (self.title_tags if self.override
-                    else list(set(self.title_tags + current_tags)))
-        self._pr_statistics.pull_request.title_tags = new_tags
+        return (self.title_tags if self.override
+                else list(set(self.title_tags + current_tags)))
+
+    def action(self):
+        self._pr_statistics.pull_request.title_tags = self._new_tags()
+
+    def operations(self):
+        pull_request = self._pr_statistics.pull_request
+        return [EditTitle(pull_request, pull_request.title_with_tags(self._new_tags()))]
 
     @property
     def hash(self):
@@ -61,6 +97,8 @@ class PullRequestTitleTagSet(Action):
 
 
 class PullRequestTitleTagRemove(Action):
+    INVALIDATES = ('title',)
+
     def __init__(self, title_tags, **kwargs):
         self.title_tags = title_tags
         Action.__init__(self, **kwargs)
@@ -68,22 +106,35 @@ class PullRequestTitleTagRemove(Action):
     def action(self):
         self._pr_statistics.pull_request.remove_title_tags(*self.title_tags)
 
+    def operations(self):
+        pull_request = self._pr_statistics.pull_request
+        return [EditTitle(pull_request, pull_request.title_without_tags(*self.title_tags))]
+
     @property
     def hash(self):
         return self._md5('-', *[PullRequestTitleTag(tag).raw for tag in self.title_tags])
 
 
 class AddReviewer(Action):
+    INVALIDATES = ('reviewer_requests',)
+
     def __init__(self, reviewer=None, level=1, **kwargs):
         self.reviewer = reviewer
         self.level = level
         Action.__init__(self, **kwargs)
 
-    def action(self):
+    def _pull_reviewer(self):
         if not self.reviewer:
             self.reviewer = self._pr_statistics.repo().reviewers_pool.pull_reviewer(
-                self.level, self._pr_statistics.pull_request)
-        self._pr_statistics.pull_request.add_reviewers([self.reviewer])
+                self.level, self._pr_statistics.pull_request,
+                exclude=[reviewer.login for reviewer in self._pr_statistics.reviewers()])
+        return self.reviewer
+
+    def action(self):
+        self._pr_statistics.pull_request.add_reviewers([self._pull_reviewer()])
+
+    def operations(self):
+        return [RequestReviewers(self._pr_statistics.pull_request, [self._pull_reviewer()])]
 
     @property
     def hash(self):
@@ -91,6 +142,8 @@ class AddReviewer(Action):
 
 
 class RemoveReviewer(Action):
+    INVALIDATES = ('reviewer_requests',)
+
     def __init__(self, reviewer, **kwargs):
         self.reviewer = reviewer
         Action.__init__(self, **kwargs)
@@ -98,12 +151,18 @@ class RemoveReviewer(Action):
     def action(self):
         self._pr_statistics.pull_request.remove_reviewers([self.reviewer])
 
+    def operations(self):
+        pull_request = self._pr_statistics.pull_request
+        return [Call(pull_request, self.INVALIDATES, pull_request.remove_reviewers, [self.reviewer])]
+
     @property
     def hash(self):
         return self._md5('-', self.reviewer)
 
 
 class CreateIssueComment(Action):
+    INVALIDATES = ('issue_comments',)
+
     def __init__(self, body, **kwargs):
         self.body = body
         Action.__init__(self, **kwargs)
@@ -111,6 +170,9 @@ class CreateIssueComment(Action):
     def action(self):
         self._pr_statistics.pull_request.create_issue_comment(self.body)
 
+    def operations(self):
+        return [CreateComment(self._pr_statistics.pull_request, self.body)]
+
     @property
     def hash(self):
         return self._md5(self.body)
@@ -118,6 +180,7 @@ class CreateIssueComment(Action):
 
 class _ReviewStateActionBase(Action):
     STATE = 'PENDING'
+    INVALIDATES = ('reviewer_requests', 'reviews')
 
     def __init__(self, body, **kwargs):
         self.body = body
@@ -130,7 +193,13 @@ class _ReviewStateActionBase(Action):
     def action(self):
         self._pr_statistics.pull_request.add_reviewers([self._github_obj])
         self._pr_statistics.pull_request.create_review(
-            list(self._pr_statistics.commits())[-1], self.body or self.STATE, self.event)
+            self._pr_statistics.head_commit(), self.body or self.STATE, self.event)
+
+    def operations(self):
+        pull_request = self._pr_statistics.pull_request
+        return [RequestReviewers(pull_request, [self._github_obj]),
+                Call(pull_request, self.INVALIDATES, pull_request.create_review,
+                     self._pr_statistics.head_commit(), self.body or self.STATE, self.event)]
 
     @property
     def hash(self):
@@ -148,6 +217,8 @@ class Approve(_ReviewStateActionBase):
 
 
 class CreateReviewComment(Action):
+    INVALIDATES = ('review_comments',)
+
     def __init__(self, body, path=None, position=None, **kwargs):
         self.body = body
         self.path = path
@@ -155,16 +226,23 @@ class CreateReviewComment(Action):
         Action.__init__(self, **kwargs)
 
     def action(self):
-        commit = list(self._pr_statistics.commits())[-1]
+        commit = self._pr_statistics.head_commit()
         self._pr_statistics.pull_request.create_review_comment(
             self.body, commit, self.path, self.position)
 
+    def operations(self):
+        pull_request = self._pr_statistics.pull_request
+        return [Call(pull_request, self.INVALIDATES, pull_request.create_review_comment,
+                     self.body, self._pr_statistics.head_commit(), self.path, self.position)]
+
     @property
     def hash(self):
         return self._md5('+', self.body, self.path, self.position)
 
 
 class EditDescription(Action):
+    INVALIDATES = ('description',)
+
     def __init__(self, body, **kwargs):
         self.body = body
         Action.__init__(self, **kwargs)
@@ -178,6 +256,8 @@ class EditDescription(Action):
 
 
 class SendEmailToUsers(Action):
+    INVALIDATES = ()
+
     def __init__(self, receivers, subject, body, **kwargs):
         self.receivers = receivers
         self.subject = subject
@@ -188,7 +268,7 @@ class SendEmailToUsers(Action):
         from nudgebot import NudgeBot
         # TODO: Check if the user has email - if not ask for it
         receivers = [user.email for user in self._receivers]
-        NudgeBot().send_email(receivers, self._subject, self._body)
+        NudgeBot().send_email(receivers, self._subject, self._body, digest=True)
 
     @property
     def hash(self):
@@ -199,13 +279,19 @@ class SendEmailToUsers(Action):
 
 
 class ReportForInactivity(Action):
+    INVALIDATES = ('issue_comments',)
 
-    def action(self):
+    @property
+    def body(self):
         last_update = Age(self._pr_statistics.last_update())
-        self._pr_statistics.pull_request.create_issue_comment(
-            ('Pull request is inactive for {}- please do'
-             ' some action, update it or close it').format(last_update.pretty)
-        )
+        return ('Pull request is inactive for {}- please do'
+                ' some action, update it or close it').format(last_update.pretty)
+
+    def action(self):
+        self._pr_statistics.pull_request.create_issue_comment(self.body)
+
+    def operations(self):
+        return [CreateComment(self._pr_statistics.pull_request, self.body)]
 
     @property
     def hash(self):
@@ -213,6 +299,8 @@ class ReportForInactivity(Action):
 
 
 class AskForReviewCommentReactions(Action):
+    INVALIDATES = ('issue_comments',)
+
     def __init__(self, days, hours, prompt_missing_emails=False, **kwargs):
         self.days = days
         self.hours = hours
@@ -254,7 +342,7 @@ class AskForReviewCommentReactions(Action):
         receviers = list(receviers)
         subject = 'PR#{} is waiting for response'.format(self._pr_statistics.number())
         from nudgebot import NudgeBot
-        NudgeBot().send_email(receviers, subject, emails_content)
+        NudgeBot().send_email(receviers, subject, emails_content, digest=True)
 
     @property
     def hash(self):
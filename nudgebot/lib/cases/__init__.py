@@ -13,7 +13,15 @@ logger.setLevel(logging.INFO)
 
 
 class Case(FlowObject):
-    """A base class for a case"""
+    """A base class for a case
+    static attributes:
+        * STATS: The stats that the case state depends on, events that don't change any of
+                 them are not evaluating the flow. None means that the case depends on all the stats.
+        * STATIC_HASH: Whether the hash arguments (hash_args) depend only on the case properties,
+                       so they are converted to a string once."""
+    STATS = None
+    STATIC_HASH = True
+
     def __init__(self, not_case=False):
         self.not_case = not_case
 
@@ -23,30 +31,50 @@ class Case(FlowObject):
             ' '.join(['{}={};'.format(key, val) for key, val in self._properties.items()])
         )
 
+    def __setattr__(self, name, value):
+        if not name.startswith('_'):
+            self.__dict__.pop('_static_hash', None)
+        return super(Case, self).__setattr__(name, value)
+
     def check_state(self):
         raise NotImplementedError()
 
     @property
     def state(self):
-        logger.info('Evaluating state of case: {}'.format(self))
         state = self.check_state()
         if self.not_case:
             state = not state
-        logger.info('Case state is {}'.format(state))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Case {} state is {}'.format(self, state))
         return state
 
+    def hash_args(self):
+        """Returns: the arguments of the case hash (besides the pull request number, the class and not_case)"""
+        raise NotImplementedError()
+
+    @property
+    def hash(self):
+        checksum = md5.new(str(self._pr_statistics.number()))
+        if self.STATIC_HASH:
+            if '_static_hash' not in self.__dict__:
+                self._static_hash = self._hash_prefix + ''.join([str(arg) for arg in self.hash_args()])
+            checksum.update(self._static_hash)
+        else:
+            checksum.update(self._hash_prefix + ''.join([str(arg) for arg in self.hash_args()]))
+        return checksum.hexdigest()
+
+    @property
+    def _hash_prefix(self):
+        return self.__class__.__name__ + str(self.not_case)
+
     def _md5(self, *args):
-        strings = [str(arg) for arg in args]
-        checksum = md5.new()
-        checksum.update(str(self._pr_statistics.number()))
-        checksum.update(self.__class__.__name__)
-        checksum.update(str(self.not_case))
-        for str_ in strings:
-            checksum.update(str_)
+        checksum = md5.new(str(self._pr_statistics.number()))
+        checksum.update(self._hash_prefix + ''.join([str(arg) for arg in args]))
         return checksum.hexdigest()
 
 
 class PullRequestHasTitleTag(Case):
+    STATS = ('title_tags',)
 
     def __init__(self, tag, *args, **kwargs):
         if isinstance(tag, (basestring, re._pattern_type)):
@@ -62,13 +90,12 @@ class PullRequestHasTitleTag(Case):
                         return True
         return False
 
-    @property
-    def hash(self):
-        return self._md5(*[tag.pattern if isinstance(tag, re._pattern_type) else tag
-                           for tag in self.tag_options])
+    def hash_args(self):
+        return [tag.pattern if isinstance(tag, re._pattern_type) else tag for tag in self.tag_options]
 
 
 class ReviewerWasSet(Case):
+    STATS = ('reviewers',)
 
     def __init__(self, level=1, *args, **kwargs):
         self.level = level
@@ -81,12 +108,12 @@ class ReviewerWasSet(Case):
                     return True
         return False
 
-    @property
-    def hash(self):
-        return self._md5(self.level)
+    def hash_args(self):
+        return (self.level,)
 
 
 class ReviewerRequestChanges(Case):
+    STATS = ('review_states_by_user',)
 
     def __init__(self, level=1, *args, **kwargs):
         self.level = level
@@ -100,12 +127,12 @@ class ReviewerRequestChanges(Case):
                 approvals += 1
         return approvals == self.level
 
-    @property
-    def hash(self):
-        return self._md5(self.level)
+    def hash_args(self):
+        return (self.level,)
 
 
 class ReviewerApproved(Case):
+    STATS = ('review_states_by_user',)
 
     def __init__(self, level=1, *args, **kwargs):
         self.level = level
@@ -119,12 +146,13 @@ class ReviewerApproved(Case):
                 approvals += 1
         return approvals == self.level
 
-    @property
-    def hash(self):
-        return self._md5(self.level)
+    def hash_args(self):
+        return (self.level,)
 
 
 class InactivityForPeriod(Case):
+    STATS = ('last_update',)
+    STATIC_HASH = False
 
     def __init__(self, days, hours, *args, **kwargs):
         self.days = days
@@ -132,15 +160,16 @@ class InactivityForPeriod(Case):
         super(InactivityForPeriod, self).__init__(*args, **kwargs)
 
     def check_state(self):
-        timedelta = datetime.now() - self._pr_statistics.last_update()
+        timedelta = datetime.utcnow() - self._pr_statistics.last_update()
         return timedelta.total_seconds() > (self.days * 86400 + self.hours * 3600)
 
-    @property
-    def hash(self):
-        return self._md5(self._pr_statistics.last_update())
+    def hash_args(self):
+        return (self._pr_statistics.last_update(),)
 
 
 class WaitingForReviewCommentReaction(Case):
+    STATS = ('review_comment_reaction_statuses',)
+    STATIC_HASH = False
 
     def __init__(self, days, hours, *args, **kwargs):
         self.days = days
@@ -153,17 +182,18 @@ class WaitingForReviewCommentReaction(Case):
                 return True
         return False
 
-    @property
-    def hash(self):
+    def hash_args(self):
         last_comments_hash = ''.join([
             status['last_comment'].user.login +
             status['last_comment'].created_at.strftime('%d-%m-%y-%H-%M-%S')
             for status in self._pr_statistics.review_comment_reaction_statuses()
         ])
-        return self._md5(last_comments_hash, self.days, self.hours)
+        return last_comments_hash, self.days, self.hours
 
 
 class DescriptionInclude(Case):
+    STATS = ('description',)
+    STATIC_HASH = False
 
     def __init__(self, text, *args, **kwargs):
         self.text = text
@@ -174,15 +204,15 @@ class DescriptionInclude(Case):
             return bool(self.text.search(self._pr_statistics.description()))
         return self.text in self._pr_statistics.description()
 
-    @property
-    def hash(self):
-        return self._md5(
+    def hash_args(self):
+        return (
             getattr(self.text, 'pattern', self.text),
             self._pr_statistics.description()
         )
 
 
 class CurrentRepoName(Case):
+    STATS = ('repo',)
 
     def __init__(self, name, *args, **kwargs):
         self.name = name
@@ -191,6 +221,23 @@ class CurrentRepoName(Case):
     def check_state(self):
         return self._pr_statistics.repo().name == self.name
 
-    @property
-    def hash(self):
-        return self._md5(self.name)
+    def hash_args(self):
+        return (self.name,)
+
+
+class PullRequestLargerThan(Case):
+    """The pull request changes more than <changes> lines or more than <files> files"""
+    STATS = ('size',)
+
+    def __init__(self, changes=None, files=None, *args, **kwargs):
+        self.changes = changes
+        self.files = files
+        super(PullRequestLargerThan, self).__init__(*args, **kwargs)
+
+    def check_state(self):
+        size = self._pr_statistics.size()
+        return ((self.changes is not None and size['changes'] > self.changes) or
+                (self.files is not None and size['files'] > self.files))
+
+    def hash_args(self):
+        return (self.changes, self.files)
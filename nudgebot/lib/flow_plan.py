@@ -0,0 +1,138 @@
+import md5
+import copy
+import time
+import logging
+
+from nudgebot.lib.actions import Action
+from nudgebot.lib.cases import Case
+
+
+logging.basicConfig()
+logger = logging.getLogger('FlowPlanLogger')
+logger.setLevel(logging.INFO)
+
+
+class PlanNode(object):
+    """A case or an action of the plan.
+        * end: the index of the node after the subtree of the case (where a false case jumps to).
+        * calls, seconds: the number of evaluations of the node and their total duration.
+        * hits: the number of evaluations of the case that were true.
+    """
+    __slots__ = ('flow_object', 'is_case', 'state_key', 'hash_key', 'end', 'calls', 'seconds', 'hits')
+
+    def __init__(self, flow_object):
+        self.flow_object = flow_object
+        self.is_case = isinstance(flow_object, Case)
+        self.state_key = self.hash_key = None
+        if self.is_case:
+            properties = tuple(sorted((name, value) for name, value in flow_object._properties.items()
+                                      if name != 'not_case'))
+            self.state_key = (flow_object.__class__, properties)
+            self.hash_key = (self.state_key, bool(flow_object.not_case))
+        self.end = None
+        self.calls = self.hits = 0
+        self.seconds = 0.0
+
+    def __repr__(self):
+        return repr(self.flow_object)
+
+
+class FlowPlan(object):
+    """A flow tree compiled into a flat list of nodes, in the order of the tree traversal.
+    A false case jumps over its subtree. Equal cases (the same class and properties) are checked
+    once per pull request and the negated cases reuse the result, the results are dropped after
+    an action runs since the action changes the pull request.
+    The cases checksum of an action is the chain of all the true cases that were traversed before
+    it (as in the recursive traversal of the tree), so the existing action records stay valid.
+    """
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    @classmethod
+    def compile(cls, tree):
+        nodes = []
+
+        def visit(tree):
+            if isinstance(tree, dict):
+                for case, subtree in tree.items():
+                    node = PlanNode(case)
+                    nodes.append(node)
+                    visit(subtree)
+                    node.end = len(nodes)
+            elif isinstance(tree, (list, tuple)):
+                for subtree in tree:
+                    visit(subtree)
+            elif isinstance(tree, Action):
+                nodes.append(PlanNode(tree))
+        visit(tree)
+        return cls(nodes)
+
+    def copy(self):
+        """Returns: a plan over copies of the flow objects, the flow objects hold the statistics they
+        evaluate so every thread has to evaluate its own copy"""
+        nodes = []
+        for node in self.nodes:
+            copied = PlanNode(copy.copy(node.flow_object))
+            copied.end = node.end
+            nodes.append(copied)
+        return FlowPlan(nodes)
+
+    @property
+    def cases(self):
+        return [node.flow_object for node in self.nodes if node.is_case]
+
+    @property
+    def stats(self):
+        """The stats that the cases depend on or None if any of the cases depends on all the stats"""
+        stats = set()
+        for case in self.cases:
+            if case.STATS is None:
+                return None
+            stats.update(case.STATS)
+        return stats
+
+    def evaluate(self, pr_stats, run_action):
+        """Evaluating the plan for the pull request statistics <pr_stats>.
+        run_action(action, cases_properties, cases_checksum) is called for every action of true cases,
+        it returns whether the action ran.
+        """
+        nodes, debug = self.nodes, logger.isEnabledFor(logging.DEBUG)
+        states, hashes = {}, {}
+        checksum, cases_properties = md5.new(), []
+        index = 0
+        while index < len(nodes):
+            node, start = nodes[index], time.time()
+            flow_object = node.flow_object
+            flow_object.load_pr_statistics(pr_stats)
+            index += 1
+            if node.is_case:
+                state = states.get(node.state_key)
+                if state is None:
+                    state = states[node.state_key] = bool(flow_object.check_state())
+                if flow_object.not_case:
+                    state = not state
+                if debug:
+                    logger.debug('Case {} state is {}'.format(flow_object, state))
+                if state:
+                    node.hits += 1
+                    case_hash = hashes.get(node.hash_key)
+                    if case_hash is None:
+                        case_hash = hashes[node.hash_key] = flow_object.hash
+                    checksum.update(case_hash)
+                    cases_properties.append(flow_object.properties)
+                else:
+                    index = node.end
+            elif run_action(flow_object, list(cases_properties), checksum.hexdigest()):
+                states.clear()
+                hashes.clear()
+            node.calls += 1
+            node.seconds += time.time() - start
+
+    def timings(self):
+        """Returns: list of (node, calls, total seconds) sorted by the total seconds"""
+        return sorted([(node, node.calls, node.seconds) for node in self.nodes], key=lambda timing: -timing[2])
+
+    def reset_timings(self):
+        for node in self.nodes:
+            node.calls, node.hits, node.seconds = 0, 0, 0.0
@@ -1,3 +1,5 @@
+import logging
+
 from github import Github
 from github.GithubException import UnknownObjectException
 
@@ -5,6 +7,11 @@ from config import config
 from common import Singleton
 
 
+logging.basicConfig()
+logger = logging.getLogger('GithubEnvLogger')
+logger.setLevel(logging.INFO)
+
+
 class GithubEnv(object):
 
     __metaclass__ = Singleton
@@ -14,6 +21,8 @@ class GithubEnv(object):
         login_info = config().credentials.github
         self.GIT = Github(login_info.get('username'), login_info.get('password'),
                           client_id=login_info.client_id, client_secret=login_info.client_secret)
+        from cache import ResponseCache
+        self.cache = ResponseCache.install(self.GIT)
         self.repos = []
         from repository import Repository
         for repo in config().config.github.repos:
@@ -23,3 +32,16 @@ class GithubEnv(object):
                 org = self.GIT.get_user(repo.org)
 
             self.repos.append(Repository(org, org.get_repo(repo.repo)))
+        config().on_reload(self._config_reloaded)
+
+    def _config_reloaded(self, old, new):
+        """Applying the reviewers of the reloaded config, the repositories are not changed until a restart"""
+        scheduler_changed = old.config.get('reviewers_scheduler') != new.config.get('reviewers_scheduler')
+        for repo in self.repos:
+            key = repo.config_key
+            if key not in new.repos:
+                logger.warning('Repository {} was removed from the config, restart to apply'.format(repo.name))
+            elif 'reviewers_pool' in repo.__dict__ and (
+                    scheduler_changed or old.reviewer_levels.get(key) != new.reviewer_levels[key]):
+                logger.info('Reloading the reviewers pool of repository "{}"'.format(repo.name))
+                repo.reviewers_pool.reload_config()
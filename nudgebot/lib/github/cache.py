@@ -0,0 +1,138 @@
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING
+
+from config import config
+from nudgebot.db import db
+
+
+logging.basicConfig()
+logger = logging.getLogger('GithubCacheLogger')
+logger.setLevel(logging.INFO)
+
+
+class ResponseCache(object):
+    """A persistent conditional-request cache for the Github API reads.
+
+    The cache is installed on the PyGithub requester, so every GET request (including
+    the pages of paginated lists) is sent with the stored ETag/Last-Modified of its URL.
+    When Github answers with 304 (which does not count against the rate limit) the
+    stored response is served instead. Responses that were validated within max_age_seconds
+    are served without a request at all.
+    The counters: hits (served without a request), not_modified (served after a 304),
+    misses (any other response) and evictions.
+    The size of the cache is checked every EVICTION_INTERVAL stored responses.
+    """
+    DEFAULT_MAX_ENTRIES = 10000
+    EVICTION_INTERVAL = 100
+
+    def __init__(self, requester, max_entries=None, max_age_seconds=0):
+        self._requester = requester
+        self._request_json = requester.requestJson
+        self._lock = threading.Lock()
+        self.max_entries = max_entries or self.DEFAULT_MAX_ENTRIES
+        self.max_age = timedelta(seconds=max_age_seconds)
+        self.counters = {'hits': 0, 'misses': 0, 'not_modified': 0, 'evictions': 0}
+        self._stores = 0
+        self._collection = db().github_cache
+        self._collection.create_index([('key', ASCENDING)], unique=True)
+        self._collection.create_index([('access_time', ASCENDING)])
+
+    @classmethod
+    def install(cls, github_obj):
+        """Installing the cache on the requester of the Github object (if enabled in the config).
+        Returns the installed cache or None"""
+        cache_config = config().config.get('github_cache', {})
+        if not cache_config.get('enabled', True):
+            return None
+        requester = github_obj._Github__requester
+        cache = cls(requester, cache_config.get('max_entries'), cache_config.get('max_age_seconds', 0))
+        requester.requestJson = cache.request_json
+        return cache
+
+    @staticmethod
+    def _key(url, parameters, headers):
+        parameters = sorted((parameters or {}).items())
+        return json.dumps([url, parameters, (headers or {}).get('Accept')])
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    @property
+    def stats(self):
+        with self._lock:
+            stats = self.counters.copy()
+        stats['entries'] = self._collection.count()
+        return stats
+
+    def request_json(self, verb, url, parameters=None, headers=None, input=None, cnx=None):
+        # Requests with their own conditional headers are handling the 304 responses by themselves
+        conditional = headers and ('If-None-Match' in headers or 'If-Modified-Since' in headers)
+        if verb != 'GET' or input is not None or cnx is not None or conditional:
+            return self._request_json(verb, url, parameters, headers, input, cnx)
+        key = self._key(url, parameters, headers)
+        entry = self._collection.find_one({'key': key})
+        now = datetime.now()
+        if entry and self.max_age and entry.get('validation_time', datetime.min) > now - self.max_age:
+            self._count('hits')
+            self._collection.update_one({'_id': entry['_id']}, {'$set': {'access_time': now}})
+            return 200, dict(entry['headers']), entry['output'].encode('UTF-8')
+        headers = dict(headers or {})
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        status, response_headers, output = self._request_json(verb, url, parameters, headers, input, cnx)
+        if status == 304 and entry:
+            self._count('not_modified')
+            now = datetime.now()
+            self._collection.update_one({'_id': entry['_id']}, {'$set': {'access_time': now, 'validation_time': now}})
+            # Keeping the fresh rate limit headers, the rest are taken from the cached response
+            cached_headers = dict(entry['headers'])
+            cached_headers.update({k: v for k, v in response_headers.items() if k.startswith('x-ratelimit')})
+            return 200, cached_headers, entry['output'].encode('UTF-8')
+        self._count('misses')
+        if status == 200 and ('etag' in response_headers or 'last-modified' in response_headers):
+            self._store(key, url, response_headers, output)
+        return status, response_headers, output
+
+    def _store(self, key, url, headers, output):
+        try:
+            output = output.decode('UTF-8')
+        except UnicodeDecodeError:
+            logger.warning('Could not cache non UTF-8 response of {}'.format(url))
+            return
+        now = datetime.now()
+        self._collection.update_one({'key': key}, {'$set': {
+            'url': url,
+            'etag': headers.get('etag'),
+            'last_modified': headers.get('last-modified'),
+            'headers': headers,
+            'output': output,
+            'access_time': now,
+            'validation_time': now
+        }}, upsert=True)
+        with self._lock:
+            self._stores += 1
+            evict = self._stores % self.EVICTION_INTERVAL == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Evicting the least recently used entries that exceeding max_entries"""
+        excess = self._collection.count() - self.max_entries
+        if excess <= 0:
+            return
+        stale = [doc['_id'] for doc in
+                 self._collection.find({}, {'_id': True}).sort('access_time', ASCENDING).limit(excess)]
+        self._collection.delete_many({'_id': {'$in': stale}})
+        self._count('evictions', len(stale))
+        logger.info('Evicted {} entries from the Github response cache'.format(len(stale)))
+
+    def clear(self):
+        self._collection.delete_many({})
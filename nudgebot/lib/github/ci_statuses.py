@@ -0,0 +1,95 @@
+import logging
+
+import github
+
+from common import Singleton, parse_time, to_epoch
+from nudgebot.db import db
+
+
+logging.basicConfig()
+logger = logging.getLogger('CIStatusesLogger')
+logger.setLevel(logging.INFO)
+
+
+class _RawObject(github.GithubObject.NonCompletableGithubObject):
+    """Paginated list item that keeps only the raw data"""
+
+    def _initAttributes(self):
+        pass
+
+    def _useAttributes(self, attributes):
+        pass
+
+
+class CIStatuses(object):
+    """The CI statuses (commit statuses and check runs) of the head commits.
+    The statuses are stored per (sha, context) and updated by the status and check_run events,
+    the full status list of a sha is fetched only if there is no stored state for it.
+    """
+    __metaclass__ = Singleton
+    CHECK_RUNS_ACCEPT = 'application/vnd.github.antiope-preview+json'
+
+    @staticmethod
+    def parse_event(payload):
+        """Returns: the (sha, context, state, description, updated_at) of the status or check_run event
+        or None if the event is not a CI status event"""
+        if 'check_run' in payload:
+            return CIStatuses.parse_check_run(payload['check_run'])
+        if 'sha' in payload and 'context' in payload and 'state' in payload:
+            return (payload['sha'], payload['context'], payload['state'], payload.get('description'),
+                    payload.get('updated_at') or payload.get('created_at'))
+        return None
+
+    @staticmethod
+    def parse_check_run(check_run):
+        state = check_run.get('conclusion') or check_run.get('status')
+        return (check_run['head_sha'], check_run['name'], state,
+                (check_run.get('output') or {}).get('title') or state,
+                check_run.get('completed_at') or check_run.get('started_at'))
+
+    @staticmethod
+    def set_status(repository, sha, context, state, description, updated_at):
+        updated_at = to_epoch(parse_time(updated_at)) if updated_at else 0
+        db().set_ci_status(repository, sha, context, state, description, updated_at)
+
+    def apply_event(self, repository, payload):
+        """Applying the status or check_run event payload.
+        Returns: True if the event is a CI status event"""
+        status = self.parse_event(payload)
+        if status:
+            self.set_status(repository, *status)
+        return bool(status)
+
+    def fetch(self, pull_request):
+        """Fetching all the statuses and check runs of the pull request head"""
+        sha, requester = pull_request.head_sha, pull_request._requester
+        statuses = github.PaginatedList.PaginatedList(
+            _RawObject, requester, '{}/commits/{}/statuses'.format(pull_request.repo.url, sha), None)
+        seen = set()
+        for status in statuses:  # From the newest to the oldest
+            status = status.raw_data
+            if status['context'] not in seen:
+                seen.add(status['context'])
+                self.set_status(pull_request.repo.name, sha, status['context'], status['state'],
+                                status.get('description'), status.get('updated_at'))
+        check_runs = github.PaginatedList.PaginatedList(
+            _RawObject, requester, '{}/commits/{}/check-runs'.format(pull_request.repo.url, sha), None,
+            headers={'Accept': self.CHECK_RUNS_ACCEPT}, list_item='check_runs')
+        try:
+            for check_run in check_runs:
+                self.set_status(pull_request.repo.name, *self.parse_check_run(check_run.raw_data))
+        except github.GithubException as error:
+            logger.warning('Could not fetch the check runs of {}: {}'.format(sha, error))
+        db().set_ci_statuses_fetched(pull_request.repo.name, sha)
+
+    def get_statuses(self, pull_request):
+        """Returns: list of the stored statuses of the pull request head (fetching them if there are none)"""
+        fetched, statuses = db().get_ci_statuses(pull_request.repo.name, pull_request.head_sha)
+        if not fetched:
+            self.fetch(pull_request)
+            fetched, statuses = db().get_ci_statuses(pull_request.repo.name, pull_request.head_sha)
+        return statuses
+
+    def get_test_results(self, pull_request):
+        """Returns: dict of context -> description"""
+        return {status['context']: status['description'] for status in self.get_statuses(pull_request)}
@@ -0,0 +1,143 @@
+import zlib
+import logging
+import threading
+from datetime import datetime
+
+import requests
+from bson.binary import Binary
+from pymongo import ASCENDING
+
+from config import config
+from common import Singleton
+from nudgebot.db import db
+
+
+logging.basicConfig()
+logger = logging.getLogger('DiffsLogger')
+logger.setLevel(logging.INFO)
+
+
+class DiffStats(object):
+    """Computing the size metrics of a unified diff, line by line"""
+
+    def __init__(self):
+        self.paths = {}
+        self._path = None
+        self._in_hunk = False
+
+    def feed(self, line):
+        if line.startswith('diff --git '):
+            self._path = line.rsplit(' b/', 1)[-1]
+            self.paths[self._path] = {'additions': 0, 'deletions': 0}
+            self._in_hunk = False
+        elif line.startswith('@@'):
+            self._in_hunk = self._path is not None
+        elif self._in_hunk:
+            if line.startswith('+'):
+                self.paths[self._path]['additions'] += 1
+            elif line.startswith('-'):
+                self.paths[self._path]['deletions'] += 1
+
+    @property
+    def json(self):
+        additions = sum(path['additions'] for path in self.paths.values())
+        deletions = sum(path['deletions'] for path in self.paths.values())
+        return {
+            'files': len(self.paths),
+            'additions': additions,
+            'deletions': deletions,
+            'changes': additions + deletions,
+            # A list since the paths could not be used as Mongo keys
+            'paths': [dict(stat, path=path) for path, stat in sorted(self.paths.items())]
+        }
+
+
+class DiffService(object):
+    """Fetching the pull request diffs and patches.
+    The responses are streamed up to max_bytes (the rest is dropped and the diff is marked as truncated),
+    the size metrics are computed while streaming and the diffs are stored compressed, keyed by
+    (base sha, head sha).
+    config (diffs):
+        * max_bytes: the maximum size of a diff.
+        * ttl_days: how long to keep the stored diffs.
+    """
+    __metaclass__ = Singleton
+    KINDS = {'diff': 'application/vnd.github.v3.diff', 'patch': 'application/vnd.github.v3.patch'}
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self):
+        diffs_config = config().config.get('diffs', {})
+        self.max_bytes = diffs_config.get('max_bytes', 5 * 1024 * 1024)
+        credentials = config().credentials.github
+        self._local = threading.local()
+        self._auth = (credentials.username, credentials.password)
+        self._collection = db().diffs
+        self._collection.create_index([('base_sha', ASCENDING), ('head_sha', ASCENDING), ('kind', ASCENDING)],
+                                      unique=True)
+        self._collection.create_index([('access_time', ASCENDING)],
+                                      expireAfterSeconds=int(diffs_config.get('ttl_days', 30) * 86400))
+
+    @property
+    def session(self):
+        """A requests session (keeping the connections alive) per thread"""
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+            self._local.session.auth = self._auth
+        return self._local.session
+
+    def stream(self, url, headers=None, line_callback=None, authenticate=True):
+        """Streaming the response of the url up to max_bytes.
+        Returns: (compressed content, size, truncated)
+        """
+        compressor, size, truncated, rest = zlib.compressobj(), 0, False, ''
+        compressed = []
+        response = self.session.get(url, headers=headers, stream=True, auth=None if authenticate else False)
+        try:
+            response.raise_for_status()
+            for chunk in response.iter_content(self.CHUNK_SIZE):
+                if size + len(chunk) > self.max_bytes:
+                    chunk, truncated = chunk[:self.max_bytes - size], True
+                size += len(chunk)
+                compressed.append(compressor.compress(chunk))
+                if line_callback:
+                    lines = (rest + chunk).split('\n')
+                    rest = lines.pop()
+                    for line in lines:
+                        line_callback(line)
+                if truncated:
+                    logger.warning('Truncated {} at {} bytes'.format(url, size))
+                    break
+        finally:
+            response.close()
+        if line_callback and rest and not truncated:
+            line_callback(rest)
+        compressed.append(compressor.flush())
+        return ''.join(compressed), size, truncated
+
+    def _get(self, pull_request, kind):
+        key = {'base_sha': pull_request.base.sha, 'head_sha': pull_request.head.sha, 'kind': kind}
+        entry = self._collection.find_one_and_update(key, {'$set': {'access_time': datetime.now()}})
+        if entry:
+            return entry
+        stats = DiffStats()
+        content, size, truncated = self.stream(pull_request.url, {'Accept': self.KINDS[kind]},
+                                               stats.feed if kind == 'diff' else None)
+        entry = dict(key, content=Binary(content), size=size, truncated=truncated, access_time=datetime.now())
+        if kind == 'diff':
+            entry['stats'] = stats.json
+            if truncated:  # Completing the totals from the pull request
+                entry['stats'].update({'files': pull_request.changed_files, 'additions': pull_request.additions,
+                                       'deletions': pull_request.deletions,
+                                       'changes': pull_request.additions + pull_request.deletions})
+        self._collection.replace_one(key, entry, upsert=True)
+        return entry
+
+    def get_content(self, pull_request, kind='diff'):
+        """Returns: the (possibly truncated) diff or patch of the pull request"""
+        return zlib.decompress(self._get(pull_request, kind)['content'])
+
+    def get_stats(self, pull_request):
+        """Returns: the size metrics of the pull request
+        (files, additions, deletions, changes and per path additions and deletions)"""
+        entry = self._get(pull_request, 'diff')
+        return dict(entry['stats'], truncated=entry['truncated'])
@@ -0,0 +1,149 @@
+import logging
+
+import github
+
+from common import parse_time, to_epoch
+from nudgebot.db import db
+from nudgebot.lib.github.ci_statuses import CIStatuses
+from nudgebot.lib.github.pull_request import PullRequestTitleTag
+from nudgebot.lib.github.pull_request_statistics import PullRequestStatistics
+
+
+logging.basicConfig()
+logger = logging.getLogger('EventDeltasLogger')
+logger.setLevel(logging.INFO)
+
+
+class EventDelta(object):
+    """The change of the pull request statistics by a Github event.
+    The delta patches the stored statistics and the in-memory statistics from the event payload
+    instead of fetching the pull request again:
+        * resources: the Github resources (see stat_property) that the event changed.
+        * refresh: whether the event could not be applied, so the statistics have to be rebuilt.
+    Every event also moves the update time of the pull request forward. That could only turn the
+    inactivity cases off, so it's not considered as a change of the resources.
+    """
+    # The pull request actions that don't change any of the statistics
+    NEUTRAL_ACTIONS = ('labeled', 'unlabeled', 'assigned', 'unassigned', 'milestoned', 'demilestoned',
+                       'locked', 'unlocked')
+    # The edited fields of the pull request (or issue) and the resources they change
+    EDITABLE_FIELDS = {'title': 'title', 'body': 'description'}
+    # The pull request (or issue) fields that are taken from the payload
+    PULL_REQUEST_FIELDS = ('title', 'body', 'updated_at')
+    # resource -> (the payload key of the item, the item class, the sort key of the items)
+    ITEMS = {
+        'reviews': ('review', github.PullRequestReview.PullRequestReview, None),
+        'review_comments': ('comment', github.PullRequestComment.PullRequestComment, lambda c: c.updated_at),
+        'issue_comments': ('comment', github.IssueComment.IssueComment, lambda c: c.updated_at)
+    }
+
+    def __init__(self, payload, resources=(), refresh=False):
+        self.payload = payload
+        self.resources = tuple(resources)
+        self.refresh = refresh
+
+    def __repr__(self):
+        return '<{} action="{}" resources={} refresh={}>'.format(
+            self.__class__.__name__, self.action, self.resources, self.refresh)
+
+    @property
+    def action(self):
+        return self.payload.get('action')
+
+    @classmethod
+    def parse(cls, payload):
+        """Returns: the delta of the event payload (a delta with refresh=True for unknown events)"""
+        action = payload.get('action')
+        if CIStatuses.parse_event(payload):
+            return cls(payload, ('statuses',))
+        if 'review' in payload and action in ('submitted', 'edited', 'dismissed'):
+            return cls(payload, ('reviews',))
+        if 'comment' in payload and action in ('created', 'edited', 'deleted'):
+            if 'pull_request' in payload:
+                return cls(payload, ('review_comments',))
+            if 'issue' in payload:
+                return cls(payload, ('issue_comments',))
+        if 'pull_request' not in payload and 'issue' not in payload:
+            return cls(payload, refresh=True)
+        if action in cls.NEUTRAL_ACTIONS:
+            return cls(payload)
+        if action == 'edited':
+            changes = payload.get('changes', {})
+            if set(changes) - set(cls.EDITABLE_FIELDS):  # e.g. the base branch was changed
+                return cls(payload, refresh=True)
+            return cls(payload, [cls.EDITABLE_FIELDS[field] for field in changes])
+        if action in ('review_requested', 'review_request_removed'):
+            # Only the user requests are collected (see PullRequest.get_reviewer_requests)
+            return cls(payload, ('reviewer_requests',) if payload.get('requested_reviewer') else ())
+        return cls(payload, refresh=True)
+
+    @property
+    def changed_stats(self):
+        """The stats that the event changed"""
+        return PullRequestStatistics.dependents(*self.resources)
+
+    @property
+    def pull_request_data(self):
+        data = self.payload.get('pull_request') or self.payload.get('issue') or {}
+        return {field: data[field] for field in self.PULL_REQUEST_FIELDS if field in data}
+
+    def get_fields(self, repository):
+        """Returns: (the fields to set, the fields to raise) of the stored statistics of the pull request"""
+        data = self.pull_request_data
+        fields, max_fields = {}, {}
+        if 'title' in data:
+            fields['title'] = data['title']
+            fields['title_tags'] = [tag.name for tag in PullRequestTitleTag.fetch(data['title'])]
+        if 'body' in data:
+            fields['description'] = data['body'] or ''
+        if data.get('updated_at'):
+            max_fields['last_update'] = to_epoch(parse_time(data['updated_at']))
+        status = CIStatuses.parse_event(self.payload)
+        if status:
+            fetched, statuses = db().get_ci_statuses(repository, status[0])
+            if fetched:  # Otherwise the statuses are fetched with the statistics
+                fields['test_results'] = {status['context']: status['description'] for status in statuses}
+        return fields, max_fields
+
+    def _patch_items(self, resource, requester):
+        key, item_class, sort_key = self.ITEMS[resource]
+        data = self.payload[key]
+        if resource == 'reviews':  # The review states of the events are in lower case
+            data = dict(data, state=data.get('state', '').upper())
+
+        def patch(items):
+            item = item_class(requester, {}, data, completed=True)
+            patched = [existing for existing in items if existing.id != item.id]
+            if self.action != 'deleted':
+                if len(patched) < len(items):  # Keeping the position of the edited item
+                    patched = [item if existing.id == item.id else existing for existing in items]
+                else:
+                    patched.append(item)
+            if sort_key:
+                patched.sort(key=sort_key)
+            return patched
+        return patch
+
+    def _patch_reviewer_requests(self, requester):
+        reviewer = self.payload['requested_reviewer']
+
+        def patch(reviewer_requests):
+            patched = [request for request in reviewer_requests if request.login != reviewer['login']]
+            if self.action == 'review_requested':
+                patched.append(github.PullRequestReviewerRequest.PullRequestReviewerRequest(
+                    requester, {}, reviewer, completed=False))
+            return patched
+        return patch
+
+    def apply(self, pr_stats):
+        """Patching the in-memory statistics <pr_stats> by the event payload"""
+        pull_request = pr_stats.pull_request
+        pull_request._github_obj._useAttributes(self.pull_request_data)
+        pr_stats.invalidate('last_update')
+        for resource in self.resources:
+            if resource in self.ITEMS:
+                pr_stats.patch(resource, self._patch_items(resource, pull_request._requester))
+            elif resource == 'reviewer_requests':
+                pr_stats.patch(resource, self._patch_reviewer_requests(pull_request._requester))
+            else:  # The stat is taken again from the patched pull request or from the stored CI statuses
+                pr_stats.invalidate(resource)
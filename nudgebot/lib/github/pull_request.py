@@ -1,15 +1,14 @@
 # -*- coding: utf-8 -*-
-import json
-import re
+import zlib
 
 from cached_property import cached_property
-import dateparser
-import requests
 import github
 
 from .users import User, ContributorUser, ReviewerUser
+from .diffs import DiffService
+from .ci_statuses import CIStatuses
 from config import config
-from common import Age, as_local_time
+from common import Age, as_utc_time, parse_time
 
 
 class ReviewCommentThread(object):
@@ -52,9 +51,11 @@ class ReviewCommentThread(object):
         return self._comments[0].position is None
 
     @classmethod
-    def fetch_threads(cls, pull_request):
+    def fetch_threads(cls, pull_request, review_comments=None):
         threads = {}
-        for comment in pull_request.review_comments:
+        if review_comments is None:
+            review_comments = pull_request.review_comments
+        for comment in review_comments:
             key = '{}:{}'.format(comment.path, comment.original_position)
             if key in threads:
                 threads[key].add_comment(comment)
@@ -77,7 +78,7 @@ class PullRequestTitleTag(object):
         """
         assert isinstance(title, basestring)
         detected_tags = []
-        tag_names = re.findall(config().config.github.pull_request_title_tag.pattern, title)
+        tag_names = config().snapshot.title_tag_pattern.findall(title)
         for tag_name in tag_names:
             tag_name = tag_name.upper()
             detected_tags.append(cls(tag_name.upper()))
@@ -100,7 +101,7 @@ class PullRequestTitleTag(object):
 
     @property
     def raw(self):
-        return config().config.github.pull_request_title_tag.format.format(self.name)
+        return config().snapshot.title_tag_format.format(self.name)
 
     @property
     def json(self):
@@ -148,17 +149,70 @@ class PullRequest(object):
     def commits(self):
         return self.get_commits()
 
+    @property
+    def head_sha(self):
+        return self._github_obj.head.sha
+
+    @property
+    def head_commit(self):
+        """The tip commit of the pull request. The commit is not fetched
+        until one of its attributes other than the sha is used."""
+        return github.Commit.Commit(self._github_obj._requester, {}, {
+            'sha': self.head_sha,
+            'url': '{}/commits/{}'.format(self.repo.url, self.head_sha)
+        }, completed=False)
+
+    @property
+    def commits_record(self):
+        """The commits record of the pull request: its head sha, the commit shas and the last
+        modification time of the head commit. The record is refreshed only when the head sha changes."""
+        from nudgebot.db import db
+        record = db().get_pr_commits(self.repo.owner.login, self.repo.name, self.number)
+        # Records without the last modification time were stored before the fallback to the committer date
+        if not record or record['head_sha'] != self.head_sha or not record.get('last_modified'):
+            record = self.fetch_commits_record(record)
+            db().set_pr_commits(record)
+        return record
+
+    def fetch_commits_record(self, previous_record=None):
+        """Fetching the commits record, only the new commits are fetched if the pull request
+        was pushed on top of the previous head"""
+        commits = None
+        if previous_record:
+            comparison = self.repo.compare(previous_record['head_sha'], self.head_sha)
+            # The comparison lists up to 250 commits
+            if comparison.status == 'ahead' and len(comparison.commits) == comparison.total_commits:
+                commits = previous_record['commits'] + [commit.sha for commit in comparison.commits]
+        if commits is None:  # New or force pushed
+            commits = [commit.sha for commit in self._github_obj.get_commits()]
+        head_commit = self.repo.get_commit(self.head_sha)
+        return {
+            'organization': self.repo.owner.login,
+            'repository': self.repo.name,
+            'number': self.number,
+            'head_sha': self.head_sha,
+            'commits': commits,
+            # Github doesn't always send the Last-Modified header of the commit
+            'last_modified': head_commit.last_modified or head_commit.commit.committer.date
+        }
+
     @property
     def html(self):
-        return requests.get(self._github_obj.html_url).content
+        content, _, _ = DiffService().stream(self._github_obj.html_url, authenticate=False)
+        return zlib.decompress(content)
 
     @property
     def patch(self):
-        return requests.get(self._github_obj.patch_url).content.encode('UTF-8')
+        return DiffService().get_content(self, 'patch')
 
     @property
     def diff(self):
-        return requests.get(self._github_obj.diff_url).content.encode('UTF-8')
+        return DiffService().get_content(self, 'diff')
+
+    @property
+    def size(self):
+        """The size metrics of the pull request (see DiffService.get_stats)"""
+        return DiffService().get_stats(self)
 
     @property
     def title_tags(self):
@@ -168,25 +222,26 @@ class PullRequest(object):
     def title_tags(self, title_tags):
         """Setting the title_tags <title_tags> to the pull request title
         """
+        return self._github_obj.edit(self.title_with_tags(title_tags))
+
+    def title_with_tags(self, title_tags):
+        """Returns: the title of the pull request with the title tags replaced by <title_tags>"""
         if isinstance(title_tags, basestring):
             title_tags = [title_tags]
         title_tags = [PullRequestTitleTag(tag) for tag in title_tags]
-        return self._github_obj.edit(
-            '{} {}'.format(
-                ''.join([t.raw for t in title_tags]), re.split(
-                    config().config.github.pull_request_title_tag.pattern, self.title
-                    )[-1].strip()
-            )
+        return '{} {}'.format(
+            ''.join([t.raw for t in title_tags]),
+            config().snapshot.title_tag_pattern.split(self.title)[-1].strip()
         )
 
     def remove_title_tags(self, *title_tags):
-        return self._github_obj.edit(
-            '{} {}'.format(
-                ''.join([t.raw for t in title_tags if t not in self.title_tags]),
-                re.split(config().config.github.pull_request_title_tag.pattern,
-                         self.title)[-1].strip()
-            ).strip()
-        )
+        return self._github_obj.edit(self.title_without_tags(*title_tags))
+
+    def title_without_tags(self, *title_tags):
+        return '{} {}'.format(
+            ''.join([t.raw for t in title_tags if t not in self.title_tags]),
+            config().snapshot.title_tag_pattern.split(self.title)[-1].strip()
+        ).strip()
 
     @title_tags.deleter
     def title_tags(self):
@@ -200,29 +255,35 @@ class PullRequest(object):
     def reviewer_requests(self):
         return self.get_reviewer_requests()
 
-    @property
-    def all_reviewers(self):
+    @staticmethod
+    def collect_reviewers(review_comment_threads, reviewer_requests):
         # Including both existing reviewers and reviewers from reviewer request
         # Including reviewers that not in the pool
         reviewers = []
-        for review_comment in self.review_comment_threads:
+        for review_comment in review_comment_threads:
             reviewers.append(ReviewerUser(review_comment.first_comment.user.login))
-        for review_request in self.reviewer_requests:
+        for review_request in reviewer_requests:
             reviewer = ReviewerUser(review_request.login)
             if reviewer not in reviewers:
                 reviewers.append(reviewer)
         return list(set(reviewers))
 
     @property
-    def reviewers(self):
-        reviewers = self.all_reviewers
-        # Filtering reviewers that not in the pool and updating the pool
+    def all_reviewers(self):
+        return self.collect_reviewers(self.review_comment_threads, self.reviewer_requests)
+
+    def filter_pool_reviewers(self, reviewers):
+        """Filtering reviewers that not in the pool and updating the pool"""
+        pool_reviewers = []
         for reviewer in reviewers:
             if reviewer in self.repo.reviewers_pool.reviewers:
                 self.repo.reviewers_pool.attach_pr_to_reviewer(reviewer, self.number)
-            else:
-                reviewers.remove(reviewer)
-        return reviewers
+                pool_reviewers.append(reviewer)
+        return pool_reviewers
+
+    @property
+    def reviewers(self):
+        return self.filter_pool_reviewers(self.all_reviewers)
 
     def create_review(self, commit, body, event=None, comments=None):
         """
@@ -305,25 +366,30 @@ class PullRequest(object):
 
     @property
     def test_results(self):
-        auth = (config().credentials.github.username, config().credentials.github.password)
-        tests = json.loads(requests.get(self._github_obj.raw_data['statuses_url'], auth=auth).content)
-        out = {}
-        for test in tests:
-            out[test['context']] = test['description']
-        return out
+        return CIStatuses().get_test_results(self)
 
     @property
     def owner(self):
         return ContributorUser(self._github_obj.user)
 
+    @staticmethod
+    def commits_last_update(commits_record):
+        """Returns: the last modification time of the commits record, a timestamp string (Last-Modified
+        header) or the (naive UTC) committer date"""
+        last_modified = commits_record['last_modified']
+        return parse_time(last_modified) if isinstance(last_modified, basestring) else last_modified
+
     @property
     def last_code_update(self):
-        return dateparser.parse(list(self._github_obj.get_commits()).pop().last_modified)
+        return self.commits_last_update(self.commits_record)
 
     @property
     def last_update(self):
-        last_update = as_local_time(self._github_obj.updated_at, raise_if_native_time=False)
-        last_code_update = as_local_time(self.last_code_update, raise_if_native_time=False)
+        return self.get_last_update(self.last_code_update)
+
+    def get_last_update(self, last_code_update):
+        last_update = as_utc_time(self._github_obj.updated_at)
+        last_code_update = as_utc_time(last_code_update)
         if last_update > last_code_update:
             return last_update
         return last_code_update
@@ -1,21 +1,42 @@
+import time
+import logging
 from datetime import datetime
 
 from cached_property import cached_property
 
+from config import config
+from common import to_epoch
 from nudgebot.lib.github.users import ReviewerUser
+from nudgebot.lib.github.pull_request import ReviewCommentThread, PullRequestTitleTag
 from nudgebot.lib.statistics import Statistics, stat_property
 
 
+logging.basicConfig()
+logger = logging.getLogger('PullRequestStatisticsLogger')
+logger.setLevel(logging.INFO)
+
+
 class PullRequestStatistics(Statistics):
+    # The stats that require a Github request, fetched concurrently by prefetch()
+    PREFETCH_STATS = ('commits_record', 'size', 'reviews', 'review_comments', 'issue_comments',
+                      'test_results', 'reviewer_requests')
+    # The stats that are stored by get_json()
+    STORED_STATS = ('title', 'owner', 'description', 'age', 'last_update', 'size', 'test_results', 'title_tags',
+                    'reviewers', 'review_states_by_user', 'total_review_comments', 'total_review_comment_threads',
+                    'last_review_comment', 'review_comment_reaction_statuses')
+    # The stats that change without a change of the pull request (by the time or by the reviewers pool),
+    # they are dropped before statistics that are kept in memory are evaluated again
+    VOLATILE_STATS = ('time_since_last_update', 'review_comment_reaction_statuses', 'reviewers')
 
     def __init__(self, pull_request):
+        super(PullRequestStatistics, self).__init__()
         self._pull_request = pull_request
 
     @cached_property
     def pull_request(self):
         return self._pull_request
 
-    @stat_property
+    @stat_property(resources=('title',))
     def title(self):
         return self._pull_request.title
 
@@ -23,7 +44,7 @@ class PullRequestStatistics(Statistics):
     def owner(self):
         return self._pull_request.owner
 
-    @stat_property
+    @stat_property(resources=('description',))
     def description(self):
         return self._pull_request.description
 
@@ -39,79 +60,95 @@ class PullRequestStatistics(Statistics):
     def repo(self):
         return self._pull_request.repo
 
-    @stat_property
+    @stat_property(depends_on=('repo',))
     def org(self):
         return self.repo().organization or self.repo().owner
 
-    @stat_property
-    def commits(self):
-        return self._pull_request.commits
+    @stat_property(resources=('commits',))
+    def commits_record(self):
+        return self._pull_request.commits_record
 
-    @stat_property
+    @stat_property(resources=('commits',))
+    def head_commit(self):
+        return self._pull_request.head_commit
+
+    @stat_property(resources=('commits',))
+    def size(self):
+        return self._pull_request.size
+
+    @stat_property(resources=('issue_comments',))
     def issue_comments(self):
         return self._pull_request.issue_comments
 
-    @stat_property
+    @stat_property(resources=('review_comments',))
     def review_comments(self):
         return self._pull_request.review_comments
 
-    @stat_property
+    @stat_property(resources=('statuses',))
     def test_results(self):
         return self._pull_request.test_results
 
-    @stat_property
+    @stat_property(depends_on=('commits_record',))
     def last_code_update(self):
-        return self._pull_request.last_code_update
+        return self._pull_request.commits_last_update(self.commits_record())
 
-    @stat_property
+    @stat_property(depends_on=('last_code_update',), resources=('title', 'description'))
     def last_update(self):
-        return self._pull_request.last_update
+        return self._pull_request.get_last_update(self.last_code_update())
 
-    @stat_property
+    @stat_property(depends_on=('last_update',))
     def time_since_last_update(self):
-        return datetime.now() - self.last_update()
+        return datetime.utcnow() - self.last_update()
 
-    @stat_property
+    @stat_property(depends_on=('title',))
     def title_tags(self):
-        return self._pull_request.title_tags
+        return PullRequestTitleTag.fetch(self.title())
 
-    @stat_property
+    @stat_property(resources=('reviews',))
     def reviews(self):
-        return self._pull_request.reviews
+        return list(self._pull_request.reviews)
 
-    @stat_property
+    @stat_property(resources=('reviewer_requests',))
     def reviewer_requests(self):
         return self.pull_request.get_reviewer_requests()
 
-    @stat_property
+    @stat_property(depends_on=('review_comments',))
+    def review_comment_threads(self):
+        return ReviewCommentThread.fetch_threads(self._pull_request, self.review_comments())
+
+    @stat_property(depends_on=('review_comment_threads', 'reviewer_requests'))
+    def all_reviewers(self):
+        return self._pull_request.collect_reviewers(self.review_comment_threads(), self.reviewer_requests())
+
+    @stat_property(depends_on=('all_reviewers',))
     def reviewers(self):
-        return self._pull_request.reviewers
+        return self._pull_request.filter_pool_reviewers(self.all_reviewers())
 
-    @stat_property
+    @stat_property(depends_on=('reviews',))
     def review_states_by_user(self):
         review_states = {}
         for review in self.reviews():
             review_states[ReviewerUser(review.user.login)] = review.state
         return review_states
 
-    @stat_property
+    @stat_property(depends_on=('review_comments',))
     def last_review_comment(self):
         review_comments = self.review_comments()
         if review_comments:
             return max(review_comments, key=lambda item: (item.updated_at or item.created_at))
 
-    @stat_property
+    @stat_property(depends_on=('review_states_by_user', 'review_comment_threads', 'owner'))
     def review_comment_reaction_statuses(self):
         statuses = []
         review_states = self.review_states_by_user()
-        review_comment_threads = self.pull_request.review_comment_threads
+        review_comment_threads = self.review_comment_threads()
         for thread in review_comment_threads:
             if not thread.outdated:
                 last_comment = thread.last_comment
                 reviewer = ReviewerUser(thread.first_comment.user.login)
                 is_require_changes = review_states.get(reviewer) == 'CHANGES_REQUESTED'
                 if is_require_changes:
-                    age_seconds = (datetime.now() - last_comment.created_at).total_seconds()
+                    age_seconds = (datetime.utcnow() - last_comment.created_at).total_seconds()
                     statuses.append({
                         'reviewer': reviewer,
                         'contributor': self.owner(),
@@ -120,34 +157,63 @@ class PullRequestStatistics(Statistics):
                     })
         return statuses
 
-    @stat_property
+    @stat_property(depends_on=('review_comments',))
     def total_review_comments(self):
-        return len(self.pull_request.review_comments)
+        return len(self.review_comments())
 
-    @stat_property
+    @stat_property(depends_on=('review_comment_threads',))
     def total_review_comment_threads(self):
-        return len(self.pull_request.review_comment_threads)
+        return len(self.review_comment_threads())
+
+    def prefetch(self, pool_size=None):
+        """Concurrently fetching all the Github resources of the statistics, so the
+        fetch time is roughly the slowest request instead of the sum of all of them.
+        Returns: dict of the fetch duration (seconds) of each stat property.
+        """
+        if pool_size is None:
+            pool_size = config().config.get('prefetch', {}).get('pool_size')
+        start = time.time()
+        timings = super(PullRequestStatistics, self).prefetch(self.PREFETCH_STATS, pool_size)
+        if timings:
+            logger.info('Prefetched pull request #{} in {:.2f}s (sequential {:.2f}s): {}'.format(
+                self.number(), time.time() - start, sum(timings.values()),
+                ', '.join(['{}={:.2f}s'.format(name, duration)
+                           for name, duration in sorted(timings.items(), key=lambda t: -t[1])])))
+        return timings
+
+    def key(self):
+        """The key of the pull request (organization, repository and number)"""
+        return {
+            'organization': getattr(self.org(), 'login', self.org().name),
+            'repository': self.repo().name,
+            'number': self.number()
+        }
 
     def get_json(self):
         """Get the object data as dictionary"""
         last_review_comment = self.last_review_comment()
-        data = {
-            'number': self.number(),
+        data = self.key()
+        data.update({
             'title': self.title(),
             'owner': self.owner().login,
             'description': self.description(),
-            'age': self.age(),
-            'organization': getattr(self.org(), 'login', self.org().name),
-            'repository': self.repo().name,
-            'last_update': self.last_update(),
+            'age': to_epoch(self.age()),  # Epoch seconds
+            'last_update': to_epoch(self.last_update()),
+            'size': {key: value for key, value in self.size().items() if key != 'paths'},
             'test_results': self.test_results(),
             'title_tags': [tt.name for tt in self.title_tags()],
             'reviewers': [reviewer.login for reviewer in self.reviewers()],
             'review_states_by_user': {user.login: state for user, state in self.review_states_by_user().items()},
             'total_review_comments': self.total_review_comments(),
             'total_review_comment_threads': self.total_review_comment_threads(),
+            'review_comment_reaction_statuses': [{
+                'reviewer': status['reviewer'].login,
+                'last_comment': {'login': status['last_comment'].user.login,
+                                 'created_at': to_epoch(status['last_comment'].created_at),
+                                 'url': status['last_comment'].url}
+            } for status in self.review_comment_reaction_statuses()],
             'last_review_comment': {'login': '', 'body': '', 'updated_at': ''}
-        }
+        })
         if last_review_comment:
             data['last_review_comment'] = {
                 'login': last_review_comment.user.login,
@@ -33,12 +33,20 @@ class Repository(object):
         return prs
 
     @cached_property
-    def config(self):
+    def config_key(self):
+        """The (organization, repository) key of the repository in the config"""
         org_name = (getattr(self._github_obj.organization, 'name', None) or
                     self._github_obj.owner.login)
-        return [repo for repo in config().config.github.repos
-                if repo.org == org_name
-                and repo.repo == self._github_obj.name].pop()
+        return org_name, self._github_obj.name
+
+    @property
+    def config(self):
+        return config().snapshot.repos[self.config_key]
+
+    @property
+    def reviewer_levels(self):
+        """dict of the reviewers in the config: login -> level"""
+        return config().snapshot.reviewer_levels[self.config_key]
 
     @cached_property
     def reviewers_pool(self):
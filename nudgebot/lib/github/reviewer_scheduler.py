@@ -0,0 +1,202 @@
+import itertools
+
+
+class NoAvailableReviewerError(Exception):
+    pass
+
+
+class IndexedHeap(object):
+    """A binary min heap with an index of the item positions, so the priority of any item
+    could be updated (or the item removed) in O(log n)."""
+
+    def __init__(self):
+        self._heap = []  # [(priority, item)]
+        self._positions = {}
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, item):
+        return item in self._positions
+
+    def push(self, item, priority):
+        """Adding the item or updating its priority"""
+        if item in self._positions:
+            position = self._positions[item]
+            old_priority = self._heap[position][0]
+            self._heap[position] = (priority, item)
+            if priority < old_priority:
+                self._sift_up(position)
+            else:
+                self._sift_down(position)
+            return
+        self._heap.append((priority, item))
+        self._positions[item] = len(self._heap) - 1
+        self._sift_up(len(self._heap) - 1)
+
+    def peek(self):
+        return self._heap[0][1] if self._heap else None
+
+    def pop(self):
+        item = self._heap[0][1]
+        self.remove(item)
+        return item
+
+    def remove(self, item):
+        position = self._positions.pop(item)
+        last = self._heap.pop()
+        if position < len(self._heap):
+            self._heap[position] = last
+            self._positions[last[1]] = position
+            self._sift_up(position)
+            self._sift_down(self._positions[last[1]])
+
+    def _swap(self, i, j):
+        self._heap[i], self._heap[j] = self._heap[j], self._heap[i]
+        self._positions[self._heap[i][1]] = i
+        self._positions[self._heap[j][1]] = j
+
+    def _sift_up(self, position):
+        while position:
+            parent = (position - 1) // 2
+            if self._heap[position][0] >= self._heap[parent][0]:
+                break
+            self._swap(position, parent)
+            position = parent
+
+    def _sift_down(self, position):
+        size = len(self._heap)
+        while True:
+            smallest = position
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < size and self._heap[child][0] < self._heap[smallest][0]:
+                    smallest = child
+            if smallest == position:
+                return
+            self._swap(position, smallest)
+            position = smallest
+
+
+class ReviewerState(object):
+
+    def __init__(self, login, level, weight=1.0, capacity=None):
+        self.login = login
+        self.level = level
+        self.weight = float(weight)
+        self.capacity = capacity
+        self.pull_requests = {}  # number -> weight of the pull request
+        self.load = 0.0
+        self.assigned = 0
+        self.last_assigned = 0
+
+    @property
+    def at_capacity(self):
+        return self.capacity is not None and self.load >= self.capacity
+
+
+class SchedulingPolicy(object):
+    """A base class for a reviewers scheduling policy, the reviewer with the lowest priority is picked"""
+    NAME = None
+
+    def priority(self, reviewer):
+        raise NotImplementedError()
+
+    @classmethod
+    def get_by_name(cls, name):
+        for policy in cls.__subclasses__():
+            if policy.NAME == name:
+                return policy()
+        raise ValueError('Unknown scheduling policy "{}"'.format(name))
+
+
+class LeastLoadedPolicy(SchedulingPolicy):
+    """Picking the reviewer with the lowest weighted load, ties are broken by the least recently assigned"""
+    NAME = 'least_loaded'
+
+    def priority(self, reviewer):
+        return (reviewer.load / reviewer.weight, reviewer.last_assigned, reviewer.login)
+
+
+class WeightedRoundRobinPolicy(SchedulingPolicy):
+    """Picking the reviewers in turns, proportionally to their weights"""
+    NAME = 'weighted_round_robin'
+
+    def priority(self, reviewer):
+        return ((reviewer.assigned + 1) / reviewer.weight, reviewer.last_assigned, reviewer.login)
+
+
+class ReviewerScheduler(object):
+    """Schedules the reviewers by the policy, keeping a priority queue per level.
+    Reviewers at their capacity are kept out of the queue until their load decreases.
+    """
+
+    def __init__(self, policy=None, capacity=None):
+        self.policy = policy or LeastLoadedPolicy()
+        self.capacity = capacity
+        self._reviewers = {}
+        self._queues = {}
+        self._sequence = itertools.count(1)
+
+    def __contains__(self, login):
+        return login in self._reviewers
+
+    def get(self, login):
+        return self._reviewers[login]
+
+    def add_reviewer(self, login, level, weight=1.0, capacity=None):
+        reviewer = self._reviewers.get(login)
+        if reviewer and reviewer.level != level and login in self._queues[reviewer.level]:
+            self._queues[reviewer.level].remove(login)  # Reviewers at capacity are already out of the queue
+        if reviewer:
+            reviewer.level, reviewer.weight = level, float(weight)
+            reviewer.capacity = capacity if capacity is not None else self.capacity
+        else:
+            reviewer = self._reviewers[login] = ReviewerState(
+                login, level, weight, capacity if capacity is not None else self.capacity)
+        self._update(reviewer)
+
+    def _update(self, reviewer):
+        queue = self._queues.setdefault(reviewer.level, IndexedHeap())
+        if reviewer.at_capacity:
+            if reviewer.login in queue:
+                queue.remove(reviewer.login)
+        else:
+            queue.push(reviewer.login, self.policy.priority(reviewer))
+
+    def attach(self, login, pull_request_number, weight=1.0):
+        reviewer = self._reviewers[login]
+        reviewer.load += weight - reviewer.pull_requests.get(pull_request_number, 0)
+        reviewer.pull_requests[pull_request_number] = weight
+        self._update(reviewer)
+
+    def detach(self, login, pull_request_number):
+        reviewer = self._reviewers[login]
+        if pull_request_number in reviewer.pull_requests:
+            reviewer.load -= reviewer.pull_requests.pop(pull_request_number)
+            self._update(reviewer)
+
+    def pick(self, level, exclude=()):
+        """Picking the reviewer of the level (without attaching it), O(log n) per excluded reviewer.
+        Raises: NoAvailableReviewerError if there is no eligible reviewer in the level.
+        """
+        queue = self._queues.get(level)
+        skipped = []
+        try:
+            while queue:
+                login = queue.pop()
+                skipped.append(login)
+                if login not in exclude:
+                    return login
+        finally:
+            for login in skipped:
+                self._update(self._reviewers[login])
+        raise NoAvailableReviewerError('No available reviewer in level {}'.format(level))
+
+    def assign(self, level, pull_request_number, weight=1.0, exclude=()):
+        """Picking a reviewer of the level and attaching the pull request to it"""
+        login = self.pick(level, exclude)
+        reviewer = self._reviewers[login]
+        reviewer.assigned += 1
+        reviewer.last_assigned = next(self._sequence)
+        self.attach(login, pull_request_number, weight)
+        return login
@@ -1,10 +1,14 @@
 import logging
+import threading
 
 from cached_property import cached_property
 
 from config import config
-from nudgebot.lib.github.users import ReviewerUser
+from common import Age
+from nudgebot.lib.github.users import User, ReviewerUser
+from nudgebot.lib.github.reviewer_scheduler import ReviewerScheduler, SchedulingPolicy
 from nudgebot.db import db
+from nudgebot.change_bus import ChangeBus
 
 
 logging.basicConfig()
@@ -13,9 +17,16 @@ logger.setLevel(logging.INFO)
 
 
 class ReviewersPool(object):
+    """The reviewers pool of a repository.
+    Each reviewer is stored in its own document and changed with atomic updates, the updates are
+    buffered and written at once by flush().
+    """
 
     def __init__(self, repository):
         self._repository = repository
+        self._lock = threading.RLock()
+        self._pending_updates = []
+        self._scheduler_config = config().config.get('reviewers_scheduler', {})
         self.reload_db()
 
     @cached_property
@@ -45,43 +56,74 @@ class ReviewersPool(object):
             raise Exception('Reviewer not found in the pool: {}'.format(reviewer))
         return self._pool[reviewer]['level']
 
-    def initialize(self):
+    def initialize(self, pull_requests=None):
+        """Initializing the reviewers levels from the config and attaching the reviewers of the
+        <pull_requests> (the reviewers of each pull request are fetched once).
+        NudgeBot.initialize doesn't pass the pull requests since processing them attaches their reviewers.
+        """
         logger.info('Initializing Reviewers pool of repository "{}"...'.format(self.repository.name))
-        repo_pulls = self._repository.get_pull_requests()
-        for level, logins in enumerate(self._repository.config.reviewers):
-            level += 1
-            for login in logins:
+        with self._lock:
+            for login, level in self._repository.reviewer_levels.items():
                 if login in self._pool:
                     self._pool[login]['level'] = level
                 else:
                     self._pool[login] = {'level': level, 'pull_requests': []}
-
-            for pull_request in repo_pulls:
+                self._add_to_scheduler(login, level)
+                self._pending_updates.append(db().set_reviewer_level(
+                    self._repository.owner.login, self._repository.name, login, level))
+            for pull_request in (pull_requests or []):
                 for reviewer in pull_request.reviewers:
-                    if reviewer.login not in self._pool:
-                        continue
                     self.attach_pr_to_reviewer(reviewer.login, pull_request.number)
-        self.update_db()
+            self.flush()
 
-    def update_db(self):
-        # We are copying the dict in order to prevent the addition of '_id'
-        if not db().reviewers_pool.find_one():
-            db().reviewers_pool.insert_one(self._pool.copy())
-            return
-        db().reviewers_pool.update({}, self._pool.copy())
+    def reload_config(self):
+        """Rebuilding the scheduler and applying the reviewer levels of the reloaded config"""
+        self._scheduler_config = config().config.get('reviewers_scheduler', {})
+        self.reload_db()
+        self.initialize()
+
+    def flush(self):
+        """Writing the buffered updates of the pool"""
+        with self._lock:
+            updates, self._pending_updates = self._pending_updates, []
+            pool = {login: {'level': info['level'], 'pull_requests': list(info['pull_requests'])}
+                    for login, info in self._pool.items()}
+        if updates:
+            db().update_reviewers(updates)
+            ChangeBus().publish('reviewers_pool', {'organization': self._repository.owner.login,
+                                                   'repository': self._repository.name, 'pool': pool})
 
     def reload_db(self):
-        pool = db().reviewers_pool.find_one({})
-        if pool:
-            del pool['_id']
-            self._pool = pool
-        else:
-            self._pool = {}
-            self.update_db()
+        with self._lock:
+            self._pool = {doc['login']: {'level': doc['level'], 'pull_requests': doc['pull_requests']}
+                          for doc in db().get_reviewers_pool(self._repository.owner.login, self._repository.name)}
+            self._pr_weights = {
+                stat['number']: self.pr_weight(stat.get('age'), stat.get('size', {}).get('changes', 0))
+                for stat in db().get_pr_stats(self._repository.owner.login, self._repository.name,
+                                              {'number': True, 'age': True, 'size': True})}
+            self._scheduler = ReviewerScheduler(
+                SchedulingPolicy.get_by_name(self._scheduler_config.get('policy', 'least_loaded')),
+                self._scheduler_config.get('capacity'))
+            for login, info in self._pool.items():
+                self._add_to_scheduler(login, info['level'])
+                for number in info['pull_requests']:
+                    self._scheduler.attach(login, number, self._pr_weights.get(number, 1.0))
+
+    def _add_to_scheduler(self, login, level):
+        self._scheduler.add_reviewer(login, level, self._scheduler_config.get('reviewer_weights', {}).get(login, 1.0))
+
+    def pr_weight(self, created_at, changed_lines=0):
+        """The load of a pull request on its reviewers, weighted by the pull request size and age"""
+        weight = 1.0 + self._scheduler_config.get('pr_size_weight', 0) * changed_lines / 100.0
+        if created_at is not None:
+            age_days = Age(created_at).total_seconds / 86400.0
+            weight += self._scheduler_config.get('pr_age_weight', 0) * max(age_days, 0)
+        return weight
 
     def update_from_pr_stats(self, pr_stats):
         """Updating the pool from according to the pull request statistics"""
         stat_reviewers = [r.login for r in pr_stats.reviewers()]
+        self._pr_weights[pr_stats.number()] = self.pr_weight(pr_stats.age(), pr_stats.size()['changes'])
         for login in self.reviewers:
             pr_merged = pr_stats.pull_request.state != 'open'
             already_attached = pr_stats.number() in self._pool[login]['pull_requests']
@@ -91,26 +133,41 @@ class ReviewersPool(object):
             elif not already_attached and reviewer_was_set:
                 self.attach_pr_to_reviewer(login, pr_stats.number())
 
-    def pull_reviewer(self, level, pull_request):
-        """Pulling a reviewer and update the pool"""
-        # TODO: pull formula
-        reviewers = filter(lambda r: (r[0] not in pull_request.reviewers
-                                      and r[0] != pull_request.owner.login
-                                      and r[1]['level'] == level), self._pool.items())
-        reviewer = min(reviewers, key=lambda rev: len(rev[1]['pull_requests']))
-        if not reviewer:
-            raise Exception()  # TODO: Define appropriate exception
-        if not config().config.testing_mode:
-            self.attach_pr_to_reviewer(reviewer[0], pull_request.number)
-        return ReviewerUser(reviewer[0])
+    def pull_reviewer(self, level, pull_request, exclude=None):
+        """Pulling a reviewer by the scheduling policy and update the pool
+        Args:
+            * level: the level of the reviewer.
+            * pull_request: the PullRequest.
+            * exclude (optional): logins that should not be pulled, defaults to the pull request reviewers.
+        Raises: NoAvailableReviewerError if there is no eligible reviewer.
+        """
+        if exclude is None:
+            exclude = [reviewer.login for reviewer in pull_request.reviewers]
+        exclude = set(exclude) | {pull_request.owner.login}
+        with self._lock:
+            if config().snapshot.testing_mode:
+                return ReviewerUser(self._scheduler.pick(level, exclude))
+            login = self._scheduler.assign(level, pull_request.number,
+                                           self._pr_weights.get(pull_request.number, 1.0), exclude)
+            self.attach_pr_to_reviewer(login, pull_request.number)
+        return ReviewerUser(login)
 
     def attach_pr_to_reviewer(self, reviewer_login, pull_request_number, detach=False):
         pull_request_number = int(pull_request_number)
+        if isinstance(reviewer_login, User):
+            reviewer_login = reviewer_login.login
         if reviewer_login not in self._pool:
             raise Exception()  # TODO: Define appropriate exception
-        already_attached = pull_request_number in self._pool[reviewer_login]['pull_requests']
-        if detach and already_attached:
-            self._pool[reviewer_login]['pull_requests'].remove(pull_request_number)
-        elif not detach and not already_attached:
-            self._pool[reviewer_login]['pull_requests'].append(pull_request_number)
-        self.update_db()  # TODO: update the relevant field instead of update all
+        with self._lock:
+            already_attached = pull_request_number in self._pool[reviewer_login]['pull_requests']
+            if detach and already_attached:
+                self._pool[reviewer_login]['pull_requests'].remove(pull_request_number)
+                self._scheduler.detach(reviewer_login, pull_request_number)
+            elif not detach and not already_attached:
+                self._pool[reviewer_login]['pull_requests'].append(pull_request_number)
+                self._scheduler.attach(reviewer_login, pull_request_number,
+                                       self._pr_weights.get(pull_request_number, 1.0))
+            else:
+                return
+            self._pending_updates.append(db().attach_pr_to_reviewer(
+                self._repository.owner.login, self._repository.name, reviewer_login, pull_request_number, detach))
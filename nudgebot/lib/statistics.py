@@ -1,30 +1,159 @@
+import time
+import threading
+from multiprocessing.pool import ThreadPool
+
 from common import AttributeDict
 
 
 class stat_property(object):
-    def __init__(self, getter):
+    """A cached statistics property.
+    Could be used either as a plain decorator or with the dependencies of the stat:
+        * depends_on: names of the other stat properties that the stat is calculated from.
+        * resources: names of the Github resources that the stat is fetched from.
+    Invalidating a stat or a resource (Statistics.invalidate) drops all the stats that depend on it.
+    """
+    def __init__(self, getter=None, depends_on=(), resources=()):
+        self.depends_on = tuple(depends_on)
+        self.resources = tuple(resources)
+        self.getter = None
+        if getter:
+            self(getter)
+
+    def __call__(self, getter):
         self.__doc__ = getattr(getter, '__doc__')
         self.getter = getter
+        return self
 
-    def uncache(self):
-        if self.getter.__name__ in self.obj:
-            del self.obj[self.getter.__name__]
+    @property
+    def name(self):
+        return self.getter.__name__
 
     def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        return BoundStat(self, obj)
+
+
+class BoundStat(object):
+    """The stat property of a specific Statistics instance"""
+
+    def __init__(self, stat, obj):
+        self.stat = stat
         self.obj = obj
-        return self
+
+    def uncache(self):
+        self.obj.invalidate(self.stat.name)
 
     def __call__(self):
-        if self.getter.__name__ in self.obj:
-            return self.obj[self.getter.__name__]
-        value = self.obj[self.getter.__name__] = self.getter(self.obj)
-        return value
+        return self.obj.get_stat(self.stat)
 
 
 class Statistics(AttributeDict):
+    """Statistics base class, the cached values of the stat properties are stored in the dict."""
+
+    DEFAULT_PREFETCH_POOL_SIZE = 8
+    _stat_properties_by_class = {}
+
+    def __setattr__(self, name, value):
+        # Private attributes are kept as instance attributes so they are not treated as cached stats
+        if name.startswith('_'):
+            return object.__setattr__(self, name, value)
+        return AttributeDict.__setattr__(self, name, value)
+
+    @property
+    def _lock(self):
+        return self.__dict__.setdefault('_instance_lock', threading.RLock())
+
+    @property
+    def _generations(self):
+        return self.__dict__.setdefault('_stat_generations', {})
+
+    def _stat_lock(self, name):
+        with self._lock:
+            return self.__dict__.setdefault('_stat_locks', {}).setdefault(name, threading.RLock())
+
+    @classmethod
+    def stat_properties(cls):
+        """Returns: dict of all the stat properties of the class by name"""
+        if cls not in cls._stat_properties_by_class:
+            stats = {}
+            for klass in reversed(cls.__mro__):
+                for name, attr in klass.__dict__.items():
+                    if isinstance(attr, stat_property):
+                        stats[name] = attr
+            cls._stat_properties_by_class[cls] = stats
+        return cls._stat_properties_by_class[cls]
+
+    @classmethod
+    def dependents(cls, *names):
+        """Returns: set of the stat names that depend (directly or not) on the given stats/resources"""
+        affected = set(names)
+        stats = cls.stat_properties()
+        changed = True
+        while changed:
+            changed = False
+            for name, stat in stats.items():
+                if name not in affected and affected.intersection(stat.depends_on + stat.resources):
+                    affected.add(name)
+                    changed = True
+        return affected.intersection(stats)
+
+    def get_stat(self, stat):
+        name = stat.name
+        if name in self:
+            return self[name]
+        with self._stat_lock(name):
+            if name in self:
+                return self[name]
+            generation = self._generations.get(name, 0)
+            value = stat.getter(self)
+            with self._lock:
+                # Storing only if the stat was not invalidated during the fetch
+                if self._generations.get(name, 0) == generation:
+                    self[name] = value
+            return value
+
+    def invalidate(self, *names):
+        """Dropping the cached stats <names> and all the stats that depend on them.
+        <names> could be either stat names or Github resource names.
+        """
+        with self._lock:
+            for name in self.dependents(*names):
+                self._generations[name] = self._generations.get(name, 0) + 1
+                self.pop(name, None)
+
+    def patch(self, name, update):
+        """Replacing the cached stat <name> by update(<cached value>) and dropping the stats that depend on it.
+        Returns: whether the stat was cached (a stat that is not cached is just invalidated)"""
+        with self._lock:
+            if name not in self:
+                self.invalidate(name)
+                return False
+            value = update(self[name])
+            self.invalidate(name)
+            self[name] = value
+            return True
 
     def uncache_all(self):
-        for k in self.keys():
-            # PLease do not iterate over self since it causes:
-            # RuntimeError: dictionary changed size during iteration
-            del self[k]
+        with self._lock:
+            self.invalidate(*self.keys())
+
+    def prefetch(self, names, pool_size=None):
+        """Concurrently fetching the stat properties <names> into the cache.
+        Returns: dict of the fetch duration (seconds) of each stat property.
+        """
+        names = [name for name in names if name not in self]
+        if not names:
+            return {}
+        stats = self.stat_properties()
+
+        def fetch(name):
+            start = time.time()
+            self.get_stat(stats[name])
+            return name, time.time() - start
+
+        pool = ThreadPool(min(pool_size or self.DEFAULT_PREFETCH_POOL_SIZE, len(names)))
+        try:
+            return dict(pool.map(fetch, names))
+        finally:
+            pool.close()
@@ -0,0 +1,247 @@
+import time
+import heapq
+import Queue
+import logging
+import smtplib
+import itertools
+import threading
+from contextlib import contextmanager
+from email import encoders
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from email.mime.base import MIMEBase
+from email.utils import COMMASPACE, formatdate
+
+from config import config
+
+
+logging.basicConfig()
+logger = logging.getLogger('MailerLogger')
+logger.setLevel(logging.INFO)
+
+
+class Message(object):
+
+    def __init__(self, receivers, subject, body, attachments=None, text_format='plain'):
+        self.receivers = receivers
+        self.subject = subject
+        self.body = body
+        self.attachments = attachments or []
+        self.text_format = text_format
+        self.attempts = 0
+
+    def __repr__(self):
+        return '<{} receivers={} subject="{}">'.format(self.__class__.__name__, self.receivers, self.subject)
+
+    def as_mime(self, sender):
+        msg = MIMEMultipart()
+        msg['From'] = sender
+        msg['To'] = COMMASPACE.join(self.receivers)
+        msg['Date'] = formatdate(localtime=True)
+        msg['Subject'] = self.subject
+
+        msg.attach(MIMEText(self.body, self.text_format))
+        for attachment in self.attachments:
+            with open(attachment, "rb") as attachment_file:
+                part = MIMEBase('application', 'octet-stream')
+                part.set_payload(attachment_file.read())
+                encoders.encode_base64(part)
+                part.add_header('Content-Disposition', "attachment; filename= {}"
+                                .format(attachment))
+                msg.attach(part)
+        return msg
+
+    @classmethod
+    def digest(cls, receiver, messages):
+        """Combining the messages to the receiver into a single message"""
+        if len(messages) == 1:
+            return cls([receiver], messages[0].subject, messages[0].body)
+        body = '\n\n'.join('{}\n{}\n{}'.format(message.subject, '-' * len(message.subject), message.body)
+                           for message in messages)
+        return cls([receiver], '{} NudgeBot notifications'.format(len(messages)), body)
+
+
+class SMTPPool(object):
+    """A pool of persistent SMTP connections.
+    Connections that were idle for more than max_idle_seconds are reopened, since SMTP servers drop them.
+    """
+
+    def __init__(self, host='localhost', port=25, size=2, max_idle_seconds=60, timeout=30):
+        self.host = host
+        self.port = port
+        self.max_idle_seconds = max_idle_seconds
+        self.timeout = timeout
+        self._idle = Queue.LifoQueue()  # [(connection, last use time)]
+        self._semaphore = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        return smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, IOError):
+            connection.close()
+
+    @contextmanager
+    def connection(self):
+        with self._semaphore:
+            connection = None
+            while connection is None:
+                try:
+                    connection, last_use = self._idle.get_nowait()
+                except Queue.Empty:
+                    connection = self._connect()
+                    break
+                if time.time() - last_use > self.max_idle_seconds:
+                    self._close(connection)
+                    connection = None
+            try:
+                yield connection
+            except Exception:
+                self._close(connection)
+                raise
+            self._idle.put((connection, time.time()))
+
+    def close(self):
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except Queue.Empty:
+                return
+            self._close(connection)
+
+
+class Mailer(object):
+    """Outbound mail queue.
+    The messages are sent in the background over a pool of SMTP connections, failed messages are
+    retried with a growing delay. Messages sent with digest=True are coalesced per receiver: the
+    messages to a receiver within the digest window are sent as a single message.
+    config (mailer):
+        * smtp_host, smtp_port: the SMTP server.
+        * pool_size: the number of SMTP connections.
+        * workers: the number of messages sent concurrently.
+        * max_attempts: the number of attempts to send a message.
+        * retry_delay_seconds: the delay before the first retry (multiplied by the attempt number).
+        * digest_window_seconds: the time to collect messages to a receiver, 0 disables the digests.
+    """
+
+    def __init__(self, sender, smtp_host='localhost', smtp_port=25, pool_size=2, workers=2, max_attempts=3,
+                 retry_delay_seconds=30, digest_window_seconds=300):
+        self.sender = sender
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay_seconds = retry_delay_seconds
+        self.digest_window_seconds = digest_window_seconds
+        self.pool = SMTPPool(smtp_host, smtp_port, pool_size)
+        self.counters = {'queued': 0, 'sent': 0, 'retried': 0, 'failed': 0, 'digested': 0}
+        self._digests = {}  # receiver -> {'messages': [...], 'due': <time>}
+        self._scheduled = []  # heap of (due, sequence, message)
+        self._sequence = itertools.count()
+        self._ready = Queue.Queue()
+        self._unfinished = 0
+        self._condition = threading.Condition()
+        self._started = False
+
+    @classmethod
+    def from_config(cls, sender):
+        return cls(sender, **config().config.get('mailer', {}))
+
+    def send(self, receivers, subject, body, attachments=None, text_format='plain', digest=False):
+        """Queuing the message, returns immediately"""
+        if isinstance(receivers, basestring):
+            receivers = [receivers]
+        self.start()
+        now = time.time()
+        with self._condition:
+            if digest and self.digest_window_seconds and text_format == 'plain' and not attachments:
+                for receiver in receivers:
+                    pending = self._digests.get(receiver)
+                    if pending is None:
+                        pending = self._digests[receiver] = {'messages': [], 'due': now + self.digest_window_seconds}
+                        self._unfinished += 1
+                    if any(message.subject == subject and message.body == body for message in pending['messages']):
+                        continue  # The same notification was already queued
+                    pending['messages'].append(Message([receiver], subject, body))
+                    self.counters['digested'] += 1
+            else:
+                self._schedule(Message(receivers, subject, body, attachments, text_format), now)
+                self._unfinished += 1
+            self.counters['queued'] += 1
+            self._condition.notify_all()
+
+    def _schedule(self, message, due):
+        heapq.heappush(self._scheduled, (due, next(self._sequence), message))
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                now = time.time()
+                for receiver, pending in self._digests.items():
+                    if pending['due'] <= now:
+                        del self._digests[receiver]
+                        self._ready.put(Message.digest(receiver, pending['messages']))
+                while self._scheduled and self._scheduled[0][0] <= now:
+                    self._ready.put(heapq.heappop(self._scheduled)[2])
+                dues = [pending['due'] for pending in self._digests.values()]
+                if self._scheduled:
+                    dues.append(self._scheduled[0][0])
+                self._condition.wait(min(dues) - now if dues else None)
+
+    def _deliver(self, message):
+        with self.pool.connection() as connection:
+            connection.sendmail(self.sender, message.receivers, message.as_mime(self.sender).as_string())
+
+    def _work(self):
+        while True:
+            message = self._ready.get()
+            done = True
+            try:
+                logger.info('Sending Email to {}; subject="{}"'.format(message.receivers, message.subject))
+                self._deliver(message)
+                counter = 'sent'
+            except Exception:
+                message.attempts += 1
+                if message.attempts < self.max_attempts:
+                    logger.warning('Failed to send {} (attempt {}), retrying'.format(message, message.attempts))
+                    counter, done = 'retried', False
+                else:
+                    logger.exception('Failed to send {}, giving up'.format(message))
+                    counter = 'failed'
+            with self._condition:
+                self.counters[counter] += 1
+                if done:
+                    self._unfinished -= 1
+                else:
+                    self._schedule(message, time.time() + self.retry_delay_seconds * message.attempts)
+                self._condition.notify_all()
+
+    def start(self):
+        with self._condition:
+            if self._started:
+                return
+            self._started = True
+        for target in [self._dispatch] + [self._work] * self.workers:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def flush(self, timeout=None):
+        """Sending the pending digests now and waiting for all the queued messages to be handled.
+        Returns: True if all the messages were handled within the timeout"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            for pending in self._digests.values():
+                pending['due'] = 0
+            self._condition.notify_all()
+            while self._unfinished:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        self.flush(timeout)
+        self.pool.close()
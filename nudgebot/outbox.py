@@ -0,0 +1,281 @@
+import time
+import Queue
+import logging
+import threading
+
+import github
+
+from config import config
+from common import Singleton
+from nudgebot.db import db
+from nudgebot.lib.github.users import User
+
+
+logging.basicConfig()
+logger = logging.getLogger('OutboxLogger')
+logger.setLevel(logging.INFO)
+
+
+class Operation(object):
+    """A Github mutation of a pull request, produced by an action (see Action.operations).
+    Consecutive operations of a pull request with the same KEY are merged into a single operation,
+    operations without a KEY are executed as they are and the operations are not merged across them.
+    static attributes:
+        * INVALIDATES: The Github resources that the operation changes, they are invalidated in the
+                       statistics after the operation is executed.
+    """
+    KEY = None
+    INVALIDATES = ()
+
+    def __init__(self, pull_request):
+        self.pull_request = pull_request
+        self.done = False
+
+    def __repr__(self):
+        return '<{} pull_request={}>'.format(self.__class__.__name__, self.pull_request.number)
+
+    def merge(self, other):
+        raise NotImplementedError()
+
+    def preview(self, pr_stats):
+        """Applying the operation to the in-memory statistics <pr_stats>, so the rest of the flow
+        is evaluated as if the operation was already executed"""
+        pass
+
+    def execute(self):
+        raise NotImplementedError()
+
+
+class EditTitle(Operation):
+    KEY = 'title'
+
+    def __init__(self, pull_request, title):
+        super(EditTitle, self).__init__(pull_request)
+        self.title = title
+
+    def merge(self, other):
+        self.title = other.title  # The later title is computed from the previewed title
+
+    def preview(self, pr_stats):
+        self.pull_request._github_obj._useAttributes({'title': self.title})
+        pr_stats.invalidate('title')
+
+    def execute(self):
+        self.pull_request._github_obj.edit(self.title)
+
+
+class RequestReviewers(Operation):
+    KEY = 'reviewers'
+
+    def __init__(self, pull_request, reviewers):
+        super(RequestReviewers, self).__init__(pull_request)
+        self.logins = [reviewer.login if isinstance(reviewer, User) else reviewer for reviewer in reviewers]
+
+    def merge(self, other):
+        self.logins += [login for login in other.logins if login not in self.logins]
+
+    def preview(self, pr_stats):
+        requester = self.pull_request._requester
+
+        def patch(reviewer_requests):
+            requested = [request.login for request in reviewer_requests]
+            return reviewer_requests + [
+                github.PullRequestReviewerRequest.PullRequestReviewerRequest(
+                    requester, {}, {'login': login}, completed=False)
+                for login in self.logins if login not in requested]
+        pr_stats.patch('reviewer_requests', patch)
+
+    def execute(self):
+        if not self.pull_request.add_reviewers(self.logins):
+            raise IOError('Failed to request the reviewers {}'.format(self.logins))
+
+
+class CreateComment(Operation):
+    KEY = 'comment'
+    INVALIDATES = ('issue_comments',)
+
+    def __init__(self, pull_request, body):
+        super(CreateComment, self).__init__(pull_request)
+        self.bodies = [body]
+
+    def merge(self, other):
+        self.bodies += [body for body in other.bodies if body not in self.bodies]
+
+    @property
+    def body(self):
+        return '\n\n'.join(self.bodies)
+
+    def execute(self):
+        self.pull_request.create_issue_comment(self.body)
+
+
+class Call(Operation):
+    """Calling func(*args), the <invalidates> resources are invalidated after the call"""
+
+    def __init__(self, pull_request, invalidates, func, *args):
+        super(Call, self).__init__(pull_request)
+        self.INVALIDATES = tuple(invalidates)
+        self.func = func
+        self.args = args
+
+    def execute(self):
+        self.func(*self.args)
+
+
+class OutboxBatch(object):
+    """The operations of the actions of a single flow evaluation of a pull request.
+    The record of an action is committed once all of its operations were executed, the operations
+    that were executed are not executed again when the batch is retried.
+    """
+
+    def __init__(self, pr_stats):
+        self.pr_stats = pr_stats
+        self.pr_key = pr_stats.key()
+        self.key = (self.pr_key['repository'], self.pr_key['number'])
+        self.operations = []
+        self.records = []  # [(done key, record, operations)] of the actions that were not committed yet
+        self.actions = 0
+        self.attempts = 0
+        self._mergeable = {}  # KEY -> the operation that the next operations with the KEY are merged into
+
+    def add(self, operations, done_key, record):
+        """Adding the <operations> of an action and the <record> to commit once they are executed"""
+        added = []
+        for operation in operations:
+            if operation.KEY is None:
+                self._mergeable.clear()
+            elif operation.KEY in self._mergeable:
+                self._mergeable[operation.KEY].merge(operation)
+                added.append(self._mergeable[operation.KEY])
+                continue
+            else:
+                self._mergeable[operation.KEY] = operation
+            self.operations.append(operation)
+            added.append(operation)
+        self.records.append((done_key, record, added))
+        self.actions += 1
+
+    @property
+    def done_keys(self):
+        return {done_key for done_key, _, _ in self.records}
+
+    def execute(self):
+        """Executing the operations that were not executed yet and committing the records of the actions
+        whose operations were executed. Raises the error of the first operation that failed."""
+        try:
+            for operation in self.operations:
+                if not operation.done:
+                    operation.execute()
+                    operation.done = True
+                    self.pr_stats.invalidate(*operation.INVALIDATES)
+        finally:
+            done = [all(operation.done for operation in operations) for _, _, operations in self.records]
+            db().add_records([record for (_, record, _), is_done in zip(self.records, done) if is_done])
+            self.records = [entry for entry, is_done in zip(self.records, done) if not is_done]
+
+
+class ActionOutbox(object):
+    """Executing the flow actions of the pull requests in the background.
+    The batches of a pull request are executed in order by the same worker, a failed batch is retried
+    with a growing delay (only its operations that were not executed yet). The action records are committed
+    only after the operations of the action were executed, so the actions of a batch that failed are
+    run again by the next flow evaluation.
+    config (outbox):
+        * workers: the number of batches executed concurrently.
+        * max_attempts: the number of attempts to execute a batch.
+        * retry_delay_seconds: the delay before the first retry (multiplied by the attempt number).
+    """
+    __metaclass__ = Singleton
+
+    def __init__(self):
+        outbox_config = config().config.get('outbox', {})
+        self.workers = outbox_config.get('workers', 2)
+        self.max_attempts = outbox_config.get('max_attempts', 3)
+        self.retry_delay_seconds = outbox_config.get('retry_delay_seconds', 10)
+        self.counters = {'submitted': 0, 'executed': 0, 'retried': 0, 'failed': 0}
+        self._queues = [Queue.Queue() for _ in range(self.workers)]
+        self._pending = {}  # (repository, number) -> [batch, ...]
+        self._failure_callbacks = []
+        self._condition = threading.Condition()
+        self._started = False
+
+    def on_failure(self, callback):
+        """Registering callback(pr_key) that is called when a batch of the pull request failed"""
+        self._failure_callbacks.append(callback)
+
+    def get_pending(self, pr_key):
+        """Returns: set of the done keys of the actions of the pull request that were not committed yet"""
+        with self._condition:
+            batches = list(self._pending.get((pr_key['repository'], pr_key['number']), []))
+        return set().union(*[batch.done_keys for batch in batches])
+
+    def submit(self, batch):
+        if not batch.operations:  # Only the records of actions that ran inline
+            return batch.execute()
+        self.start()
+        with self._condition:
+            self._pending.setdefault(batch.key, []).append(batch)
+            self.counters['submitted'] += 1
+        self._queue_of(batch).put(batch)
+
+    def _queue_of(self, batch):
+        return self._queues[hash(batch.key) % self.workers]
+
+    def _execute(self, batch):
+        """Executing the batch until it succeeds or the attempts are exhausted.
+        The worker waits between the attempts, so the later batches of the pull request are not
+        executed before it. Returns: whether the batch succeeded"""
+        while True:
+            batch.attempts += 1
+            try:
+                batch.execute()
+                return True
+            except Exception:
+                if batch.attempts >= self.max_attempts:
+                    logger.exception('Failed to execute the actions of pull request #{}, giving up'.format(
+                        batch.key[1]))
+                    return False
+                logger.warning('Failed to execute the actions of pull request #{} (attempt {}), retrying...'.format(
+                    batch.key[1], batch.attempts))
+                with self._condition:
+                    self.counters['retried'] += 1
+                time.sleep(self.retry_delay_seconds * batch.attempts)
+
+    def _work(self, queue):
+        while True:
+            batch = queue.get()
+            succeeded = self._execute(batch)
+            if not succeeded:
+                for callback in self._failure_callbacks:
+                    try:
+                        callback(batch.pr_key)
+                    except Exception:
+                        logger.exception('Outbox failure callback failed')
+            with self._condition:
+                self.counters['executed' if succeeded else 'failed'] += 1
+                self._pending[batch.key].remove(batch)
+                if not self._pending[batch.key]:
+                    del self._pending[batch.key]
+                self._condition.notify_all()
+
+    def start(self):
+        with self._condition:
+            if self._started:
+                return
+            self._started = True
+        for queue in self._queues:
+            thread = threading.Thread(target=self._work, args=(queue,))
+            thread.daemon = True
+            thread.start()
+
+    def flush(self, timeout=None):
+        """Waiting for all the submitted batches to be handled.
+        Returns: True if all the batches were handled within the timeout"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
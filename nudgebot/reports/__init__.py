@@ -1,9 +1,19 @@
 import os
+import time
 import inspect
+import logging
+import threading
 
 from jinja2 import Template
+from cached_property import cached_property
 
 from nudgebot import NudgeBot
+from nudgebot.db import db
+
+
+logging.basicConfig()
+logger = logging.getLogger('ReportsLogger')
+logger.setLevel(logging.INFO)
 
 
 class Report(object):
@@ -20,11 +30,14 @@ class Report(object):
     TEMPLATE = None
     TEXT_FORMAT = 'plain'
     RECEIVERS = []
+    _compiled_templates = {}  # report class -> (subject template, body template)
+    _compile_lock = threading.Lock()
 
     def __init__(self):
         assert self.SUBJECT, 'SUBJECT should be defined in the report class'
         assert self.TEMPLATE, 'TEMPLATE should be defined in the report class'
         assert self.RECEIVERS, 'No receivers for the report, please define RECEIVERS'
+        self.timings = {}
 
     @classmethod
     def get_reports(cls):
@@ -41,31 +54,54 @@ class Report(object):
     def get_name(cls):
         return cls.__name__
 
-    @property
-    def data(self):
+    @classmethod
+    def get_templates(cls):
+        """Returns: the compiled (subject, body) templates of the report, compiled once per process"""
+        with cls._compile_lock:
+            if cls not in cls._compiled_templates:
+                if os.path.exists(cls.TEMPLATE):
+                    with open(cls.TEMPLATE, 'r') as f:
+                        template_raw = f.read().decode('UTF-8')
+                else:
+                    template_raw = cls.TEMPLATE
+                cls._compiled_templates[cls] = (Template(cls.SUBJECT), Template(template_raw))
+            return cls._compiled_templates[cls]
+
+    def collect_data(self):
         """In this function we should implement the data calculation for the report.
-        This data will be used for the template. The property should return the data dictionary
+        This data will be used for the template. The function should return the data dictionary
         used for the report rendering
         """
-        return NotImplementedError()
+        raise NotImplementedError()
+
+    @cached_property
+    def data(self):
+        """The report data, collected once per report"""
+        start = time.time()
+        data = self.collect_data()
+        self.timings['data'] = time.time() - start
+        return data
 
     @property
     def subject(self):
-        return Template(self.SUBJECT).render(data=self.data)
+        return self.get_templates()[0].render(data=self.data)
 
     @property
     def body(self):
         """Rendering the body of the report with the data"""
-        if os.path.exists(self.TEMPLATE):
-            with open(self.TEMPLATE, 'r') as f:
-                template_raw = f.read().encode('UTF-8')
-        else:
-            template_raw = self.TEMPLATE
-        return Template(template_raw).render(data=self.data)
+        data = self.data
+        start = time.time()
+        body = self.get_templates()[1].render(data=data)
+        self.timings['render'] = time.time() - start
+        return body
 
     def send(self):
         """Sending the report"""
-        NudgeBot().send_email(self.RECEIVERS, self.subject, self.body, text_format=self.TEXT_FORMAT)
+        subject, body = self.subject, self.body
+        NudgeBot().send_email(self.RECEIVERS, subject, body, text_format=self.TEXT_FORMAT)
+        logger.info('Report {} sent: data collected in {:.3f}s, rendered in {:.3f}s'.format(
+            self.get_name(), self.timings['data'], self.timings['render']))
+        db().add_sent_report(self.get_name(), self.RECEIVERS, self.timings)
 
     @property
     def json(self):
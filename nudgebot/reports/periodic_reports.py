@@ -13,18 +13,26 @@ DAILY_REPORT_TIME = [int(t) for t in config().config.reports.daily.split(':')]
 
 class DailyStatusReport(Report):
     CRONTAB = crontab(hour=DAILY_REPORT_TIME[0], minute=DAILY_REPORT_TIME[1])
-    SUBJECT = '{{ data["stats"][0]["repository"] }} daily report'
+    SUBJECT = '{{ data["repositories"]|join(", ") }} daily report'
     TEMPLATE = os.path.join(TEMPLATES_DIR, 'daily_status_report.j2')
     TEXT_FORMAT = 'html'
     RECEIVERS = config().config.reports.receivers
+    TAGS = ('RFR', 'WIPTEST', 'WIP')
+    MANY_COMMENTS = 10
 
-    @property
-    def data(self):
-        stats = db().pull_request_statistics
+    def collect_data(self):
+        pull_request_fields = ('organization', 'repository', 'number', 'owner', 'total_review_comments')
+        stats_by_tag = db().group_pr_stats('title_tags', match={'title_tags': {'$in': self.TAGS}},
+                                           push=('organization', 'repository', 'number'))
+        _, commented_stats = db().find_pr_stats(
+            {'total_review_comments': {'$gte': self.MANY_COMMENTS}}, pull_request_fields,
+            sort=[('total_review_comments', True)])
+        stats_by_repository = db().group_pr_stats('repository')
         return {
-            'stats': stats,
-            'stats_by_tag': {tag: [stat for stat in stats if tag in stat['title_tags']]
-                             for tag in ('RFR', 'WIPTEST', 'WIP')},
-            'reviewers_pool_items': sorted(db().get_reviewers_pool().items(),
-                                           key=lambda d: len(d[1]['pull_requests']))
+            'repositories': sorted(stats_by_repository),
+            'stats_by_repository': stats_by_repository,
+            'stats_by_tag': {tag: stats_by_tag.get(tag, {}).get('pull_requests', []) for tag in self.TAGS},
+            'stats_by_reviewer': db().group_pr_stats('reviewers'),
+            'commented_stats': commented_stats,
+            'reviewers_pool_items': db().group_reviewers_pool()
         }
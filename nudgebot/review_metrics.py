@@ -0,0 +1,138 @@
+import logging
+from datetime import timedelta
+
+from config import config
+from common import Singleton, as_local_time
+from nudgebot.db import db
+
+
+logging.basicConfig()
+logger = logging.getLogger('ReviewMetricsLogger')
+logger.setLevel(logging.INFO)
+
+
+class ReviewMetrics(object):
+    """Incrementally maintained review metrics rollups.
+    Every handled Github event increments the hourly and daily bucket documents of its repository
+    (reviewer=None) and of the reviewer, so reading a period costs O(buckets).
+    The bucket counters:
+        * opened, closed, merged, review_requests, reviews, approvals, comments: activity counts.
+        * first_review.count/total_seconds/max_seconds: time from the creation to the first review.
+        * approval.count/total_seconds/max_seconds: time from the creation to the first approval.
+        * round_trips: the times the owner responded to a reviewer.
+        * pull_requests (reviewer buckets): the pull requests the reviewer was active on.
+    config (review_metrics):
+        * enabled: whether to maintain the rollups.
+        * hourly_retention_days: how long to keep the hourly buckets.
+    """
+    __metaclass__ = Singleton
+    GRANULARITIES = ('hourly', 'daily')
+    REVIEWER_SIDE = 'reviewer'
+    OWNER_SIDE = 'owner'
+
+    def __init__(self):
+        metrics_config = config().config.get('review_metrics', {})
+        self.enabled = metrics_config.get('enabled', True)
+        self.hourly_retention = timedelta(days=metrics_config.get('hourly_retention_days', 30))
+
+    @staticmethod
+    def get_bucket(time, granularity):
+        if granularity == 'hourly':
+            return time.replace(minute=0, second=0, microsecond=0)
+        return time.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    @staticmethod
+    def parse_event(payload):
+        """Parsing the review activity of the event payload.
+        Returns: dict of the activity, actor, time and the pull request number, owner and creation time
+                 or None if the event is not a pull request review activity
+        """
+        pull_request = payload.get('pull_request')
+        if not pull_request and 'pull_request' in payload.get('issue', {}):
+            pull_request = payload['issue']
+        if not pull_request:
+            return None
+        action = payload.get('action') or payload.get('event')
+        activity = actor = time = state = None
+        if 'review' in payload and action == 'submitted':
+            activity, actor, time = 'review', payload['review']['user']['login'], payload['review'].get('submitted_at')
+            state = payload['review'].get('state', '').lower()
+        elif 'comment' in payload and action == 'created':
+            activity, actor, time = 'comment', payload['comment']['user']['login'], payload['comment']['created_at']
+        elif action == 'review_requested' and payload.get('requested_reviewer'):
+            activity, actor = 'review_requested', payload['requested_reviewer']['login']
+            time = payload.get('created_at') or pull_request.get('updated_at')
+        elif action in ('opened', 'closed') and 'number' in payload:
+            activity, actor = action, pull_request['user']['login']
+            time = pull_request['created_at'] if action == 'opened' else pull_request.get('closed_at')
+        if not activity:
+            return None
+        return {
+            'activity': activity,
+            'actor': actor,
+            'time': as_local_time(time or pull_request['updated_at'], raise_if_native_time=False),
+            'state': state,
+            'merged': bool(pull_request.get('merged')),
+            'number': pull_request['number'],
+            'owner': pull_request['user']['login'],
+            'created_at': as_local_time(pull_request['created_at'], raise_if_native_time=False)
+        }
+
+    def _updates(self, repository, reviewer, time, inc, max_fields=None, number=None):
+        updates = []
+        for granularity in self.GRANULARITIES:
+            bucket = self.get_bucket(time, granularity)
+            expire_at = bucket + self.hourly_retention if granularity == 'hourly' else None
+            updates.append(db().review_metrics_update(
+                repository, reviewer, granularity, bucket, inc, max_fields, number, expire_at))
+        return updates
+
+    def record(self, repository, payload):
+        """Updating the rollups of the <repository> by the event payload"""
+        if not self.enabled:
+            return
+        event = self.parse_event(payload)
+        if not event:
+            return
+        repo_inc, reviewer_inc, max_fields = {}, {}, {}
+        activity, actor, number, time = event['activity'], event['actor'], event['number'], event['time']
+        if activity in ('opened', 'closed'):
+            repo_inc[activity] = 1
+            if activity == 'closed':
+                repo_inc['merged'] = int(event['merged'])
+                db().remove_review_milestones(repository, number)
+        elif activity == 'review_requested':
+            repo_inc['review_requests'] = reviewer_inc['review_requests'] = 1
+        elif actor != event['owner']:
+            repo_inc[activity + 's'] = reviewer_inc[activity + 's'] = 1
+            milestones = (('first_review', activity == 'review'), ('approval', event['state'] == 'approved'))
+            if event['state'] == 'approved':
+                repo_inc['approvals'] = reviewer_inc['approvals'] = 1
+            for milestone, reached in milestones:
+                if reached and db().set_review_milestone(repository, number, milestone, time):
+                    seconds = int((time - event['created_at']).total_seconds())
+                    for inc in (repo_inc, reviewer_inc):
+                        inc.update({milestone + '.count': 1, milestone + '.total_seconds': seconds})
+                    max_fields[milestone + '.max_seconds'] = seconds
+            db().set_review_side(repository, number, self.REVIEWER_SIDE)
+        else:
+            if db().set_review_side(repository, number, self.OWNER_SIDE) == self.REVIEWER_SIDE:
+                repo_inc['round_trips'] = 1
+        updates = []
+        if repo_inc or max_fields:  # e.g. nothing is counted for the first comment of the owner
+            updates += self._updates(repository, None, time, repo_inc, max_fields)
+        if reviewer_inc:
+            updates += self._updates(repository, actor, time, reviewer_inc, max_fields, number)
+        db().update_review_metrics(updates)
+
+    def get_rollups(self, repository, granularity='daily', since=None, reviewer=None):
+        """Returns: the rollups of the period (sorted by bucket) with the average times"""
+        rollups = db().get_review_metrics(repository, granularity, since, reviewer)
+        for rollup in rollups:
+            for milestone in ('first_review', 'approval'):
+                if milestone in rollup:
+                    times = rollup[milestone]
+                    times['average_seconds'] = times['total_seconds'] / times['count']
+            if 'pull_requests' in rollup:
+                rollup['pull_requests'] = len(rollup['pull_requests'])
+        return rollups
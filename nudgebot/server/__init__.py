@@ -1,16 +1,23 @@
 import os
+import time
 import logging
-from flask import request, Flask
+from functools import partial
+from datetime import datetime, timedelta
+from flask import request, Flask, Response
 import json
 
 from jinja2 import Template
 
-from common import Age
+from common import ages
 from globals import SERVER_HOST, SERVER_PORT
 from nudgebot.db import db
 from nudgebot import NudgeBot
 from nudgebot.lib.github import GithubEnv
 from nudgebot.events_handler import EventsHandler
+from nudgebot.deliveries import DeliveryStore
+from nudgebot.event_queue import EventQueue
+from nudgebot.change_bus import ChangeBus
+from nudgebot.review_metrics import ReviewMetrics
 
 
 logging.basicConfig()
@@ -20,31 +27,141 @@ logger.setLevel(logging.INFO)
 app = Flask(__name__)
 
 
+def _load_template(name):
+    with open(os.path.join(os.path.dirname(__file__), name), 'r') as f:
+        return Template(f.read().decode('UTF-8'))
+
+
+# Compiled once per process
+STATISTICS_TEMPLATE = _load_template('statistics.j2')
+API_FILTERS = {'repository': 'repository', 'tag': 'title_tags', 'reviewer': 'reviewers', 'owner': 'owner'}
+API_SORT_FIELDS = ('number', 'repository', 'owner', 'title', 'age', 'last_update',
+                   'total_review_comments', 'total_review_comment_threads')
+API_MAX_PER_PAGE = 200
+STREAM_KEEPALIVE_SECONDS = 15
+
+
+def conditional_response(etag, build_response, mimetype='text/html'):
+    """Responding 304 if the client already has the <etag> version, otherwise building the response"""
+    etag = '"{}"'.format(etag)
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers={'ETag': etag})
+    return Response(build_response(), mimetype=mimetype, headers={'ETag': etag})
+
+
+def _json_default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    return str(obj)
+
+
 @app.route('/webhooks', methods=['POST'])
 def webhook_event():
     payload = (request.json if request.json else json.loads(request.form['payload']))
-    NudgeBot().process_github_event(payload)
+    keys = DeliveryStore().claim_github_event(payload, delivery_id=request.headers.get('X-GitHub-Delivery'),
+                                              event_id=request.headers.get('X-NudgeBot-Event-Id'))
+    if not keys:
+        return 'Duplicated event'
+    EventQueue().put(payload, on_done=partial(DeliveryStore().done, keys))
     return 'OK'
 
 
 @app.route('/statistics', methods=['GET'])
 def statistics_page():
-    with open('{}/statistics.j2'.format(os.path.dirname(__file__)), 'r') as f:
-        template = Template(f.read().encode('UTF-8'))
-    stats = [stat for stat in db().pr_stats.find()]
-    # Temp wrapper for aging - TODO: do this internally in the stat class!!!
-    for stat in stats:
+
+    def render():
+        stats = [stat for stat in db().pr_stats.find()]
+        now = time.time()
         for key in ('last_update', 'age'):
-            stat[key] = Age(stat[key])
-    html = template.render(stats=stats, repos=GithubEnv().repos)
-    return html
+            for stat, age in zip(stats, ages([stat[key] for stat in stats], now)):
+                stat[key] = age
+        return STATISTICS_TEMPLATE.render(stats=stats, repos=GithubEnv().repos)
+
+    # The ages are presented in hours, so the page is also changed every hour
+    return conditional_response('{}-{}'.format(db().stats_version, int(time.time() / 3600)), render)
+
+
+@app.route('/api/pull_requests', methods=['GET'])
+def pull_requests_api():
+    """Pull requests statistics API
+    Query arguments:
+        * repository, tag, reviewer, owner (optional): filters.
+        * sort (optional): comma separated fields to sort by, prefixed with "-" for descending order.
+        * page, per_page (optional): pagination (default: 1, 50).
+        * fields (optional): comma separated fields to return.
+    The age and last_update fields are epoch seconds.
+    """
+    args = request.args
+    query = {field: args[arg] for arg, field in API_FILTERS.items() if args.get(arg)}
+    if 'number' in args:
+        query['number'] = args.get('number', type=int)
+    sort = []
+    for field in filter(None, args.get('sort', 'number').split(',')):
+        if field.lstrip('-') not in API_SORT_FIELDS:
+            return Response(json.dumps({'error': 'Cannot sort by "{}"'.format(field)}),
+                            status=400, mimetype='application/json')
+        sort.append((field.lstrip('-'), field.startswith('-')))
+    page = max(args.get('page', 1, type=int), 1)
+    per_page = min(max(args.get('per_page', 50, type=int), 1), API_MAX_PER_PAGE)
+    fields = filter(None, args.get('fields', '').split(','))
+
+    def build():
+        total, stats = db().find_pr_stats(query, fields, sort, (page - 1) * per_page, per_page)
+        return json.dumps({'total': total, 'page': page, 'per_page': per_page, 'pull_requests': stats},
+                          default=_json_default)
+
+    return conditional_response('{}-{}'.format(db().stats_version, hash(request.query_string)),
+                                build, mimetype='application/json')
+
+
+@app.route('/api/review_metrics', methods=['GET'])
+def review_metrics_api():
+    """Review metrics rollups API
+    Query arguments:
+        * repository: the repository name.
+        * reviewer (optional): the reviewer rollups instead of the repository rollups.
+        * granularity (optional): hourly || daily (default: daily).
+        * days (optional): the period in days (default: 30).
+    """
+    args = request.args
+    granularity = args.get('granularity', 'daily')
+    if not args.get('repository') or granularity not in ReviewMetrics.GRANULARITIES:
+        return Response(json.dumps({'error': 'repository and a valid granularity are required'}),
+                        status=400, mimetype='application/json')
+    since = ReviewMetrics.get_bucket(datetime.now() - timedelta(days=args.get('days', 30, type=int)), granularity)
+    rollups = ReviewMetrics().get_rollups(args['repository'], granularity, since, args.get('reviewer'))
+    return Response(json.dumps({'rollups': rollups}, default=_json_default), mimetype='application/json')
+
+
+@app.route('/api/stream', methods=['GET'])
+def changes_stream():
+    """Server-Sent Events stream of the statistics changes (pr_stats, pr_stats_removed and reviewers_pool)"""
+    subscription = ChangeBus().subscribe()
+
+    def events():
+        try:
+            yield 'retry: 5000\n\n'
+            while not subscription.closed:
+                change = subscription.get(timeout=STREAM_KEEPALIVE_SECONDS)
+                if change is None:
+                    yield ': keepalive\n\n'
+                    continue
+                kind, data = change
+                yield 'event: {}\ndata: {}\n\n'.format(kind, json.dumps(data, default=_json_default))
+        finally:
+            ChangeBus().unsubscribe(subscription)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 def run():
     logger.info('Stating server')
-    if not db().initialization_time:
+    if not db().initialization_done:
         NudgeBot().initialize()
+    EventQueue().start()
     events_handler = EventsHandler()
     events_handler.start()
     logger.info('Running server...')
-    app.run(host=SERVER_HOST, port=SERVER_PORT)
+    # Threaded since the changes stream connections are long lived
+    app.run(host=SERVER_HOST, port=SERVER_PORT, threaded=True)
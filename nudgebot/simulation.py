@@ -0,0 +1,231 @@
+import json
+import time
+import logging
+import importlib
+import multiprocessing
+from datetime import datetime
+
+from config import config
+from common import from_epoch
+from nudgebot.db import db
+from nudgebot.lib.actions import RUN_TYPES
+from nudgebot.lib.flow_plan import FlowPlan
+from nudgebot.lib.github.users import ContributorUser, ReviewerUser
+from nudgebot.lib.github.pull_request import PullRequestTitleTag
+from nudgebot.lib.statistics import Statistics, stat_property
+
+
+logging.basicConfig()
+logger = logging.getLogger('SimulationLogger')
+logger.setLevel(logging.INFO)
+
+
+def snapshot_user(login, user_class=ReviewerUser):
+    """A user that is not fetched from Github (only the login is known)"""
+    user = user_class(login)
+    user.login = login
+    return user
+
+
+class SnapshotObject(object):
+
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class SnapshotReviewersPool(object):
+    """The reviewers pool of a repository by the reviewer levels of the config"""
+
+    def __init__(self, levels):
+        self._levels = dict(levels)
+        self.reviewers = list(self._levels)
+
+    def get_level(self, reviewer):
+        return self._levels[reviewer]
+
+
+class PullRequestSnapshot(Statistics):
+    """The pull request statistics of a stored statistics document (see PullRequestStatistics.get_json),
+    the stats are taken from the document so the flow could be evaluated without Github"""
+
+    def __init__(self, data, reviewer_levels=None):
+        super(PullRequestSnapshot, self).__init__()
+        self._data = data
+        self._reviewer_levels = reviewer_levels or {}
+
+    @stat_property
+    def number(self):
+        return self._data['number']
+
+    @stat_property
+    def title(self):
+        return self._data['title']
+
+    @stat_property
+    def title_tags(self):
+        return [PullRequestTitleTag(name) for name in self._data.get('title_tags', [])]
+
+    @stat_property
+    def description(self):
+        return self._data.get('description') or ''
+
+    @stat_property
+    def owner(self):
+        return snapshot_user(self._data['owner'], ContributorUser)
+
+    @stat_property
+    def age(self):
+        return from_epoch(self._data['age'])
+
+    @stat_property
+    def last_update(self):
+        return from_epoch(self._data['last_update'])
+
+    @stat_property
+    def time_since_last_update(self):
+        return datetime.utcnow() - self.last_update()
+
+    @stat_property
+    def size(self):
+        return self._data.get('size', {})
+
+    @stat_property
+    def test_results(self):
+        return self._data.get('test_results', {})
+
+    @stat_property
+    def repo(self):
+        return SnapshotObject(name=self._data['repository'], reviewers_pool=SnapshotReviewersPool(
+            self._reviewer_levels.get((self._data['organization'], self._data['repository']), {})))
+
+    @stat_property
+    def reviewers(self):
+        return [snapshot_user(login) for login in self._data.get('reviewers', [])]
+
+    @stat_property
+    def review_states_by_user(self):
+        return {snapshot_user(login): state for login, state in self._data.get('review_states_by_user', {}).items()}
+
+    @stat_property
+    def review_comment_reaction_statuses(self):
+        statuses, now = [], datetime.utcnow()
+        for status in self._data.get('review_comment_reaction_statuses', []):
+            last_comment = status['last_comment']
+            created_at = from_epoch(last_comment['created_at'])
+            statuses.append({
+                'reviewer': snapshot_user(status['reviewer']),
+                'contributor': self.owner(),
+                'last_comment': SnapshotObject(user=snapshot_user(last_comment['login']), created_at=created_at,
+                                               url=last_comment.get('url')),
+                'age_seconds': (now - created_at).total_seconds()
+            })
+        return statuses
+
+    def key(self):
+        return {key: self._data[key] for key in ('organization', 'repository', 'number')}
+
+
+def load_flow(path):
+    """Returns: the flow of the <module>:<attribute> path"""
+    module_name, _, attribute = path.partition(':')
+    return getattr(importlib.import_module(module_name), attribute or 'FLOW')
+
+
+def load_snapshots(files=None, repository=None, limit=0):
+    """Loading the pull request statistics snapshots from the JSON <files> (a document or a list of
+    documents per file) or from the DB"""
+    if not files:
+        _, snapshots = db().find_pr_stats({'repository': repository} if repository else None, limit=limit)
+        return snapshots
+    snapshots = []
+    for path in files:
+        with open(path) as snapshots_file:
+            data = json.load(snapshots_file)
+        snapshots.extend(data if isinstance(data, list) else [data])
+    if repository:
+        snapshots = [snapshot for snapshot in snapshots if snapshot.get('repository') == repository]
+    return snapshots[:limit] if limit else snapshots
+
+
+_simulation = {}  # The plan and the settings of the simulation, inherited by the forked workers
+
+
+def _simulate_chunk(snapshots):
+    """Evaluating the plan for the <snapshots> with the actions stubbed.
+    Returns: (fired actions, case hits by node index, errors, evaluation seconds)"""
+    plan, done_actions = _simulation['plan'], _simulation['done_actions']
+    plan.reset_timings()
+    fired, errors = [], []
+    start = time.time()
+    for data in snapshots:
+        pr_stats = PullRequestSnapshot(data, _simulation['reviewer_levels'])
+        key = (data.get('repository'), data.get('number'))
+
+        def run_action(action, cases_properties, cases_checksum):
+            done_key = (cases_checksum, action.hash)
+            if done_key not in done_actions.get(key, ()) or action.run_type == RUN_TYPES.ALWAYS:
+                fired.append((key, action.class_name, action.properties))
+            return False
+        try:
+            plan.evaluate(pr_stats, run_action)
+        except Exception as error:
+            errors.append((key, '{}: {}'.format(error.__class__.__name__, error)))
+    seconds = time.time() - start
+    hits = {index: node.hits for index, node in enumerate(plan.nodes) if node.is_case}
+    return fired, hits, errors, seconds
+
+
+def simulate_flow(flow, snapshots, processes=None, done_actions=None, chunk_size=50):
+    """Evaluating the <flow> for the pull request statistics <snapshots> over a process pool.
+    The actions are not run, the actions that would run are collected.
+        * done_actions: dict of (repository, number) -> set of the (cases checksum, action checksum)
+                        of the action records, the actions that were already done are not collected.
+    Returns: dict of the fired actions, the case hits, the errors and the throughput
+    """
+    plan = FlowPlan.compile(flow)
+    _simulation.update(plan=plan, done_actions=done_actions or {},
+                       reviewer_levels=dict(config().snapshot.reviewer_levels))
+    chunks = [snapshots[index:index + chunk_size] for index in range(0, len(snapshots), chunk_size)]
+    processes = processes or multiprocessing.cpu_count()
+    start = time.time()
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_simulate_chunk, chunks)
+    finally:
+        pool.close()
+    wall_seconds = time.time() - start
+    fired, errors, hits, cpu_seconds = [], [], [0] * len(plan.nodes), 0.0
+    for chunk_fired, chunk_hits, chunk_errors, seconds in results:
+        fired.extend(chunk_fired)
+        errors.extend(chunk_errors)
+        cpu_seconds += seconds
+        for index, count in chunk_hits.items():
+            hits[index] += count
+    return {
+        'pull_requests': len(snapshots),
+        'processes': processes,
+        'fired': sorted(fired),
+        'case_hits': [(plan.nodes[index].flow_object, hits[index]) for index in range(len(plan.nodes))
+                      if plan.nodes[index].is_case],
+        'errors': errors,
+        'wall_seconds': wall_seconds,
+        'cpu_seconds': cpu_seconds
+    }
+
+
+def print_simulation(result):
+    count = result['pull_requests']
+    print('Simulated {} pull requests in {:.2f}s over {} processes: {:.0f} pull requests/sec, '
+          '{:.1f}us of evaluation per pull request'.format(
+              count, result['wall_seconds'], result['processes'], count / max(result['wall_seconds'], 1e-9),
+              result['cpu_seconds'] / max(count, 1) * 1e6))
+    print('\nActions that would fire ({}):'.format(len(result['fired'])))
+    for (repository, number), name, properties in result['fired']:
+        print('  {}#{}: {} {}'.format(repository, number, name, properties))
+    print('\nCase hits:')
+    for case, hits in result['case_hits']:
+        print('  {:>6}/{} {}'.format(hits, count, case))
+    if result['errors']:
+        print('\nErrors ({}):'.format(len(result['errors'])))
+        for (repository, number), error in result['errors']:
+            print('  {}#{}: {}'.format(repository, number, error))
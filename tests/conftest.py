@@ -0,0 +1,42 @@
+import os
+import sys
+import time
+
+import pytest
+
+import nudgebot.db  # noqa
+from common import Singleton
+
+
+db_module = sys.modules['nudgebot.db']  # The package attribute is shadowed by the db class
+
+
+@pytest.fixture
+def mongo_client(monkeypatch):
+    """An in-memory mongo client that db() is connected to"""
+    mongomock = pytest.importorskip('mongomock')
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(db_module, 'MongoClient', lambda: client)
+    Singleton._instances.pop(db_module.db, None)
+    yield client
+    Singleton._instances.pop(db_module.db, None)
+
+
+@pytest.fixture
+def mongo(mongo_client):
+    """A db() over an empty in-memory mongo"""
+    return db_module.db()
+
+
+@pytest.fixture
+def local_timezone():
+    """Running the test in a timezone other than UTC"""
+    original = os.environ.get('TZ')
+    os.environ['TZ'] = 'America/New_York'
+    time.tzset()
+    yield
+    if original is None:
+        del os.environ['TZ']
+    else:
+        os.environ['TZ'] = original
+    time.tzset()
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from nudgebot.server import app
+
+
+def stat(number, repository='repo', **fields):
+    return dict({'organization': 'org', 'repository': repository, 'number': number, 'owner': 'alice',
+                 'title_tags': [], 'reviewers': [], 'age': 1514800800 + number, 'last_update': 1514800800},
+                **fields)
+
+
+@pytest.fixture
+def client(mongo):
+    mongo.update_pr_stats_many([
+        stat(1, title_tags=['WIP'], reviewers=['bob']),
+        stat(2, owner='bob', reviewers=['carol', 'bob']),
+        stat(3, repository='other', title_tags=['WIP', 'RFR']),
+        stat(4)
+    ])
+    return app.test_client()
+
+
+def get(client, query='', **headers):
+    response = client.get('/api/pull_requests' + query, headers=headers)
+    return response, json.loads(response.data) if response.status_code != 304 else None
+
+
+def numbers(data):
+    return [pr['number'] for pr in data['pull_requests']]
+
+
+def test_filters(client):
+    assert numbers(get(client, '?repository=repo')[1]) == [1, 2, 4]
+    assert numbers(get(client, '?tag=WIP')[1]) == [1, 3]
+    assert numbers(get(client, '?reviewer=bob')[1]) == [1, 2]
+    assert numbers(get(client, '?owner=bob')[1]) == [2]
+    assert numbers(get(client, '?number=3')[1]) == [3]
+    assert numbers(get(client, '?tag=WIP&repository=other')[1]) == [3]
+
+
+def test_sort_and_fields(client):
+    assert numbers(get(client, '?sort=-age')[1]) == [4, 3, 2, 1]
+    assert numbers(get(client, '?sort=repository,-number')[1]) == [3, 4, 2, 1]
+    _, data = get(client, '?fields=number,owner&owner=bob')
+    assert data['pull_requests'] == [{'number': 2, 'owner': 'bob'}]
+    response, data = get(client, '?sort=body')
+    assert response.status_code == 400 and 'body' in data['error']
+
+
+def test_pagination(client):
+    _, data = get(client, '?per_page=3&page=2')
+    assert (data['total'], data['page'], data['per_page'], numbers(data)) == (4, 2, 3, [4])
+    assert numbers(get(client, '?per_page=0')[1]) == [1]  # At least one per page
+    assert get(client, '?page=0')[1]['page'] == 1
+
+
+def test_etag(client, mongo):
+    response, _ = get(client, '?tag=WIP')
+    etag = response.headers['ETag']
+    response, data = get(client, '?tag=WIP', **{'If-None-Match': etag})
+    assert response.status_code == 304 and data is None
+    assert get(client, '?tag=RFR', **{'If-None-Match': etag})[0].status_code == 200  # Another query
+    mongo.update_pr_stats(stat(5, title_tags=['WIP']))
+    response, data = get(client, '?tag=WIP', **{'If-None-Match': etag})
+    assert response.status_code == 200 and numbers(data) == [1, 3, 5]
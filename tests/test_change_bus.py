@@ -0,0 +1,22 @@
+from nudgebot.change_bus import ChangeBus
+
+
+def test_publish_to_subscribers():
+    bus = ChangeBus()
+    subscription = bus.subscribe()
+    try:
+        bus.publish('pr_stats', {'number': 1})
+        assert subscription.get(timeout=1) == ('pr_stats', {'number': 1})
+        assert subscription.get(timeout=0.01) is None
+    finally:
+        bus.unsubscribe(subscription)
+    bus.publish('pr_stats', {'number': 2})
+    assert subscription.get(timeout=0.01) is None
+
+
+def test_slow_subscriber_is_dropped():
+    bus = ChangeBus()
+    subscription = bus.subscribe()
+    for number in range(bus.MAX_PENDING + 1):
+        bus.publish('pr_stats', {'number': number})
+    assert subscription.closed
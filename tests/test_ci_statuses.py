@@ -0,0 +1,87 @@
+from nudgebot.lib.github.ci_statuses import CIStatuses
+
+
+def test_parse_event():
+    assert CIStatuses.parse_event({
+        'sha': 'abc', 'context': 'ci/tests', 'state': 'failure', 'description': 'Tests failed',
+        'updated_at': '2018-01-01T10:00:00Z'}) == ('abc', 'ci/tests', 'failure', 'Tests failed', '2018-01-01T10:00:00Z')
+    assert CIStatuses.parse_event({'check_run': {
+        'head_sha': 'abc', 'name': 'lint', 'status': 'completed', 'conclusion': 'success',
+        'output': {'title': None}, 'completed_at': '2018-01-01T11:00:00Z'}}) == \
+        ('abc', 'lint', 'success', 'success', '2018-01-01T11:00:00Z')
+    assert CIStatuses.parse_event({'action': 'opened', 'pull_request': {'number': 1}}) is None
+
+
+class FakeRequester(object):
+    """Serving the pages of the statuses and the check runs, url -> (data, next page url)"""
+    per_page = 30
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.requests = []
+
+    def requestJsonAndCheck(self, verb, url, parameters=None, headers=None, input=None):
+        self.requests.append(url)
+        data, next_url = self.pages[url]
+        return ({'link': '<{}>; rel="next"'.format(next_url)} if next_url else {}), data
+
+
+class FakePullRequest(object):
+
+    def __init__(self, requester, head_sha='abc'):
+        self._requester = requester
+        self.head_sha = head_sha
+        self.repo = type('FakeRepo', (), {'name': 'repo', 'url': '/repo'})
+
+
+def status(context, state, updated_at):
+    return {'context': context, 'state': state, 'description': state, 'updated_at': updated_at}
+
+
+def check_run(name, conclusion, completed_at):
+    return {'head_sha': 'abc', 'name': name, 'status': 'completed', 'conclusion': conclusion,
+            'output': {'title': None}, 'completed_at': completed_at}
+
+
+PAGES = {
+    # The statuses are listed from the newest to the oldest
+    '/repo/commits/abc/statuses': ([status('ci', 'success', '2018-01-01T11:00:00Z'),
+                                    status('docs', 'failure', '2018-01-01T10:30:00Z')], '/statuses?page=2'),
+    '/statuses?page=2': ([status('ci', 'pending', '2018-01-01T10:00:00Z'),
+                          status('lint', 'success', '2018-01-01T09:00:00Z')], None),
+    '/repo/commits/abc/check-runs': ({'total_count': 2, 'check_runs': [
+        check_run('build', 'success', '2018-01-01T12:00:00Z')]}, '/check-runs?page=2'),
+    '/check-runs?page=2': ({'total_count': 2, 'check_runs': [
+        check_run('deploy', 'failure', '2018-01-01T12:30:00Z')]}, None)
+}
+
+
+def test_newer_status_wins(mongo):
+    CIStatuses.set_status('repo', 'abc', 'ci', 'pending', 'Running', '2018-01-01T10:00:00Z')
+    CIStatuses.set_status('repo', 'abc', 'ci', 'success', 'Passed', '2018-01-01T11:00:00Z')
+    CIStatuses.set_status('repo', 'abc', 'ci', 'failure', 'Failed', '2018-01-01T10:30:00Z')  # Delivered late
+    fetched, statuses = mongo.get_ci_statuses('repo', 'abc')
+    assert not fetched
+    assert [(status['state'], status['description']) for status in statuses] == [('success', 'Passed')]
+
+
+def test_fetch_pages(mongo):
+    requester = FakeRequester(PAGES)
+    pull_request = FakePullRequest(requester)
+    assert CIStatuses().get_test_results(pull_request) == {
+        'ci': 'success', 'docs': 'failure', 'lint': 'success', 'build': 'success', 'deploy': 'failure'}
+    assert sorted(requester.requests) == sorted(PAGES)
+
+
+def test_fetch_once_per_sha(mongo):
+    requester = FakeRequester(PAGES)
+    pull_request = FakePullRequest(requester)
+    CIStatuses().get_test_results(pull_request)
+    del requester.requests[:]
+    CIStatuses().apply_event('repo', {'sha': 'abc', 'context': 'ci', 'state': 'failure',
+                                      'description': 'Flaky', 'updated_at': '2018-01-01T13:00:00Z'})
+    assert CIStatuses().get_test_results(pull_request)['ci'] == 'Flaky'
+    assert not requester.requests  # The stored state is used
+    requester.pages = {'/repo/commits/def/statuses': ([], None), '/repo/commits/def/check-runs': ({}, None)}
+    assert CIStatuses().get_test_results(FakePullRequest(requester, 'def')) == {}
+    assert len(requester.requests) == 2  # A new head is fetched
@@ -0,0 +1,77 @@
+import time
+import threading
+from datetime import datetime
+
+import dateparser
+
+from common import LRUCache, KeyLocks, parse_time, as_local_time, to_epoch, from_epoch, ages
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert 'a' in cache and 'c' in cache and 'b' not in cache
+    assert len(cache) == 2
+    assert cache.pop('a') == 1 and cache.get('a') is None
+
+
+def test_key_locks():
+    locks, events = KeyLocks(), []
+
+    def hold(key, name):
+        with locks.lock(key):
+            events.append(name + '+')
+            time.sleep(0.1)
+            events.append(name + '-')
+    threads = [threading.Thread(target=hold, args=args) for args in (('a', '1'), ('a', '2'), ('b', '3'))]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join()
+    assert events.index('1-') < events.index('2+')  # The same key is serialized
+    assert events.index('3+') < events.index('2-')  # The other keys are not
+    assert not len(locks)
+
+
+TIMESTAMPS = ('2018-01-01T10:00:00Z', '2018-01-01T10:00:00.123Z', '2018-01-01T10:00:00+02:00',
+              '2018-01-01T10:00:00-05:00', '2018-01-01T10:00:00', 'Mon, 01 Jan 2018 10:00:00 GMT')
+
+
+def test_parse_time():
+    for timestamp in TIMESTAMPS:
+        assert parse_time(timestamp) == dateparser.parse(timestamp)
+        assert as_local_time(timestamp, raise_if_native_time=False) == \
+            as_local_time(dateparser.parse(timestamp), raise_if_native_time=False)
+    assert parse_time('January 1st 2018') == datetime(2018, 1, 1)  # Falling back to dateparser
+
+
+def test_epoch():
+    time_obj = datetime(2018, 1, 1, 10, 0, 0, 500000)
+    assert from_epoch(to_epoch(time_obj)) == time_obj
+    assert to_epoch(parse_time('1970-01-01T00:01:00Z')) == 60
+    now = to_epoch(datetime(2018, 1, 3, 12))
+    assert ages([datetime(2018, 1, 1, 10), now - 3600], now) == [
+        {'days': 2, 'hours': 2, 'total_seconds': 180000}, {'days': 0, 'hours': 1, 'total_seconds': 3600}]
+
+
+def test_epoch_naive_times_are_utc(local_timezone):
+    assert to_epoch(datetime(2018, 1, 1, 10)) == to_epoch(parse_time('2018-01-01T10:00:00Z')) == 1514800800
+    assert from_epoch(1514800800) == datetime(2018, 1, 1, 10)
+    assert ages([parse_time('2018-01-01T10:00:00-05:00'), datetime(2018, 1, 1, 15)], 1514818800) == \
+        [{'days': 0, 'hours': 0, 'total_seconds': 0}] * 2
+
+
+def test_parse_time_benchmark():
+    repeats = 10
+    durations = []
+    for parse in (dateparser.parse, parse_time):
+        start = time.time()
+        for _ in range(repeats):
+            for timestamp in TIMESTAMPS:
+                parse(timestamp)
+        durations.append(time.time() - start)
+    assert durations[1] < durations[0]
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from config import config, ConfigSnapshot
+
+
+CONFIG = """github:
+  repos:
+    - org: org
+      repo: repo
+      reviewers:
+        - [alice]
+        - [bob{}]
+  pull_request_title_tag:
+    format: '[{{}}]'
+    pattern: '\\[(\\w+)\\]'
+testing_mode: true
+"""
+
+
+@pytest.fixture
+def tmp_config():
+    directory = tempfile.mkdtemp()
+
+    class TmpConfig(config):
+        DIR = directory
+        CHECK_INTERVAL = 0
+
+    def write(reviewer='', mtime=None):
+        for name, content in (('config.yaml', CONFIG.format(reviewer)), ('credentials.yaml', 'github: {}\n')):
+            path = os.path.join(directory, name)
+            with open(path, 'w') as config_file:
+                config_file.write(content)
+            if mtime:
+                os.utime(path, (mtime, mtime))
+
+    write(mtime=1000)
+    yield TmpConfig, write
+    shutil.rmtree(directory)
+
+
+def test_snapshot(tmp_config):
+    config_class, _ = tmp_config
+    snapshot = config_class().snapshot
+    assert isinstance(snapshot, ConfigSnapshot)
+    assert snapshot.title_tag_pattern.findall('[WIP][RFR] Fix') == ['WIP', 'RFR']
+    assert snapshot.title_tag_format.format('WIP') == '[WIP]'
+    assert snapshot.testing_mode is True
+    assert snapshot.reviewer_levels[('org', 'repo')] == {'alice': 1, 'bob': 2}
+    assert config_class().config.github.repos[0].repo == 'repo'
+    with pytest.raises(TypeError):
+        snapshot.config.github.repos[0]['repo'] = 'other'
+    with pytest.raises(TypeError):
+        snapshot.testing_mode = False
+
+
+def test_reload(tmp_config):
+    config_class, write = tmp_config
+    reloads = []
+    config_class().on_reload(lambda old, new: reloads.append((old, new)))
+    old = config_class().snapshot
+    assert config_class().snapshot is old
+    write(', carol', mtime=2000)
+    new = config_class().snapshot
+    assert new is not old and reloads == [(old, new)]
+    assert new.reviewer_levels[('org', 'repo')] == {'alice': 1, 'bob': 2, 'carol': 2}
+    with open(os.path.join(config_class.DIR, 'config.yaml'), 'w') as config_file:
+        config_file.write('github: [')
+    os.utime(os.path.join(config_class.DIR, 'config.yaml'), (3000, 3000))
+    assert config_class().snapshot is new  # The broken config is skipped
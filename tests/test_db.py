@@ -0,0 +1,75 @@
+from common import Singleton
+from nudgebot.db import db
+
+
+PR_KEY = {'organization': 'org', 'repository': 'repo', 'number': 1}
+
+
+class FakeAction(object):
+    hash = 'action-checksum'
+    class_name = 'FakeAction'
+    properties = {'body': 'hello'}
+
+
+def record(cases_checksum, action_checksum, **pr_key):
+    return dict({'cases_checksum': cases_checksum, 'action': {'checksum': action_checksum}}, **pr_key)
+
+
+def test_add_records(mongo):
+    new_record = mongo.create_record(PR_KEY, [{'days': 1}], 'cases-checksum', FakeAction())
+    mongo.add_records([new_record])
+    mongo.add_records([])
+    stored = mongo.records.find_one({}, {'_id': False})
+    assert stored['action'] == {'checksum': 'action-checksum', 'name': 'FakeAction', 'properties': {'body': 'hello'}}
+    assert stored['cases_properties'] == [{'days': 1}]
+    assert {key: stored[key] for key in PR_KEY} == PR_KEY
+
+
+def test_get_done_actions(mongo):
+    mongo.add_records([record('c1', 'a1', **PR_KEY), record('c2', 'a2', **PR_KEY),
+                       record('c3', 'a3', **dict(PR_KEY, number=2))])
+    assert mongo.get_done_actions(PR_KEY) == {('c1', 'a1'), ('c2', 'a2')}
+    assert mongo.get_done_actions(dict(PR_KEY, repository='other')) == set()
+
+
+def test_claim_legacy_action(mongo_client):
+    mongo_client.db.records.insert_many([record('c1', 'a1'), record('c1', 'a1'), record('c2', 'a2')])
+    mongo = db()
+    assert not mongo.claim_legacy_action(PR_KEY, ('c1', 'a2'))
+    assert mongo.claim_legacy_action(PR_KEY, ('c1', 'a1'))
+    assert mongo.get_done_actions(PR_KEY) == {('c1', 'a1')}
+    assert mongo.records.count({'number': {'$exists': False}}) == 1
+    assert not mongo.claim_legacy_action(PR_KEY, ('c1', 'a1'))  # Found by get_done_actions from now on
+
+
+def test_update_pr_stats_many(mongo):
+    mongo.update_pr_stats(dict(PR_KEY, title='Old'))
+    version = mongo.stats_version
+    mongo.update_pr_stats_many([dict(PR_KEY, title='New'), dict(PR_KEY, number=2, title='Other')])
+    assert sorted((stat['number'], stat['title']) for stat in mongo.pull_request_statistics) == \
+        [(1, 'New'), (2, 'Other')]
+    assert mongo.stats_version == version + 1
+
+
+def test_duplicated_pr_stats_removed(mongo_client):
+    mongo_client.db.pr_stats.insert_many([dict(PR_KEY, title='First'), dict(PR_KEY, title='Duplicate'),
+                                          dict(PR_KEY, number=2, title='Other')])
+    mongo = db()
+    assert sorted((stat['number'], stat['title']) for stat in mongo.pull_request_statistics) == \
+        [(1, 'First'), (2, 'Other')]
+    mongo.update_pr_stats_many([dict(PR_KEY, title='New')])
+    assert mongo.pr_stats.count() == 2
+
+
+def test_migrate_local_epoch_times(mongo_client, local_timezone):
+    # 2018-01-01T10:00:00Z and 2018-07-01T10:00:00Z converted as New York times (EST and EDT)
+    mongo_client.db.metadata.insert_one({'init_time': None})
+    mongo_client.db.pr_stats.insert_one(dict(PR_KEY, age=1514818800, last_update=1530453600,
+                                             review_comment_reaction_statuses=[
+                                                 {'reviewer': 'bob', 'last_comment': {'created_at': 1514818800}}]))
+    mongo = db()
+    stat = mongo.pr_stats.find_one()
+    assert (stat['age'], stat['last_update']) == (1514800800, 1530439200)
+    assert stat['review_comment_reaction_statuses'][0]['last_comment']['created_at'] == 1514800800
+    Singleton._instances.pop(db, None)
+    assert db().pr_stats.find_one()['age'] == 1514800800  # Migrated once
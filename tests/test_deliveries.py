@@ -0,0 +1,71 @@
+import pytest
+
+from common import Singleton
+from nudgebot.deliveries import DeliveryStore, event_fingerprint
+
+
+PULL_REQUEST = {'id': 10, 'number': 1, 'updated_at': '2018-01-01T10:00:00Z'}
+
+
+def event(action, **fields):
+    return dict({'action': action, 'pull_request': PULL_REQUEST}, **fields)
+
+
+@pytest.fixture
+def store(mongo):
+    Singleton._instances.pop(DeliveryStore, None)
+    yield DeliveryStore()
+    Singleton._instances.pop(DeliveryStore, None)
+
+
+def test_fingerprint_subjects():
+    fingerprints = [
+        event_fingerprint(event('review_requested', requested_reviewer={'login': 'a'})),
+        event_fingerprint(event('review_requested', requested_reviewer={'login': 'b'})),
+        event_fingerprint(event('review_requested', requested_team={'slug': 'team'})),
+        event_fingerprint(event('assigned', assignee={'login': 'a'})),
+        event_fingerprint(event('assigned', assignee={'login': 'b'})),
+        event_fingerprint(event('unassigned', assignee={'login': 'a'})),
+        event_fingerprint(event('labeled', label={'name': 'bug'})),
+        event_fingerprint(event('labeled', label={'name': 'docs'}))
+    ]
+    assert len(set(fingerprints)) == len(fingerprints)
+
+
+def test_fingerprint_same_event():
+    # The webhook and the Events API payloads of the same event
+    assert event_fingerprint(event('review_requested', requested_reviewer={'login': 'a', 'id': 1})) == \
+        event_fingerprint(event('review_requested', requested_reviewer={'login': 'a'}, number=1))
+    assert event_fingerprint({'action': 'created'}) is None
+
+
+def test_claim_github_event(store):
+    first = event('review_requested', requested_reviewer={'login': 'a'})
+    assert store.claim_github_event(first, delivery_id='d1')
+    assert not store.claim_github_event(first, event_id='e1')  # The same event from the Events API
+    assert store.claim_github_event(event('review_requested', requested_reviewer={'login': 'b'}), delivery_id='d2')
+    assert not store.claim_github_event(event('review_requested', requested_reviewer={'login': 'c'}),
+                                        delivery_id='d2')
+    assert store.is_delivered(DeliveryStore.event_key('e1'))
+
+
+def test_release_failed_event(store, mongo):
+    first = event('review_requested', requested_reviewer={'login': 'a'})
+    keys = store.claim_github_event(first, delivery_id='d1')
+    store.done(keys, processed=False)
+    assert not mongo.get_delivered_events(keys)
+    keys = store.claim_github_event(first, delivery_id='d1')  # The redelivery
+    assert keys
+    store.done(keys)
+    assert not mongo.delivered_events.count({'pending': True})
+    assert not store.claim_github_event(first, delivery_id='d1')
+
+
+def test_remove_pending_on_startup(store, mongo):
+    first = event('review_requested', requested_reviewer={'login': 'a'})
+    assert store.claim_github_event(first, delivery_id='d1')
+    assert store.claim_github_event(event('labeled', label={'name': 'bug'}), delivery_id='d2')
+    store.done([DeliveryStore.delivery_key('d2')])
+    Singleton._instances.pop(DeliveryStore, None)  # The process was stopped before the event was processed
+    assert DeliveryStore().claim_github_event(first, delivery_id='d1')
+    assert not DeliveryStore().claim_github_event(event('labeled', label={'name': 'bug'}), delivery_id='d2')
@@ -0,0 +1,116 @@
+import zlib
+
+import pytest
+
+from common import Singleton
+from nudgebot.lib.github.diffs import DiffStats, DiffService
+
+
+DIFF = """diff --git a/common.py b/common.py
+index 1111111..2222222 100644
+--- a/common.py
++++ b/common.py
+@@ -1,3 +1,4 @@
++import re
+ import threading
+-from enum import Enum
++from enum import IntEnum
+ from datetime import datetime
+diff --git a/docs/new file.md b/docs/new file.md
+new file mode 100644
+--- /dev/null
++++ b/docs/new file.md
+@@ -0,0 +1,2 @@
++# Title
++--- not a header
+"""
+
+
+def test_diff_stats():
+    stats = DiffStats()
+    for line in DIFF.split('\n'):
+        stats.feed(line)
+    assert stats.json == {
+        'files': 2, 'additions': 4, 'deletions': 1, 'changes': 5,
+        'paths': [{'path': 'common.py', 'additions': 2, 'deletions': 1},
+                  {'path': 'docs/new file.md', 'additions': 2, 'deletions': 0}]
+    }
+
+
+class FakeResponse(object):
+
+    def __init__(self, content):
+        self.content = content
+        self.closed = False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for index in range(0, len(self.content), chunk_size):
+            yield self.content[index:index + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession(object):
+    """Serving the content of the urls"""
+
+    def __init__(self, contents):
+        self.contents = contents
+        self.requests = []
+
+    def get(self, url, headers=None, stream=False, auth=None):
+        self.requests.append((url, headers['Accept'] if headers else None))
+        return FakeResponse(self.contents[url])
+
+
+class FakePullRequest(object):
+    url = '/repo/pulls/1'
+    changed_files, additions, deletions = 7, 100, 20
+
+    def __init__(self, base_sha='base', head_sha='head'):
+        self.base = type('FakeRef', (), {'sha': base_sha})
+        self.head = type('FakeRef', (), {'sha': head_sha})
+
+
+@pytest.fixture
+def service(mongo):
+    Singleton._instances.pop(DiffService, None)
+    service = DiffService()
+    service.CHUNK_SIZE = 16
+    service._local.session = FakeSession({FakePullRequest.url: DIFF})
+    yield service
+    Singleton._instances.pop(DiffService, None)
+
+
+def test_stream(service):
+    service.max_bytes = 40
+    lines = []
+    content, size, truncated = service.stream(FakePullRequest.url, line_callback=lines.append)
+    assert (zlib.decompress(content), size, truncated) == (DIFF[:40], 40, True)
+    assert lines == DIFF[:40].split('\n')[:-1]  # Without the partial line
+    service.max_bytes = len(DIFF)
+    content, size, truncated = service.stream(FakePullRequest.url)
+    assert (zlib.decompress(content), size, truncated) == (DIFF, len(DIFF), False)
+
+
+def test_stats_cache(service, mongo):
+    pull_request = FakePullRequest()
+    stats = service.get_stats(pull_request)
+    assert (stats['files'], stats['changes'], stats['truncated']) == (2, 5, False)
+    assert service.get_stats(pull_request) == stats
+    assert service.get_content(pull_request) == DIFF  # Stored compressed
+    assert service.session.requests == [(FakePullRequest.url, DiffService.KINDS['diff'])]  # Fetched once
+    service.get_stats(FakePullRequest(head_sha='new head'))
+    assert len(service.session.requests) == 2  # Keyed by the base and the head
+    assert mongo.diffs.count() == 2
+
+
+def test_truncated_stats(service):
+    service.max_bytes = 200
+    stats = service.get_stats(FakePullRequest())
+    assert stats['truncated']
+    assert (stats['files'], stats['additions'], stats['deletions'], stats['changes']) == (7, 100, 20, 120)
+    assert [path['path'] for path in stats['paths']] == ['common.py']  # The paths of the streamed part
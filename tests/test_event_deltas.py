@@ -0,0 +1,53 @@
+import github
+
+from nudgebot.lib.github.event_deltas import EventDelta
+from nudgebot.lib.github.pull_request import PullRequest
+from nudgebot.lib.github.pull_request_statistics import PullRequestStatistics
+
+
+PULL_REQUEST = {'number': 1, 'title': '[WIP] Fix', 'body': None, 'updated_at': '2018-01-01T10:00:00Z'}
+
+
+def review(review_id, login, state):
+    return {'id': review_id, 'user': {'login': login}, 'state': state, 'submitted_at': '2018-01-01T10:00:00Z'}
+
+
+def test_parse():
+    assert EventDelta.parse({'action': 'labeled', 'pull_request': PULL_REQUEST}).resources == ()
+    assert EventDelta.parse({'action': 'submitted', 'review': {}, 'pull_request': PULL_REQUEST}).resources == \
+        ('reviews',)
+    assert EventDelta.parse({'action': 'created', 'comment': {}, 'issue': PULL_REQUEST}).resources == \
+        ('issue_comments',)
+    assert EventDelta.parse({'action': 'edited', 'changes': {'title': {}}, 'pull_request': PULL_REQUEST}
+                            ).resources == ('title',)
+    assert EventDelta.parse({'action': 'edited', 'changes': {'base': {}}, 'pull_request': PULL_REQUEST}).refresh
+    assert EventDelta.parse({'action': 'synchronize', 'pull_request': PULL_REQUEST}).refresh
+    assert EventDelta.parse({'sha': 'abc', 'context': 'ci', 'state': 'success'}).resources == ('statuses',)
+
+
+def test_changed_stats():
+    assert not EventDelta.parse({'action': 'labeled', 'pull_request': PULL_REQUEST}).changed_stats
+    assert EventDelta.parse({'action': 'created', 'comment': {}, 'issue': PULL_REQUEST}).changed_stats == \
+        {'issue_comments'}
+    assert 'review_states_by_user' in EventDelta.parse({'action': 'submitted', 'review': {}}).changed_stats
+
+
+def test_get_fields():
+    fields, max_fields = EventDelta.parse({'action': 'labeled', 'pull_request': PULL_REQUEST}).get_fields('repo')
+    assert fields == {'title': '[WIP] Fix', 'title_tags': ['WIP'], 'description': ''}
+    assert max_fields == {'last_update': 1514800800}
+
+
+def test_apply():
+    github_obj = github.PullRequest.PullRequest(None, {}, dict(PULL_REQUEST), completed=True)
+    stats = PullRequestStatistics(PullRequest(None, github_obj))
+    stats['reviews'] = [github.PullRequestReview.PullRequestReview(None, {}, review(1, 'a', 'COMMENTED'), True)]
+    stats['review_states_by_user'] = {}
+    stats['last_update'] = None
+    EventDelta.parse({'action': 'submitted', 'review': review(2, 'b', 'approved'),
+                      'pull_request': dict(PULL_REQUEST, title='[RFR] Fix')}).apply(stats)
+    assert [(r.id, r.state) for r in stats.reviews()] == [(1, 'COMMENTED'), (2, 'APPROVED')]
+    assert 'review_states_by_user' not in stats and 'last_update' not in stats
+    assert stats.title() == '[RFR] Fix'
+    EventDelta.parse({'action': 'dismissed', 'review': review(1, 'a', 'dismissed')}).apply(stats)
+    assert [(r.id, r.state) for r in stats.reviews()] == [(1, 'DISMISSED'), (2, 'APPROVED')]
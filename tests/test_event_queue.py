@@ -0,0 +1,123 @@
+import time
+import threading
+
+import pytest
+
+import nudgebot
+from common import Singleton
+from nudgebot.event_queue import EventQueue
+
+
+class FakeBot(object):
+    """Recording the processed batches of events"""
+
+    def __init__(self, processing_seconds=0):
+        self.processing_seconds = processing_seconds
+        self.batches = []
+        self.running = {}
+        self.overlaps = []
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        return self
+
+    def is_bot_event(self, payload):
+        return payload.get('sender') == 'bot'
+
+    def fetch_pr_number(self, payload):
+        return payload['number']
+
+    def process_github_events(self, payloads):
+        if any(payload.get('fail') for payload in payloads):
+            raise IOError('Github is down')
+        key = payloads[0]['number']
+        with self._lock:
+            if self.running.get(key):
+                self.overlaps.append(key)
+            self.running[key] = True
+        time.sleep(self.processing_seconds)
+        with self._lock:
+            self.running[key] = False
+            self.batches.append((key, [payload['id'] for payload in payloads]))
+
+
+def event(number, event_id, **fields):
+    return dict({'repository': {'name': 'repo'}, 'number': number, 'id': event_id}, **fields)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.fixture
+def make_queue(monkeypatch):
+    def make(window_seconds, max_wait_seconds, processing_seconds=0):
+        bot = FakeBot(processing_seconds)
+        monkeypatch.setattr(nudgebot, 'NudgeBot', bot)
+        Singleton._instances.pop(EventQueue, None)
+        queue = EventQueue()
+        queue.window_seconds, queue.max_wait_seconds = window_seconds, max_wait_seconds
+        queue.start()
+        return queue, bot
+    yield make
+    Singleton._instances.pop(EventQueue, None)
+
+
+def test_coalescing(make_queue):
+    queue, bot = make_queue(0.2, 5)
+    for event_id in range(3):
+        queue.put(event(1, event_id))
+    queue.put(event(2, 3))
+    queue.put(event(1, 4, sender='bot'))
+    assert wait_for(lambda: len(bot.batches) == 2)
+    assert sorted(bot.batches) == [(1, [0, 1, 2]), (2, [3])]
+    assert queue.counters == {'received': 4, 'processed': 2}
+
+
+def test_window_flush(make_queue):
+    queue, bot = make_queue(0.2, 5)
+    queue.put(event(1, 0))
+    time.sleep(0.1)
+    queue.put(event(1, 1))  # Extending the window
+    time.sleep(0.15)
+    assert not bot.batches
+    assert wait_for(lambda: bot.batches)
+    assert bot.batches == [(1, [0, 1])]
+
+
+def test_max_wait_flush(make_queue):
+    queue, bot = make_queue(0.2, 0.5)
+    start = time.time()
+    for event_id in range(10):  # The window is extended all the time
+        queue.put(event(1, event_id))
+        time.sleep(0.1)
+    assert wait_for(lambda: sum(len(ids) for _, ids in bot.batches) == 10)
+    first_batch = bot.batches[0][1]
+    assert first_batch[0] == 0 and len(first_batch) < 10
+    assert time.time() - start < 5
+
+
+def test_per_key_ordering(make_queue):
+    queue, bot = make_queue(0.05, 0.1, processing_seconds=0.3)
+    queue.put(event(1, 0))
+    queue.put(event(2, 1))
+    assert wait_for(lambda: bot.running.get(1))
+    queue.put(event(1, 2))  # Arrives while the pull request is processed
+    queue.put(event(1, 3))
+    assert wait_for(lambda: len(bot.batches) == 3)
+    assert [ids for key, ids in bot.batches if key == 1] == [[0], [2, 3]]
+    assert not bot.overlaps
+
+
+def test_done_callbacks(make_queue):
+    queue, bot = make_queue(0.05, 0.1)
+    done = []
+    queue.put(event(1, 0), on_done=lambda processed: done.append((0, processed)))
+    queue.put(event(1, 1), on_done=lambda processed: done.append((1, processed)))
+    queue.put(event(2, 2, fail=True), on_done=lambda processed: done.append((2, processed)))
+    queue.put(event(3, 3, sender='bot'), on_done=lambda processed: done.append((3, processed)))
+    assert wait_for(lambda: len(done) == 4)
+    assert sorted(done) == [(0, True), (1, True), (2, False), (3, True)]
@@ -0,0 +1,142 @@
+import json
+import time
+from datetime import datetime
+
+import pytest
+
+import nudgebot.events_handler
+from common import Singleton
+from nudgebot.deliveries import DeliveryStore
+from nudgebot.events_handler import EventsFeed, EventsHandler
+
+
+class FakeRequester(object):
+    """Serving the pages of the events feed (with an ETag per page), 304 for the current ETag of the first page"""
+
+    def __init__(self, pages, etag='"1"'):
+        self.pages = pages
+        self.etag = etag
+        self.requests = []
+
+    def requestJson(self, verb, url, headers=None, **kwargs):
+        self.requests.append((url, headers))
+        if url == '/repo/events' and headers and headers.get('If-None-Match') == self.etag:
+            return 304, {'x-poll-interval': '1'}, ''
+        index = 0 if url == '/repo/events' else int(url.split('page=')[1])
+        if index:
+            headers = {'etag': '"page{}"'.format(index), 'x-poll-interval': '60'}
+        else:
+            headers = {'etag': self.etag, 'x-poll-interval': '1'}
+        if index + 1 < len(self.pages):
+            headers['link'] = '</repo/events?page={}>; rel="next", </repo/events?page=9>; rel="last"'.format(
+                index + 1)
+        return 200, headers, json.dumps(self.pages[index])
+
+
+class FakeRepo(object):
+    name = 'repo'
+    full_name = 'org/repo'
+    url = '/repo'
+    owner = type('FakeOwner', (), {'login': 'org'})
+
+    def __init__(self, requester):
+        self._requester = requester
+
+
+def events(*ids):
+    return [{'id': str(event_id)} for event_id in ids]
+
+
+def test_poll_pages(mongo):
+    requester = FakeRequester([events(6, 5), events(4, 3), events(2, 1)])
+    feed = EventsFeed(FakeRepo(requester), '/events', 10, 80)
+    assert [event['id'] for event in feed.poll()] == ['1', '2', '3', '4', '5', '6']
+    assert [url for url, _ in requester.requests] == ['/repo/events', '/repo/events?page=1', '/repo/events?page=2']
+    assert (feed.etag, feed.last_event_id, feed.interval) == ('"1"', 6, 10)  # The ETag of the first page
+    assert feed.poll() == []
+    assert requester.requests[-1] == ('/repo/events', {'If-None-Match': '"1"'})
+
+
+def test_cursor(mongo):
+    requester = FakeRequester([events(2, 1)])
+    feed = EventsFeed(FakeRepo(requester), '/events', 10, 80)
+    feed.poll()
+    assert EventsFeed(FakeRepo(requester), '/events', 10, 80).last_event_id is None  # Not saved yet
+    feed.release(feed.checkpoint())
+    feed = EventsFeed(FakeRepo(requester), '/events', 10, 80)
+    assert (feed.etag, feed.last_event_id) == ('"1"', 2)
+    assert feed.poll() == []  # Not modified
+    assert requester.requests[-1][1] == {'If-None-Match': '"1"'}
+    assert feed.interval == 20
+    requester.pages, requester.etag = [events(5, 4), events(3, 2, 1)], '"2"'
+    start = time.time()
+    assert [event['id'] for event in feed.poll()] == ['3', '4', '5']
+    assert (feed.etag, feed.last_event_id, feed.interval) == ('"2"', 5, 10)
+    assert feed.next_poll - start < 30  # The poll interval hint of the first page (1), not of the last (60)
+
+
+def test_checkpoints(mongo):
+    requester = FakeRequester([events(2, 1)])
+    feed = EventsFeed(FakeRepo(requester), '/events', 10, 80)
+    feed.poll()
+    first = feed.checkpoint()
+    feed.hold(first)  # A queued event
+    feed.release(first)
+    requester.pages, requester.etag = [events(3)], '"2"'
+    feed.poll()
+    feed.release(feed.checkpoint())  # No events
+    assert mongo.get_events_cursor(feed.name) == {'feed': feed.name}  # The event of the first poll is queued
+    feed.release(first)
+    cursor = mongo.get_events_cursor(feed.name)
+    assert (cursor['etag'], cursor['last_event_id']) == ('"2"', 3)
+
+
+def test_max_pages(mongo):
+    requester = FakeRequester([events(index) for index in range(20, 0, -1)])
+    feed = EventsFeed(FakeRepo(requester), '/events', 10, 80)
+    assert len(feed.poll()) == EventsFeed.MAX_PAGES
+    assert feed.last_event_id == 20
+
+
+def test_backoff(mongo):
+    requester = FakeRequester([[]])
+    feed = EventsFeed(FakeRepo(requester), '/events', 10, 30)
+    for interval in (20, 30, 30):
+        feed.poll()
+        assert feed.interval == interval
+
+
+class FakeQueue(object):
+
+    def __init__(self):
+        self.queued = []
+
+    def __call__(self):
+        return self
+
+    def put(self, payload, on_done=None):
+        self.queued.append(on_done)
+
+
+@pytest.fixture
+def queue(mongo, monkeypatch):
+    fake = FakeQueue()
+    monkeypatch.setattr(nudgebot.events_handler, 'EventQueue', fake)
+    Singleton._instances.pop(DeliveryStore, None)
+    yield fake
+    Singleton._instances.pop(DeliveryStore, None)
+
+
+def test_cursor_after_processing(queue, mongo):
+    pages = [[{'id': str(event_id), 'created_at': '2018-01-01T10:00:00Z', 'actor': {'login': 'alice'},
+               'payload': {'action': 'created', 'number': event_id}} for event_id in (2, 1)]]
+    feed = EventsFeed(FakeRepo(FakeRequester(pages)), '/events', 10, 80)
+    mongo.metadata.update_one({}, {'$set': {'init_time': datetime(2017, 1, 1)}})
+    handler = object.__new__(EventsHandler)
+    handler.check_feed(feed)
+    assert len(queue.queued) == 2
+    assert 'last_event_id' not in mongo.get_events_cursor(feed.name)  # The events are still queued
+    queue.queued[0](False)  # The event 1 failed
+    queue.queued[1](True)
+    assert mongo.get_events_cursor(feed.name)['last_event_id'] == 2
+    assert not mongo.get_delivered_events([DeliveryStore.event_key(1)])  # Released for the redelivery
@@ -0,0 +1,121 @@
+import md5
+
+from nudgebot.lib.actions import Action
+from nudgebot.lib.cases import Case
+from nudgebot.lib.flow_plan import FlowPlan
+
+
+class Stats(dict):
+    def number(self):
+        return 1
+
+
+class Flag(Case):
+    STATS = ('flags',)
+    checks = []
+
+    def __init__(self, name, *args, **kwargs):
+        self.name = name
+        super(Flag, self).__init__(*args, **kwargs)
+
+    def check_state(self):
+        self.checks.append(self.name)
+        return self._pr_statistics['flags'].get(self.name)
+
+    def hash_args(self):
+        return (self.name,)
+
+
+class Record(Action):
+
+    def __init__(self, name, **kwargs):
+        self.name = name
+        Action.__init__(self, **kwargs)
+
+    def run(self):
+        self._pr_statistics['flags'][self.name] = True
+
+    @property
+    def hash(self):
+        return self._md5(self.name)
+
+
+def legacy_traversal(pr_stats, tree, fired, checksum=None):
+    """The recursive traversal of the flow that the plan replaces"""
+    checksum = checksum or md5.new()
+    if isinstance(tree, dict):
+        for case, node in tree.items():
+            case.load_pr_statistics(pr_stats)
+            if case.state:
+                checksum.update(case.hash)
+                legacy_traversal(pr_stats, node, fired, checksum)
+    elif isinstance(tree, (list, tuple)):
+        for action in tree:
+            legacy_traversal(pr_stats, action, fired, checksum)
+    else:
+        fired.append((tree.name, checksum.hexdigest()))
+
+
+FLOW = {
+    Flag('a'): {
+        Flag('b', not_case=True): Record('1'),
+        Flag('c'): [Record('2'), Record('3')],
+        Flag('b'): {Flag('c'): Record('4')}
+    },
+    Flag('c'): Record('5'),
+    Flag('d'): {Flag('a'): Record('6')}
+}
+
+
+def evaluate(plan, flags):
+    fired = []
+    plan.evaluate(Stats(flags=flags), lambda action, properties, checksum: fired.append((action.name, checksum)))
+    return fired
+
+
+def test_checksums_match_the_tree_traversal():
+    plan = FlowPlan.compile(FLOW)
+    for flags in ({'a': True, 'c': True}, {'a': True, 'b': True, 'c': True}, {'c': True}, {}):
+        expected = []
+        legacy_traversal(Stats(flags=dict(flags)), FLOW, expected)
+        assert evaluate(plan, dict(flags)) == expected
+
+
+def test_equal_cases_are_checked_once():
+    plan = FlowPlan.compile(FLOW)
+    del Flag.checks[:]
+    evaluate(plan, {'a': True, 'c': True})
+    assert sorted(Flag.checks) == ['a', 'b', 'c', 'd']
+    assert plan.stats == {'flags'}
+    assert sum(calls for _, calls, _ in plan.timings()) > len(Flag.checks)
+
+
+def test_false_case_skips_its_subtree():
+    plan = FlowPlan.compile({Flag('x'): {Flag('y'): Record('1')}})
+    del Flag.checks[:]
+    assert evaluate(plan, {}) == []
+    assert Flag.checks == ['x']
+
+
+def test_results_are_dropped_after_an_action_runs():
+    plan = FlowPlan.compile([{Flag('x', not_case=True): Record('x')}, {Flag('x'): Record('2')}])
+
+    def run_action(action, properties, checksum):
+        action.load_pr_statistics(stats)
+        action.run()
+        fired.append(action.name)
+        return True
+    stats, fired = Stats(flags={}), []
+    plan.evaluate(stats, run_action)
+    assert fired == ['x', '2']
+
+
+def test_copy():
+    plan = FlowPlan.compile(FLOW)
+    copied = plan.copy()
+    assert [node.end for node in copied.nodes] == [node.end for node in plan.nodes]
+    assert all(node.flow_object is not original.flow_object for node, original in zip(copied.nodes, plan.nodes))
+    for flags in ({'a': True, 'c': True}, {'a': True, 'b': True, 'c': True}):
+        assert evaluate(copied, dict(flags)) == evaluate(plan, dict(flags))
+    copied.nodes[0].flow_object.name = 'z'
+    assert plan.nodes[0].flow_object.name != 'z' and plan.nodes[0].flow_object.properties['name'] != 'z'
@@ -0,0 +1,91 @@
+import time
+
+from nudgebot.lib.github.cache import ResponseCache
+
+
+class FakeRequester(object):
+    """Answering 304 to the requests with the current ETag or Last-Modified of the URL"""
+
+    def __init__(self):
+        self.versions = {}  # url -> (etag, last modified, output)
+        self.requests = []
+
+    def requestJson(self, verb, url, parameters=None, headers=None, input=None, cnx=None):
+        headers = headers or {}
+        self.requests.append((url, headers))
+        etag, last_modified, output = self.versions[url]
+        if (etag and headers.get('If-None-Match') == etag or
+                last_modified and headers.get('If-Modified-Since') == last_modified):
+            return 304, {'x-ratelimit-remaining': '4999'}, ''
+        response_headers = {'x-ratelimit-remaining': '4998'}
+        if etag:
+            response_headers['etag'] = etag
+        if last_modified:
+            response_headers['last-modified'] = last_modified
+        return 200, response_headers, output
+
+
+def test_etag_replay(mongo):
+    requester = FakeRequester()
+    cache = ResponseCache(requester)
+    requester.versions['/a'] = ('"1"', None, '{"title": "a"}')
+    assert cache.request_json('GET', '/a') == (200, {'etag': '"1"', 'x-ratelimit-remaining': '4998'},
+                                               '{"title": "a"}')
+    status, headers, output = cache.request_json('GET', '/a')
+    assert (status, output) == (200, '{"title": "a"}')
+    assert headers['x-ratelimit-remaining'] == '4999'
+    assert requester.requests[-1][1] == {'If-None-Match': '"1"'}
+    requester.versions['/a'] = ('"2"', None, '{"title": "b"}')
+    assert cache.request_json('GET', '/a')[2] == '{"title": "b"}'
+    assert cache.counters == {'hits': 0, 'misses': 2, 'not_modified': 1, 'evictions': 0}
+
+
+def test_last_modified_replay(mongo):
+    requester = FakeRequester()
+    cache = ResponseCache(requester)
+    requester.versions['/a'] = (None, 'Mon, 01 Jan 2018 10:00:00 GMT', '[]')
+    cache.request_json('GET', '/a')
+    assert cache.request_json('GET', '/a') == (200, {'last-modified': 'Mon, 01 Jan 2018 10:00:00 GMT',
+                                                     'x-ratelimit-remaining': '4999'}, '[]')
+    assert requester.requests[-1][1] == {'If-Modified-Since': 'Mon, 01 Jan 2018 10:00:00 GMT'}
+    assert cache.counters['not_modified'] == 1
+
+
+def test_max_age(mongo):
+    requester = FakeRequester()
+    cache = ResponseCache(requester, max_age_seconds=0.1)
+    requester.versions['/a'] = ('"1"', None, '{}')
+    for _ in range(3):
+        assert cache.request_json('GET', '/a')[2] == '{}'
+    assert len(requester.requests) == 1  # Served from the cache without a request
+    time.sleep(0.15)
+    cache.request_json('GET', '/a')
+    assert requester.requests[-1][1] == {'If-None-Match': '"1"'}
+    cache.request_json('GET', '/a')  # Validated again by the 304
+    assert cache.counters == {'hits': 3, 'misses': 1, 'not_modified': 1, 'evictions': 0}
+
+
+def test_not_cached(mongo):
+    requester = FakeRequester()
+    cache = ResponseCache(requester)
+    requester.versions['/a'] = ('"1"', None, '{}')
+    cache.request_json('POST', '/a', input={})
+    cache.request_json('GET', '/a', headers={'If-None-Match': '"0"'})
+    assert not mongo.github_cache.count()
+    assert cache.counters == {'hits': 0, 'misses': 0, 'not_modified': 0, 'evictions': 0}
+
+
+def test_eviction(mongo):
+    requester = FakeRequester()
+    cache = ResponseCache(requester, max_entries=3)
+    cache.EVICTION_INTERVAL = 5
+    for index in range(5):
+        requester.versions['/{}'.format(index)] = ('"1"', None, '{}')
+    for url in ('/0', '/1', '/2', '/3', '/0', '/4'):  # /0 is served from the cache, so /1 is the oldest entry
+        cache.request_json('GET', url)
+        time.sleep(0.005)  # The access times are stored in milliseconds
+        if url == '/3':
+            assert mongo.github_cache.count() == 4  # The size is checked periodically
+    assert mongo.github_cache.count() == 3
+    assert sorted(entry['url'] for entry in mongo.github_cache.find()) == ['/0', '/3', '/4']
+    assert cache.counters['evictions'] == 2
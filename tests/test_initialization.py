@@ -0,0 +1,76 @@
+import pytest
+
+import nudgebot
+from nudgebot import NudgeBot
+
+
+class FakeReviewersPool(object):
+
+    def initialize(self):
+        pass
+
+
+class FakePullRequest(object):
+
+    def __init__(self, number):
+        self.number = number
+
+
+class FakeRepo(object):
+    name = 'repo'
+    full_name = 'org/repo'
+    reviewers_pool = FakeReviewersPool()
+
+    def __init__(self, numbers):
+        self.numbers = numbers
+
+    def get_pull_requests(self):
+        return [FakePullRequest(number) for number in self.numbers]
+
+
+class FakeStatistics(object):
+
+    def __init__(self, pull_request):
+        self.pull_request = pull_request
+
+    def get_json(self):
+        return {'organization': 'org', 'repository': 'repo', 'number': self.pull_request.number}
+
+
+@pytest.fixture
+def bot(mongo, monkeypatch):
+    repo = FakeRepo([1, 2, 3])
+    monkeypatch.setattr(nudgebot, 'GithubEnv', lambda: type('FakeGithubEnv', (), {'repos': [repo]}))
+    monkeypatch.setattr(nudgebot, 'PullRequestStatistics', FakeStatistics)
+    bot = object.__new__(NudgeBot)  # Without the mailer and the flow
+    bot.failing, bot.processed = set(), []
+
+    def process(pr_stat):
+        if pr_stat.pull_request.number in bot.failing:
+            raise IOError('Github is down')
+        bot.processed.append(pr_stat.pull_request.number)
+    bot.process = process
+    return bot
+
+
+def test_resume(mongo, bot):
+    bot.failing = {2}
+    bot.initialize()
+    assert not mongo.initialization_done
+    assert sorted(bot.processed) == [1, 3]
+    assert mongo.get_initialized_pull_requests('org/repo') == {1, 3}
+    init_time = mongo.initialization_time
+    bot.failing, bot.processed = set(), []
+    bot.initialize()  # Resuming the interrupted initialization
+    assert bot.processed == [2]
+    assert mongo.initialization_done and mongo.initialization_time == init_time
+    assert sorted(stat['number'] for stat in mongo.pull_request_statistics) == [1, 2, 3]
+
+
+def test_initialize_again(mongo, bot):
+    bot.initialize()
+    assert mongo.initialization_done
+    bot.processed = []
+    bot.initialize()  # A completed initialization starts over
+    assert sorted(bot.processed) == [1, 2, 3]
+    assert mongo.pr_stats.count() == 3
@@ -0,0 +1,86 @@
+import time
+import smtpd
+import asyncore
+import threading
+from email import message_from_string
+
+import pytest
+
+from nudgebot.mailer import Mailer
+
+
+class SMTPSink(smtpd.SMTPServer):
+    """A local SMTP server that collects the messages"""
+
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.messages = []
+        self.connections = 0
+
+    def handle_accept(self):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages.append((rcpttos, message_from_string(data)))
+
+
+def _serve_forever():
+    while True:
+        if asyncore.socket_map:
+            asyncore.loop(timeout=0.05, count=1)
+        else:
+            time.sleep(0.05)
+
+
+@pytest.fixture(scope='module')
+def asyncore_loop():
+    # A single loop thread, since the SMTP channels share the global asyncore map
+    thread = threading.Thread(target=_serve_forever)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+@pytest.fixture
+def sink(asyncore_loop):
+    sink = SMTPSink()
+    yield sink
+    sink.close()
+
+
+def test_send_over_pooled_connection(sink):
+    mailer = Mailer('bot@example.com', smtp_port=sink.port, pool_size=1, workers=1)
+    for i in range(3):
+        mailer.send(['a@example.com', 'b@example.com'], 'subject {}'.format(i), 'body')
+    assert mailer.flush(timeout=10)
+    assert sorted(message['Subject'] for _, message in sink.messages) == ['subject 0', 'subject 1', 'subject 2']
+    assert sink.messages[0][0] == ['a@example.com', 'b@example.com']
+    assert sink.connections == 1
+    mailer.close()
+
+
+def test_digest(sink):
+    mailer = Mailer('bot@example.com', smtp_port=sink.port, digest_window_seconds=60)
+    mailer.send(['a@example.com', 'b@example.com'], 'PR#1 is waiting for response', 'comment 1')
+    mailer.send(['a@example.com', 'b@example.com'], 'PR#1 is waiting for response', 'comment 1', digest=True)
+    mailer.send(['a@example.com'], 'PR#2 is waiting for response', 'comment 2', digest=True)
+    mailer.send(['a@example.com'], 'PR#2 is waiting for response', 'comment 2', digest=True)
+    assert mailer.flush(timeout=10)
+    digests = {tuple(receivers): message for receivers, message in sink.messages}
+    assert len(digests) == 3
+    assert digests[('a@example.com',)]['Subject'] == '2 NudgeBot notifications'
+    assert 'comment 2' in digests[('a@example.com',)].get_payload()[0].get_payload()
+    assert digests[('b@example.com',)]['Subject'] == 'PR#1 is waiting for response'
+    assert mailer.counters['sent'] == 3
+    mailer.close()
+
+
+def test_retry(sink):
+    port = sink.port
+    sink.close()
+    mailer = Mailer('bot@example.com', smtp_port=port, max_attempts=2, retry_delay_seconds=0.1)
+    mailer.send('a@example.com', 'subject', 'body')
+    assert mailer.flush(timeout=10)
+    assert (mailer.counters['retried'], mailer.counters['failed'], mailer.counters['sent']) == (1, 1, 0)
@@ -0,0 +1,139 @@
+import github
+import pytest
+
+from common import LRUCache
+from nudgebot import NudgeBot
+from nudgebot.outbox import ActionOutbox, OutboxBatch, EditTitle, RequestReviewers, CreateComment, Call
+from nudgebot.lib.github.pull_request import PullRequest
+from nudgebot.lib.github.pull_request_statistics import PullRequestStatistics
+
+
+class FakePullRequest(object):
+    number = 1
+
+    def __init__(self):
+        self.calls = []
+
+    def create_issue_comment(self, body):
+        self.calls.append(('comment', body))
+
+    def add_reviewers(self, reviewers):
+        self.calls.append(('reviewers', reviewers))
+        return True
+
+
+class FakeStatistics(object):
+
+    def __init__(self):
+        self.invalidated = []
+
+    def key(self):
+        return {'organization': 'org', 'repository': 'repo', 'number': 1}
+
+    def invalidate(self, *names):
+        self.invalidated.extend(names)
+
+
+class FakeDB(object):
+
+    def __init__(self):
+        self.records = []
+
+    def add_records(self, records):
+        self.records.extend(records)
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr('nudgebot.outbox.db', lambda: fake)
+    return fake
+
+
+def test_merge():
+    pull_request = FakePullRequest()
+    batch = OutboxBatch(FakeStatistics())
+    batch.add([EditTitle(pull_request, '[WIP] Fix'), CreateComment(pull_request, 'a')], 'k1', 'r1')
+    batch.add([EditTitle(pull_request, '[WIP][RFR] Fix'), CreateComment(pull_request, 'b'),
+               RequestReviewers(pull_request, ['x'])], 'k2', 'r2')
+    batch.add([RequestReviewers(pull_request, ['y', 'x']), CreateComment(pull_request, 'a')], 'k3', 'r3')
+    assert [operation.__class__ for operation in batch.operations] == [EditTitle, CreateComment, RequestReviewers]
+    assert batch.operations[0].title == '[WIP][RFR] Fix'
+    assert batch.operations[1].body == 'a\n\nb'
+    assert batch.operations[2].logins == ['x', 'y']
+    assert batch.actions == 3 and batch.done_keys == {'k1', 'k2', 'k3'}
+
+
+def test_no_merge_across_calls():
+    pull_request = FakePullRequest()
+    batch = OutboxBatch(FakeStatistics())
+    batch.add([RequestReviewers(pull_request, ['x'])], 'k1', 'r1')
+    batch.add([Call(pull_request, (), pull_request.calls.append, 'remove x')], 'k2', 'r2')
+    batch.add([RequestReviewers(pull_request, ['x'])], 'k3', 'r3')
+    assert len(batch.operations) == 3
+
+
+def test_records_after_success(fake_db):
+    pull_request, stats = FakePullRequest(), FakeStatistics()
+    failures = [IOError('Github is down')]
+
+    def flaky():
+        if failures:
+            raise failures.pop()
+        pull_request.calls.append('flaky')
+
+    batch = OutboxBatch(stats)
+    batch.add([CreateComment(pull_request, 'a')], 'k1', 'r1')
+    batch.add([Call(pull_request, ('reviews',), flaky)], 'k2', 'r2')
+    with pytest.raises(IOError):
+        batch.execute()
+    assert fake_db.records == ['r1']
+    assert batch.done_keys == {'k2'}
+    batch.execute()
+    assert fake_db.records == ['r1', 'r2']
+    assert pull_request.calls == [('comment', 'a'), 'flaky']  # The comment is not created again
+    assert stats.invalidated == ['issue_comments', 'reviews']
+
+
+def test_outbox_retry(fake_db):
+    outbox = ActionOutbox()
+    outbox.retry_delay_seconds, outbox.max_attempts = 0, 2
+    pull_request, attempts = FakePullRequest(), []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise IOError('Github is down')
+
+    batch = OutboxBatch(FakeStatistics())
+    batch.add([Call(pull_request, (), flaky)], 'k1', 'r1')
+    outbox.submit(batch)
+    assert outbox.flush(timeout=5)
+    assert len(attempts) == 2 and fake_db.records == ['r1']
+    assert not outbox.get_pending(batch.pr_key)
+
+
+def test_preview():
+    github_obj = github.PullRequest.PullRequest(None, {}, {'number': 1, 'title': 'Fix'}, completed=True)
+    pull_request = PullRequest(None, github_obj)
+    stats = PullRequestStatistics(pull_request)
+    stats['reviewer_requests'] = []
+    EditTitle(pull_request, '[WIP] Fix').preview(stats)
+    RequestReviewers(pull_request, ['x']).preview(stats)
+    assert stats.title() == '[WIP] Fix'
+    assert [request.login for request in stats.reviewer_requests()] == ['x']
+
+
+def test_failure_marks_stats_stale(mongo):
+    bot = object.__new__(NudgeBot)  # Without the mailer and the flow
+    bot._pr_statistics = LRUCache(10)
+    mongo.update_pr_stats({'organization': 'org', 'repository': 'repo', 'number': 1, 'title': 'Fix'})
+    repository = type('FakeRepository', (), {'name': 'repo'})
+    event = {'action': 'labeled', 'pull_request': {'number': 1, 'title': '[WIP] Fix', 'body': None,
+                                                   'updated_at': '2018-01-01T10:00:00Z'}}
+    assert bot.apply_event_delta(repository, 1, event) is not None
+    bot._pr_statistics.set(('repo', 1), (0, FakeStatistics()))
+    bot._outbox_failed({'organization': 'org', 'repository': 'repo', 'number': 1})
+    assert ('repo', 1) not in bot._pr_statistics
+    assert mongo.find_pr_stats({'number': 1})[1][0]['stale']
+    assert bot.apply_event_delta(repository, 1, event) is None  # Refreshed from Github
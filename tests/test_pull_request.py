@@ -0,0 +1,112 @@
+from datetime import datetime
+
+from common import parse_time
+from nudgebot.db import db
+from nudgebot.lib.github.pull_request import PullRequest
+
+
+def obj(name, **attributes):
+    return type(name, (), attributes)
+
+
+class FakeRepo(object):
+    """A repository whose commits are a single branch of 'c<index>' shas"""
+    name = 'repo'
+
+    def __init__(self, shas, organization='org'):
+        self.owner = obj('FakeOwner', login=organization)
+        self.shas = shas
+        self.requests = []
+        self.last_modified = 'Mon, 01 Jan 2018 10:00:00 GMT'
+
+    def compare(self, base, head):
+        self.requests.append(('compare', base, head))
+        if base not in self.shas:  # Force pushed
+            return obj('FakeComparison', status='diverged', commits=[], total_commits=0)
+        commits = [obj('FakeCommit', sha=sha) for sha in self.shas[self.shas.index(base) + 1:]]
+        return obj('FakeComparison', status='ahead', commits=commits, total_commits=len(commits))
+
+    def get_commit(self, sha):
+        self.requests.append(('commit', sha))
+        committer = obj('FakeCommitter', date=datetime(2018, 1, 1, 9))
+        return obj('FakeCommit', sha=sha, last_modified=self.last_modified,
+                   commit=obj('FakeGitCommit', committer=committer))
+
+
+class FakePullRequest(object):
+    number = 1
+
+    def __init__(self, repo):
+        self.repo = repo
+
+    @property
+    def head(self):
+        return obj('FakeHead', sha=self.repo.shas[-1])
+
+    def get_commits(self):
+        self.repo.requests.append(('commits',))
+        return [obj('FakeCommit', sha=sha) for sha in self.repo.shas]
+
+
+def pull_request(shas, organization='org'):
+    repo = FakeRepo(shas, organization)
+    return PullRequest(repo, FakePullRequest(repo)), repo
+
+
+def test_commits_record(mongo):
+    pr, repo = pull_request(['c1', 'c2'])
+    assert pr.commits_record == {'organization': 'org', 'repository': 'repo', 'number': 1, 'head_sha': 'c2',
+                                 'commits': ['c1', 'c2'], 'last_modified': 'Mon, 01 Jan 2018 10:00:00 GMT'}
+    assert pr.last_code_update == parse_time('Mon, 01 Jan 2018 10:00:00 GMT')
+    assert repo.requests == [('commits',), ('commit', 'c2')]
+    del repo.requests[:]
+    assert pr.commits_record['head_sha'] == 'c2'
+    assert not repo.requests  # The head sha didn't change
+
+
+def test_commits_record_push(mongo):
+    pr, repo = pull_request(['c1', 'c2'])
+    pr.commits_record
+    repo.shas += ['c3', 'c4']
+    del repo.requests[:]
+    assert pr.commits_record['commits'] == ['c1', 'c2', 'c3', 'c4']
+    assert repo.requests == [('compare', 'c2', 'c4'), ('commit', 'c4')]  # Only the new commits
+    assert mongo.find_pr_number_by_head_sha('org', 'repo', 'c4') == 1
+
+
+def test_commits_record_per_organization(mongo):
+    pr, repo = pull_request(['c1', 'c2'])
+    other_pr, _ = pull_request(['c3'], organization='other')  # A repository with the same name
+    assert pr.commits_record['commits'] == ['c1', 'c2']
+    assert other_pr.commits_record['commits'] == ['c3']
+    del repo.requests[:]
+    assert pr.commits_record['commits'] == ['c1', 'c2']
+    assert not repo.requests
+    assert mongo.find_pr_number_by_head_sha('other', 'repo', 'c2') is None
+
+
+def test_migrate_commits_records(mongo_client):
+    mongo_client.db.pr_commits.create_index([('repository', 1), ('number', 1)], unique=True)
+    mongo_client.db.pr_commits.create_index([('repository', 1), ('head_sha', 1)])
+    mongo_client.db.pr_commits.insert_one({'repository': 'repo', 'number': 1, 'head_sha': 'c1', 'commits': ['c1']})
+    pr, _ = pull_request(['c1'], organization='other')
+    assert pr.commits_record['organization'] == 'other'  # Refetched
+    assert db().pr_commits.count() == 1
+
+
+def test_commits_record_force_push(mongo):
+    pr, repo = pull_request(['c1', 'c2'])
+    pr.commits_record
+    repo.shas[:] = ['c1', 'c5']
+    del repo.requests[:]
+    assert pr.commits_record['commits'] == ['c1', 'c5']
+    assert repo.requests == [('compare', 'c2', 'c5'), ('commits',), ('commit', 'c5')]
+
+
+def test_commits_record_without_last_modified(mongo):
+    pr, repo = pull_request(['c1'])
+    repo.last_modified = None
+    assert pr.last_code_update == datetime(2018, 1, 1, 9)  # The committer date
+    mongo.set_pr_commits(dict(pr.commits_record, last_modified=None))  # A record stored before the fallback
+    repo.last_modified = 'Mon, 01 Jan 2018 10:00:00 GMT'
+    assert pr.commits_record['last_modified'] == 'Mon, 01 Jan 2018 10:00:00 GMT'
@@ -0,0 +1,31 @@
+from nudgebot.reports.periodic_reports import DailyStatusReport
+
+
+def stat(number, repository='repo', **fields):
+    return dict({'organization': 'org', 'repository': repository, 'number': number, 'owner': 'alice',
+                 'title_tags': [], 'reviewers': [], 'total_review_comments': 0}, **fields)
+
+
+def test_collect_data(mongo):
+    mongo.update_pr_stats_many([
+        stat(1, title_tags=['WIP'], reviewers=['bob'], total_review_comments=12),
+        stat(2, title_tags=['RFR', 'Bug'], reviewers=['bob', 'carol'], total_review_comments=3),
+        stat(3, repository='other', title_tags=['RFR'], reviewers=['bob'], total_review_comments=20)
+    ])
+    mongo.update_reviewers([
+        mongo.set_reviewer_level('org', 'repo', 'bob', 1), mongo.set_reviewer_level('org', 'repo', 'carol', 1),
+        mongo.set_reviewer_level('org', 'other', 'bob', 1),
+        mongo.attach_pr_to_reviewer('org', 'repo', 'bob', 1), mongo.attach_pr_to_reviewer('org', 'repo', 'bob', 2),
+        mongo.attach_pr_to_reviewer('org', 'repo', 'carol', 2), mongo.attach_pr_to_reviewer('org', 'other', 'bob', 3)
+    ])
+    data = DailyStatusReport().collect_data()
+    assert data['repositories'] == ['other', 'repo']
+    assert data['stats_by_repository']['repo']['count'] == 2
+    assert data['stats_by_repository']['repo']['total_review_comments'] == 15
+    assert {tag: [pr['number'] for pr in prs] for tag, prs in data['stats_by_tag'].items()} == \
+        {'RFR': [2, 3], 'WIPTEST': [], 'WIP': [1]}
+    assert data['stats_by_reviewer']['bob']['count'] == 3
+    assert [pr['number'] for pr in data['commented_stats']] == [3, 1]
+    # A reviewer of several repositories is listed once
+    assert data['reviewers_pool_items'] == [('carol', {'pull_requests': 1, 'load': 1}),
+                                            ('bob', {'pull_requests': 3, 'load': 3})]
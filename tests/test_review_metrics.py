@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from nudgebot.review_metrics import ReviewMetrics
+
+
+PULL_REQUEST = {'number': 5, 'user': {'login': 'owner'}, 'created_at': '2018-01-01T10:00:00',
+                'updated_at': '2018-01-01T11:00:00'}
+
+
+def test_get_bucket():
+    time = datetime(2018, 1, 2, 10, 35, 12)
+    assert ReviewMetrics.get_bucket(time, 'hourly') == datetime(2018, 1, 2, 10)
+    assert ReviewMetrics.get_bucket(time, 'daily') == datetime(2018, 1, 2)
+
+
+def test_parse_event():
+    review = ReviewMetrics.parse_event({
+        'action': 'submitted', 'pull_request': PULL_REQUEST,
+        'review': {'user': {'login': 'reviewer'}, 'state': 'APPROVED', 'submitted_at': '2018-01-01T12:00:00'}})
+    assert (review['activity'], review['actor'], review['state']) == ('review', 'reviewer', 'approved')
+    assert review['time'] == datetime(2018, 1, 1, 12)
+    assert review['created_at'] == datetime(2018, 1, 1, 10)
+    comment = ReviewMetrics.parse_event({
+        'action': 'created', 'issue': dict(PULL_REQUEST, pull_request={}),
+        'comment': {'user': {'login': 'owner'}, 'created_at': '2018-01-01T13:00:00'}})
+    assert (comment['activity'], comment['actor'], comment['owner']) == ('comment', 'owner', 'owner')
+    assert ReviewMetrics.parse_event({'action': 'created', 'issue': {'number': 1},
+                                      'comment': {'user': {'login': 'owner'}}}) is None
+    assert ReviewMetrics.parse_event({'action': 'labeled', 'number': 5, 'pull_request': PULL_REQUEST}) is None
+
+
+def test_record_without_counters(mongo, monkeypatch):
+    updates = []
+    monkeypatch.setattr(mongo, 'update_review_metrics', updates.extend)
+    comment = {'action': 'created', 'issue': dict(PULL_REQUEST, pull_request={}),
+               'comment': {'user': {'login': 'owner'}, 'created_at': '2018-01-01T13:00:00'}}
+    ReviewMetrics().record('repo', comment)  # The first comment of the owner is not a round trip
+    assert updates == []
+    review = {'action': 'submitted', 'pull_request': PULL_REQUEST,
+              'review': {'user': {'login': 'reviewer'}, 'state': 'COMMENTED', 'submitted_at': '2018-01-01T12:00:00'}}
+    ReviewMetrics().record('repo', review)
+    ReviewMetrics().record('repo', comment)
+    assert len(updates) == 6 and all(update._doc.get('$inc') for update in updates)
@@ -0,0 +1,98 @@
+import random
+import time
+
+import pytest
+
+from nudgebot.lib.github.reviewer_scheduler import (IndexedHeap, ReviewerScheduler, WeightedRoundRobinPolicy,
+                                                    NoAvailableReviewerError)
+
+
+def test_indexed_heap():
+    heap = IndexedHeap()
+    priorities = {item: random.random() for item in range(200)}
+    for item, priority in priorities.items():
+        heap.push(item, priority)
+    for item in range(0, 200, 3):
+        priorities[item] = random.random()
+        heap.push(item, priorities[item])
+    for item in range(1, 200, 7):
+        heap.remove(item)
+        del priorities[item]
+    assert [heap.pop() for _ in range(len(heap))] == sorted(priorities, key=priorities.get)
+
+
+def test_least_loaded_scheduling():
+    scheduler = ReviewerScheduler(capacity=3)
+    for login in ('a', 'b', 'c'):
+        scheduler.add_reviewer(login, level=1)
+    scheduler.add_reviewer('d', level=2)
+    scheduler.attach('a', 1, weight=2)
+    assert scheduler.assign(1, 10) == 'b'
+    assert scheduler.assign(1, 11) == 'c'  # Tie between b and c is broken by the least recently assigned
+    assert scheduler.assign(1, 12, exclude=('b',)) == 'c'
+    scheduler.attach('a', 2)  # a reaches its capacity
+    assert scheduler.pick(1) == 'b'
+    scheduler.detach('a', 1)
+    assert scheduler.pick(1) == 'a'
+    with pytest.raises(NoAvailableReviewerError):
+        scheduler.pick(2, exclude=('d',))
+    with pytest.raises(NoAvailableReviewerError):
+        scheduler.pick(3)
+
+
+def test_level_change_at_capacity():
+    scheduler = ReviewerScheduler(capacity=1)
+    scheduler.add_reviewer('a', 1)
+    scheduler.attach('a', 1)
+    scheduler.add_reviewer('a', 2)  # Out of the level 1 queue
+    assert scheduler.get('a').level == 2
+    scheduler.detach('a', 1)
+    assert scheduler.pick(2) == 'a'
+    with pytest.raises(NoAvailableReviewerError):
+        scheduler.pick(1)
+
+
+def test_weighted_round_robin_scheduling():
+    scheduler = ReviewerScheduler(WeightedRoundRobinPolicy())
+    scheduler.add_reviewer('a', level=1, weight=2)
+    scheduler.add_reviewer('b', level=1)
+    picks = [scheduler.assign(1, number) for number in range(30)]
+    assert picks.count('a') == 20 and picks.count('b') == 10
+
+
+def test_scheduler_distribution():
+    repos, reviewers, assignments = 20, 5000, 20000
+    random.seed(0)
+    schedulers = [ReviewerScheduler() for _ in range(repos)]
+    logins = ['reviewer{}'.format(index) for index in range(reviewers / repos)]
+    for scheduler in schedulers:
+        for index, login in enumerate(logins):
+            scheduler.add_reviewer(login, level=index % 2 + 1)
+    for number in range(assignments):
+        schedulers[number % repos].assign(number / repos % 2 + 1, number, weight=random.choice((1, 1.5, 3)),
+                                          exclude=('reviewer0', 'reviewer1'))
+    for scheduler in schedulers:
+        assert scheduler.get('reviewer0').load == scheduler.get('reviewer1').load == 0
+        for level in (1, 2):
+            loads = [scheduler.get(login).load for index, login in enumerate(logins[2:], 2) if index % 2 + 1 == level]
+            assert max(loads) - min(loads) <= 3  # Balanced up to the weight of a single pull request
+            assert sum(scheduler.get(login).assigned for index, login in enumerate(logins)
+                       if index % 2 + 1 == level) == assignments / repos / 2
+
+
+def test_pick_benchmark():
+    """The pick cost grows with the log of the pool size, not with the pool size"""
+    def pick_seconds(reviewers, repeats=2000):
+        scheduler = ReviewerScheduler()
+        for index in range(reviewers):
+            scheduler.add_reviewer('reviewer{}'.format(index), level=1)
+            scheduler.attach('reviewer{}'.format(index), index, weight=index % 7 + 1)
+        exclude = ('reviewer0', 'reviewer7', 'reviewer14')  # The owner and the current reviewers, least loaded
+        durations = []
+        for _ in range(3):
+            start = time.time()
+            for _ in range(repeats):
+                assert scheduler.pick(1, exclude) not in exclude
+            durations.append(time.time() - start)
+        return min(durations)
+    assert pick_seconds(5000) < pick_seconds(500) * 5  # A linear pick would be 10 times slower
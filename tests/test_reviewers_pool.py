@@ -0,0 +1,76 @@
+import sys
+
+import pytest
+
+from config import config
+from nudgebot.db import db
+from nudgebot.lib.github.reviewers_pool import ReviewersPool
+
+
+class FakeConfig(object):
+    """The config with the reviewer levels of the test repositories"""
+
+    def __init__(self, reviewer_levels):
+        self.config = config().config
+        self.snapshot = type('FakeSnapshot', (), {'reviewer_levels': reviewer_levels})
+
+
+class FakeRepository(object):
+
+    def __init__(self, organization, name):
+        self.owner = type('FakeOwner', (), {'login': organization})
+        self.name = name
+
+
+@pytest.fixture
+def legacy_pool(mongo_client, monkeypatch):
+    monkeypatch.setattr(sys.modules['nudgebot.db'], 'config', lambda: FakeConfig({
+        ('org', 'repo'): {'alice': 1, 'bob': 2},
+        ('org', 'other'): {'alice': 2}
+    }))
+    mongo_client.db.reviewers_pool.insert_one({
+        'alice': {'level': 1, 'pull_requests': [1, 2, 7]},
+        'bob': {'level': 2, 'pull_requests': []}
+    })
+    mongo_client.db.pr_stats.insert_many([{'organization': 'org', 'repository': 'repo', 'number': number}
+                                          for number in (1, 2)] +
+                                         [{'organization': 'org', 'repository': 'other', 'number': 7}])
+
+
+def test_migrate_legacy_pool(legacy_pool):
+    reviewers = {(doc['repository'], doc['login']): doc for doc in db().get_reviewers_pool()}
+    assert reviewers == {
+        ('repo', 'alice'): {'organization': 'org', 'repository': 'repo', 'login': 'alice', 'level': 1,
+                            'pull_requests': [1, 2], 'load': 2},
+        ('repo', 'bob'): {'organization': 'org', 'repository': 'repo', 'login': 'bob', 'level': 2,
+                          'pull_requests': [], 'load': 0},
+        ('other', 'alice'): {'organization': 'org', 'repository': 'other', 'login': 'alice', 'level': 2,
+                             'pull_requests': [7], 'load': 1}
+    }
+    assert db().reviewers_pool.count() == 3
+
+
+def test_upgraded_pool(legacy_pool):
+    pool = ReviewersPool(FakeRepository('org', 'repo'))
+    assert sorted(pool.reviewers) == ['alice', 'bob']
+    assert pool.get_level('bob') == 2
+    assert pool.pool['alice']['pull_requests'] == [1, 2]
+    pull_request = type('FakePullRequest', (), {'number': 3, 'reviewers': [],
+                                                'owner': type('FakeOwner', (), {'login': 'carol'})})
+    assert pool.pull_reviewer(1, pull_request)._github_obj == 'alice'  # The login, without fetching the user
+    pool.flush()
+    reviewer = db().reviewers_pool.find_one({'organization': 'org', 'repository': 'repo', 'login': 'alice'})
+    assert reviewer['pull_requests'] == [1, 2, 3]
+    assert not ReviewersPool(FakeRepository('fork', 'repo')).reviewers  # A repository with the same name
+
+
+def test_migrate_full_name_keys(mongo_client):
+    mongo_client.db.reviewers_pool.create_index([('repository', 1), ('login', 1)], unique=True)
+    mongo_client.db.reviewers_pool.create_index([('repository', 1), ('level', 1), ('load', 1)])
+    mongo_client.db.reviewers_pool.insert_many([
+        {'repository': 'org/repo', 'login': 'alice', 'level': 1, 'pull_requests': [1], 'load': 1},
+        {'repository': 'fork/repo', 'login': 'alice', 'level': 2, 'pull_requests': [], 'load': 0}
+    ])
+    assert ReviewersPool(FakeRepository('org', 'repo')).pool == {'alice': {'level': 1, 'pull_requests': [1]}}
+    assert ReviewersPool(FakeRepository('fork', 'repo')).get_level('alice') == 2
+    assert 'repository_1_login_1' not in db().reviewers_pool.index_information()
@@ -0,0 +1,43 @@
+import re
+import time
+
+from nudgebot.lib.actions import CreateIssueComment, ReportForInactivity
+from nudgebot.lib.cases import PullRequestHasTitleTag, InactivityForPeriod, DescriptionInclude
+from nudgebot.simulation import PullRequestSnapshot, simulate_flow
+
+
+def snapshot(number, title_tags, description='', days_inactive=0):
+    now = time.time()
+    return {'organization': 'org', 'repository': 'repo', 'number': number, 'title': 'Fix', 'owner': 'user',
+            'description': description, 'age': now - 30 * 86400, 'last_update': now - days_inactive * 86400,
+            'title_tags': title_tags, 'reviewers': ['reviewer'], 'review_states_by_user': {'reviewer': 'APPROVED'},
+            'review_comment_reaction_statuses': [
+                {'reviewer': 'reviewer', 'last_comment': {'login': 'reviewer', 'created_at': now - 3 * 86400}}]}
+
+
+FLOW = {
+    PullRequestHasTitleTag('RFR'): {
+        DescriptionInclude(re.compile('.'), not_case=True): CreateIssueComment('Please add a description')
+    },
+    InactivityForPeriod(3, 0): ReportForInactivity()
+}
+
+
+def test_snapshot_stats():
+    stats = PullRequestSnapshot(snapshot(1, ['RFR']))
+    assert [tag.name for tag in stats.title_tags()] == ['RFR']
+    assert stats.reviewers() == ['reviewer']
+    assert stats.review_states_by_user().values() == ['APPROVED']
+    assert 3 * 86400 - 60 < stats.review_comment_reaction_statuses()[0]['age_seconds'] < 3 * 86400 + 60
+    assert stats.repo().name == 'repo'
+
+
+def test_simulate_flow():
+    snapshots = [snapshot(1, ['RFR']), snapshot(2, ['RFR'], 'Described'), snapshot(3, ['WIP'], days_inactive=5)]
+    result = simulate_flow(FLOW, snapshots * 20, processes=2, chunk_size=7)
+    assert not result['errors']
+    assert result['pull_requests'] == 60
+    fired = set((key[1], name) for key, name, _ in result['fired'])
+    assert fired == {(1, 'CreateIssueComment'), (3, 'ReportForInactivity')}
+    hits = sorted(hits for _, hits in result['case_hits'])
+    assert hits == [20, 20, 40]
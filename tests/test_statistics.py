@@ -1,5 +1,6 @@
 from datetime import datetime
 import time
+import threading
 
 from nudgebot.lib.statistics import Statistics, stat_property
 
@@ -27,3 +28,78 @@ def test_statistics():
     for _ in range(3):
         print(T.first_call())
         time.sleep(1)
+
+
+def test_statistics_prefetch():
+    started = {'first': threading.Event(), 'second': threading.Event()}
+    overlapped = []
+
+    class Fetches(Statistics):
+        # Each fetch waits for the other one to start, so they complete only if they overlap
+
+        @stat_property
+        def first(self):
+            started['first'].set()
+            overlapped.append(started['second'].wait(5))
+            return 1
+
+        @stat_property
+        def second(self):
+            started['second'].set()
+            overlapped.append(started['first'].wait(5))
+            return 2
+
+    S = Fetches()
+    timings = S.prefetch(('first', 'second'))
+    assert overlapped == [True, True]
+    assert sorted(timings) == ['first', 'second']
+    assert (S.first(), S.second()) == (1, 2)
+    assert S.prefetch(('first', 'second')) == {}
+
+
+def test_statistics_invalidate_dependents():
+
+    class Calls(Statistics):
+        calls = []
+
+        @stat_property(resources=('title',))
+        def title(self):
+            self.calls.append('title')
+            return 'title'
+
+        @stat_property(depends_on=('title',))
+        def title_length(self):
+            self.calls.append('title_length')
+            return len(self.title())
+
+        @stat_property(resources=('reviews',))
+        def reviews(self):
+            self.calls.append('reviews')
+            return []
+
+    C = Calls()
+    assert (C.title_length(), C.reviews()) == (5, [])
+    C.invalidate('title')
+    assert 'title' not in C and 'title_length' not in C and 'reviews' in C
+    assert (C.title_length(), C.reviews()) == (5, [])
+    assert Calls.calls == ['title_length', 'title', 'reviews', 'title_length', 'title']
+    C.title.uncache()
+    assert 'title_length' not in C
+
+
+def test_statistics_per_instance():
+
+    class Number(Statistics):
+        def __init__(self, number):
+            super(Number, self).__init__()
+            self._number = number
+
+        @stat_property
+        def number(self):
+            return self._number
+
+    first, second = Number(1), Number(2)
+    first_number, second_number = first.number, second.number
+    assert (first_number(), second_number()) == (1, 2)
+    first.uncache_all()
+    assert first._number == 1 and 'number' not in first and 'number' in second